@@ -0,0 +1,286 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+
+# numpy and treeswift are imported by the prepare step only: a child inherits the
+# peak RSS of the process it is forked from, so the driver has to stay small
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.dirname(SCRIPTS_DIR)
+
+# taxa and loci of every scale; SR21 uses the shipped gene trees, the others are simulated once
+SCALES = {
+    "SR21": {"taxa": 21, "loci": 2000},
+    "SR201": {"taxa": 201, "loci": 2000},
+    "large": {"taxa": 1000, "loci": 100000},
+}
+
+STUB_ASTRAL = f"""#!{sys.executable}
+# benchmark stand-in for astral4_coalescent_unit: the -c tree with unit CU branch lengths
+import sys
+import treeswift as ts
+argv = sys.argv[1:]
+args = {{flag: argv[argv.index(flag) + 1] for flag in ("-c", "-o")}}
+with open(args["-c"]) as f:
+    tree = ts.read_tree_newick(f.read().strip().split("\\n")[0])
+for nd in tree.traverse_postorder():
+    if not nd.is_root():
+        nd.set_edge_length(1.0)
+tree.write_tree_newick(args["-o"])
+"""
+
+
+def random_species_tree(num_taxa, rng):
+    import treeswift as ts
+
+    nodes = [ts.Node(label=f"T{i}") for i in range(num_taxa)]
+    while len(nodes) > 1:
+        a, b = (nodes.pop(rng.randrange(len(nodes))) for _ in range(2))
+        parent = ts.Node()
+        for c in (a, b):
+            c.set_edge_length(rng.expovariate(1.0))
+            parent.add_child(c)
+        nodes.append(parent)
+    tree = ts.Tree()
+    tree.root = nodes[0]
+    return tree
+
+
+def unit_lengths(tree):
+    for nd in tree.traverse_postorder():
+        if not nd.is_root():
+            nd.set_edge_length(1.0)
+    return tree
+
+
+def write_gene_trees(species_tree, num_genes, seed, output_file):
+    import numpy as np
+    from coalescent_sim import simulate_newick
+
+    with open(output_file, "w") as f:
+        for gt in simulate_newick(species_tree, num_genes, np.random.default_rng(seed)):
+            f.write(f"{gt}\n")
+
+
+def scale_loci(scale, loci=None):
+    # the shipped SR21 gene trees have a fixed number of loci
+    return SCALES[scale]["loci"] if loci is None or scale == "SR21" else loci
+
+
+def scale_inputs(scale, work_dir, loci=None):
+    scale_dir = os.path.join(work_dir, f"{scale}-{scale_loci(scale, loci)}")
+    return {
+        "species_tree": os.path.join(scale_dir, "species.tree"),
+        "gene_trees": os.path.join(scale_dir, "default.gtrees"),
+        "discordant_gene_trees": os.path.join(scale_dir, "discordant.gtrees"),
+        "event_dir": os.path.join(scale_dir, "event"),
+    }
+
+
+def prepare_inputs(scale, work_dir, seed, loci=None):
+    """Species tree, two gene tree files and an event directory of one scale, made once per work dir."""
+    import treeswift as ts
+
+    inputs = scale_inputs(scale, work_dir, loci)
+    scale_dir = os.path.dirname(inputs["species_tree"])
+    if os.path.exists(os.path.join(scale_dir, "done")):
+        return
+    os.makedirs(scale_dir, exist_ok=True)
+    num_loci = scale_loci(scale, loci)
+    if scale == "SR21":
+        gene_dir = os.path.join(DATA_DIR, "gene_trees", "SR21_1_ind")
+        shutil.copyfile(os.path.join(gene_dir, "1_1X_S21_1e6_1.1.gtrees"), inputs["gene_trees"])
+        shutil.copyfile(os.path.join(gene_dir, "2_1X_S21_1e6_1.1.gtrees"), inputs["discordant_gene_trees"])
+        shutil.copyfile(
+            os.path.join(DATA_DIR, "species_trees", "estimated", "SR21_1_ind", "1_1X_S21_1e6_1.1.caster-pair"),
+            inputs["species_tree"],
+        )
+    else:
+        if scale == "SR201":
+            with open(os.path.join(DATA_DIR, "species_trees", "estimated", "SR201_default_condition", "1_1X_S201_0_haploid.caster-pair")) as f:
+                species_tree = unit_lengths(ts.read_tree_newick(f.read().strip().split("\n")[0]))
+        else:
+            species_tree = random_species_tree(SCALES[scale]["taxa"], random.Random(seed))
+        species_tree.write_tree_newick(inputs["species_tree"])
+        write_gene_trees(species_tree, num_loci, seed, inputs["gene_trees"])
+        write_gene_trees(species_tree, num_loci, seed + 1, inputs["discordant_gene_trees"])
+
+    # an event with a prediction file for compute_metrics
+    subprocess.run(
+        [
+            sys.executable, "simulate_mixture_condition.py", "-x", inputs["gene_trees"],
+            "-y", inputs["discordant_gene_trees"], "-p", "0.1", "-r", "0.8",
+            "-o", inputs["event_dir"], "--seed", str(seed), "--overlay",
+        ],
+        cwd=SCRIPTS_DIR,
+        check=True,
+    )
+    with open(os.path.join(inputs["event_dir"], "phlag.txt"), "w") as f:
+        f.write(",".join(["0"] * num_loci) + "\n")
+    open(os.path.join(scale_dir, "done"), "w").close()
+
+
+def benchmarks(scale, inputs, out_dir, seed, loci=None):
+    """(name, command) of every benchmark of one scale."""
+    with open(inputs["species_tree"]) as f:
+        species_newick = f.read().strip().split("\n")[0]
+    taxa = sorted(re.findall(r"[(,]([^(),:;\[\]]+)", species_newick))
+    py = sys.executable
+    num_loci = str(scale_loci(scale, loci))
+    cmds = [
+        ("qqs", [py, "compute_qqs.py", "-s", inputs["species_tree"], "-g", inputs["gene_trees"], "-o", os.path.join(out_dir, "qqs.tsv")]),
+        ("simulate_gene_trees-numpy", [py, "simulate_gene_trees.py", "-i", inputs["species_tree"], "-g", inputs["gene_trees"], "-o", os.path.join(out_dir, "sim-numpy"), "-n", num_loci, "-t", "1", "-s", str(seed), "--engine", "numpy"]),
+        ("mixture", [py, "simulate_mixture_condition.py", "-x", inputs["gene_trees"], "-y", inputs["discordant_gene_trees"], "-p", "0.1", "-r", "0.8", "-o", os.path.join(out_dir, "mixture"), "--seed", str(seed)]),
+        ("introgression", [py, "simulate_introgression.py", "-s", inputs["species_tree"], "-g", inputs["gene_trees"], "-p", "0.1", "-r", taxa[0], "-d", taxa[1], "-o", os.path.join(out_dir, "introgression"), "--seed", str(seed)]),
+        ("sort_triplets", [py, "sort_triplets_ultrametricity.py", species_newick]),
+        ("compute_metrics", [py, "compute_metrics.py", "-x", os.path.join(inputs["event_dir"], "phlag.txt"), "-y", os.path.join(inputs["event_dir"], "info.txt"), "--method", "phlag"]),
+    ]
+    for option in ("fixed", "random", "support"):
+        cmds.append((f"recombination-{option}", [py, "simulate_recombination_supression.py", "-g", inputs["gene_trees"], "-p", "0.1", "-r", "0.8", "--option", option, "-o", os.path.join(out_dir, f"recombination-{option}"), "--seed", str(seed)]))
+    if scale != "large":
+        # the dendropy simulator takes hours at the large scale
+        cmds.append(("simulate_gene_trees-dendropy", [py, "simulate_gene_trees.py", "-i", inputs["species_tree"], "-g", inputs["gene_trees"], "-o", os.path.join(out_dir, "sim-dendropy"), "-n", num_loci, "-t", "1", "-s", str(seed)]))
+    return cmds
+
+
+def measure(cmd, env, log_file):
+    """Wall time, CPU time and peak RSS (KB, with its descendants) of one command, via wait4."""
+    with open(log_file, "w") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=SCRIPTS_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def run(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="qqs-bench-")
+    stub_dir = os.path.join(work_dir, "bin")
+    os.makedirs(stub_dir, exist_ok=True)
+    stub = os.path.join(stub_dir, "astral4_coalescent_unit")
+    with open(stub, "w") as f:
+        f.write(STUB_ASTRAL)
+    os.chmod(stub, 0o755)
+    env = dict(os.environ, PATH=stub_dir + os.pathsep + os.environ.get("PATH", ""))
+    env.pop("CU_CACHE_DIR", None)
+    env.pop("QQS_MEMO_DIR", None)
+
+    results = []
+    for scale in args.scales:
+        prepare = [sys.executable, os.path.abspath(__file__), "prepare", scale, work_dir, "-s", str(args.seed)]
+        subprocess.run(prepare + (["--loci", str(args.loci)] if args.loci else []), check=True)
+        inputs = scale_inputs(scale, work_dir, args.loci)
+        scale_dir = os.path.dirname(inputs["species_tree"])
+        out_dir = os.path.join(scale_dir, "out")
+        for name, cmd in benchmarks(scale, inputs, out_dir, args.seed, args.loci):
+            if args.only and name not in args.only:
+                continue
+            runs = []
+            for r in range(args.repeat):
+                shutil.rmtree(out_dir, ignore_errors=True)
+                os.makedirs(out_dir)
+                runs.append(measure(cmd, env, os.path.join(scale_dir, f"{name}.log")))
+            ok = all(rc == 0 for rc, _, _, _ in runs)
+            walls = [w for _, w, _, _ in runs]
+            results.append(
+                {
+                    "name": name,
+                    "scale": scale,
+                    "loci": scale_loci(scale, args.loci),
+                    "ok": ok,
+                    "wall": walls,
+                    "wall_min": min(walls),
+                    "cpu": [c for _, _, c, _ in runs],
+                    "max_rss_kb": max(m for _, _, _, m in runs),
+                }
+            )
+            print(f"{scale}\t{name}\t{'ok' if ok else 'FAILED'}\t{min(walls):.3f}s\t{results[-1]['max_rss_kb']} KB", file=sys.stderr)
+
+    record = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    os.makedirs(args.results_dir, exist_ok=True)
+    output = os.path.join(args.results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{(record['commit'] or 'nogit')[:10]}.json")
+    with open(output, "w") as f:
+        json.dump(record, f, indent=1)
+    print(output)
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {(r["scale"], r["loci"], r["name"]): r for r in json.load(f)["results"]}
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    regressed = False
+    print("scale\tname\tbaseline_s\tcurrent_s\tratio\tbaseline_rss_kb\tcurrent_rss_kb")
+    for r in current:
+        b = baseline.get((r["scale"], r["loci"], r["name"]))
+        if b is None:
+            continue
+        ratio = r["wall_min"] / b["wall_min"] if b["wall_min"] else float("nan")
+        flag = "\tREGRESSION" if ratio > 1 + args.threshold else ""
+        regressed |= bool(flag)
+        print(f"{r['scale']}\t{r['name']}\t{b['wall_min']:.3f}\t{r['wall_min']:.3f}\t{ratio:.2f}\t{b['max_rss_kb']}\t{r['max_rss_kb']}{flag}")
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_run = subparsers.add_parser("run", help="Run the benchmarks and write a JSON record.")
+    parser_run.add_argument("--scales", nargs="+", default=["SR21", "SR201"], choices=list(SCALES), help="Input scales.")
+    parser_run.add_argument("--loci", type=int, required=False, help="Loci of the simulated scales. [per scale]")
+    parser_run.add_argument("--only", nargs="+", required=False, help="Only these benchmarks.")
+    parser_run.add_argument("--repeat", type=int, default=3, help="Runs of every benchmark.")
+    parser_run.add_argument("-s", "--seed", type=int, default=1, help="Seed of the inputs and the simulators.")
+    parser_run.add_argument("--work-dir", required=False, help="Keep generated inputs here to reuse them. [temporary]")
+    parser_run.add_argument(
+        "--results-dir", default=os.path.join(DATA_DIR, "benchmarks"), help="Directory of the JSON records."
+    )
+    parser_prepare = subparsers.add_parser("prepare", help="Generate the inputs of one scale.")
+    parser_prepare.add_argument("scale", choices=list(SCALES), help="Input scale.")
+    parser_prepare.add_argument("work_dir", help="Directory of the generated inputs.")
+    parser_prepare.add_argument("-s", "--seed", type=int, default=1, help="Seed of the inputs.")
+    parser_prepare.add_argument("--loci", type=int, required=False, help="Loci of the simulated scales.")
+    parser_compare = subparsers.add_parser("compare", help="Compare two JSON records.")
+    parser_compare.add_argument("baseline", help="Earlier JSON record.")
+    parser_compare.add_argument("current", help="Later JSON record.")
+    parser_compare.add_argument("--threshold", type=float, default=0.2, help="Slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "prepare":
+        prepare_inputs(args.scale, args.work_dir, args.seed, args.loci)
+    else:
+        compare(args)
@@ -0,0 +1,245 @@
+import os
+import sys
+import argparse
+import pathlib
+import numpy as np
+import treeswift as ts
+from concurrent.futures import ProcessPoolExecutor
+
+from compute_qqs import clade_bits
+from compute_metrics import get_labels, read_event_info, read_list
+from gtrees_io import iter_gene_trees
+from gtrees_store import GeneTreeStore, is_store
+import profiling
+from profiling import iterate, stage
+
+
+def tree_arrays(tree, taxon_index):
+    """Postorder parent array and taxon ids of a treeswift tree, interning new leaf labels."""
+    nodes = list(tree.traverse_postorder())
+    node_index = {nd: i for i, nd in enumerate(nodes)}
+    parent = np.full(len(nodes), -1, dtype=np.int64)
+    taxa = np.full(len(nodes), -1, dtype=np.int64)
+    for i, nd in enumerate(nodes):
+        if not nd.is_root():
+            parent[i] = node_index[nd.get_parent()]
+        if nd.is_leaf():
+            taxa[i] = taxon_index.setdefault(nd.get_label(), len(taxon_index))
+    return parent, taxa
+
+
+def tree_splits(parent, taxa):
+    """Nontrivial splits of a tree as ints, each written as the side without taxon 0."""
+    bits, full = clade_bits(parent, taxa)
+    n = bin(full).count("1")
+    splits = set()
+    for b in bits:
+        s = b ^ full if b & 1 else b
+        if 1 < bin(s).count("1") < n - 1:
+            splits.add(s)
+    return sorted(splits)
+
+
+def pack(splits, num_words):
+    if not splits:
+        return np.zeros((0, num_words), dtype=np.uint64)
+    raw = b"".join(s.to_bytes(8 * num_words, "little") for s in splits)
+    return np.frombuffer(raw, dtype="<u8").astype(np.uint64).reshape(-1, num_words)
+
+
+def as_keys(words):
+    # one opaque scalar per packed split so that NumPy set routines apply row-wise
+    return np.ascontiguousarray(words).view(np.dtype((np.void, 8 * words.shape[1]))).ravel()
+
+
+class BipartitionIndex:
+    """Nontrivial bipartitions of a gene-tree collection as packed uint64 bitsets.
+
+    ``splits`` holds one row of ``ceil(taxa / 64)`` words per split and gene ``i``
+    owns rows ``offsets[i]:offsets[i + 1]``. Leaf sets are assumed complete, so
+    a split is written as the side without the first interned taxon.
+    """
+
+    def __init__(self, taxa, splits, offsets):
+        self.taxa = list(taxa)
+        self.taxon_index = {t: i for i, t in enumerate(self.taxa)}
+        self.splits = splits
+        self.offsets = offsets
+        self.gene = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    @classmethod
+    def build(cls, gene_trees):
+        if is_store(gene_trees):
+            # stored trees already have parent arrays over interned taxa
+            store = GeneTreeStore(gene_trees)
+            taxa = list(store.taxa)
+            trees = (tuple(np.asarray(a, dtype=np.int64) for a in store.arrays(i)[:2]) for i in range(len(store)))
+        else:
+            taxon_index = {}
+            trees = (tree_arrays(ts.read_tree_newick(line.strip()), taxon_index) for line in iter_gene_trees(gene_trees))
+        per_gene = []
+        for parent, t in iterate("read", trees):
+            with stage("splits"):
+                per_gene.append(tree_splits(parent, t))
+        if not is_store(gene_trees):
+            taxa = list(taxon_index)
+        num_words = max(1, (len(taxa) + 63) // 64)
+        offsets = np.zeros(len(per_gene) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(s) for s in per_gene])
+        return cls(taxa, pack([s for splits in per_gene for s in splits], num_words), offsets)
+
+    @classmethod
+    def load(cls, index_file):
+        data = np.load(index_file)
+        return cls(data["taxa"].tolist(), data["splits"], data["offsets"])
+
+    def save(self, index_file):
+        np.savez(index_file, taxa=np.array(self.taxa), splits=self.splits, offsets=self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def reference_splits(self, newick):
+        """Packed splits of a reference tree, restricted to the indexed taxa."""
+        tree = ts.read_tree_newick(newick)
+        tree.suppress_unifurcations()
+        nodes = list(tree.traverse_postorder())
+        node_index = {nd: i for i, nd in enumerate(nodes)}
+        parent = np.array([-1 if nd.is_root() else node_index[nd.get_parent()] for nd in nodes], dtype=np.int64)
+        taxa = np.array(
+            [self.taxon_index.get(nd.get_label(), -1) if nd.is_leaf() else -1 for nd in nodes], dtype=np.int64
+        )
+        return pack(tree_splits(parent, taxa), self.splits.shape[1])
+
+    def majority_splits(self, threshold=0.5):
+        """Splits found in more than ``threshold`` of the genes (a majority-rule reference)."""
+        keys, first, counts = np.unique(as_keys(self.splits), return_index=True, return_counts=True)
+        return self.splits[first[counts > threshold * len(self)]]
+
+    def support(self, reference):
+        """Boolean (genes, reference splits) matrix: does gene i display split j."""
+        ref_keys = as_keys(reference)
+        order = np.argsort(ref_keys)
+        keys = as_keys(self.splits)
+        pos = np.searchsorted(ref_keys[order], keys)
+        pos[pos == len(order)] = 0
+        hit = ref_keys[order][pos] == keys if len(order) else np.zeros(len(keys), dtype=bool)
+        matrix = np.zeros((len(self), len(reference)), dtype=bool)
+        matrix[self.gene[hit], order[pos[hit]]] = True
+        return matrix
+
+    def rf(self, reference, normalized=False):
+        """Robinson-Foulds distance of every gene tree to the reference splits."""
+        shared = self.support(reference).sum(axis=1)
+        dist = np.diff(self.offsets) + len(reference) - 2 * shared
+        if normalized:
+            return dist / max(1, 2 * (len(self.taxa) - 3))
+        return dist
+
+    def gcf(self, reference):
+        """Gene concordance factor of every reference split."""
+        return self.support(reference).mean(axis=0)
+
+    def windows(self, reference, size, step=None):
+        """Mean RF and per-split gCF over sliding windows of ``size`` consecutive genes.
+
+        Returns (window starts, mean RF per window, gCF per window and reference split).
+        """
+        step = step or size
+        starts = np.arange(0, max(1, len(self) - size + 1), step)
+        ends = np.minimum(starts + size, len(self))
+        rf = np.concatenate([[0], np.cumsum(self.rf(reference))])
+        support = np.vstack([np.zeros(len(reference), dtype=np.int64), np.cumsum(self.support(reference), axis=0)])
+        lengths = (ends - starts)[:, None]
+        return starts, (rf[ends] - rf[starts]) / lengths[:, 0], (support[ends] - support[starts]) / lengths
+
+
+def read_reference(reference_file):
+    with open(reference_file, "r") as f:
+        return f.read().strip().split("\n")[0]
+
+
+def scan_event(run_dir, reference_file):
+    """Mean normalized RF of the genes inside and outside the event of one directory."""
+    try:
+        info_dict = read_event_info(run_dir / "info.txt")
+        names = ["emission.gtrees", "emission.gtrees.gz", "emission.gtrees.zst", "emission.overlay"]
+        emission = next((run_dir / n for n in names if (run_dir / n).exists()), run_dir / names[-1])
+        index = BipartitionIndex.build(emission)
+        reference = index.reference_splits(read_reference(reference_file)) if reference_file else index.majority_splits()
+        rf = index.rf(reference, normalized=True)
+        labels = get_labels(info_dict)[: len(index)].astype(bool)
+    except Exception as e:
+        print(f"An error occurred in {run_dir}: {e}", file=sys.stderr)
+        return None
+    inside = rf[labels].mean() if labels.any() else float("nan")
+    outside = rf[~labels].mean() if (~labels).any() else float("nan")
+    return len(index), int(labels.sum()), inside, outside, index.gcf(reference).mean()
+
+
+def main(args):
+    if args.command == "build":
+        index = BipartitionIndex.build(args.gene_trees)
+        with stage("write"):
+            index.save(args.output)
+    elif args.command == "query":
+        source = str(args.input)
+        with stage("load"):
+            index = BipartitionIndex.load(source) if source.endswith(".npz") else BipartitionIndex.build(source)
+            reference = index.reference_splits(read_reference(args.reference)) if args.reference else index.majority_splits()
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            if args.window:
+                with stage("evaluate"):
+                    starts, rf, gcf = index.windows(reference, args.window, args.step)
+                with stage("write"):
+                    out.write("start\tend\tmean_RF\tmean_gCF\tmin_gCF\n")
+                    for s, r, g in zip(starts, rf, gcf):
+                        out.write(f"{s + 1}\t{min(s + args.window, len(index))}\t{r:g}\t{g.mean():g}\t{g.min():g}\n")
+            else:
+                with stage("evaluate"):
+                    rf, nrf = index.rf(reference), index.rf(reference, normalized=True)
+                with stage("write"):
+                    out.write("gene\tRF\tnRF\n")
+                    for i, (r, nr) in enumerate(zip(rf, nrf)):
+                        out.write(f"{i + 1}\t{r}\t{nr:g}\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == "scan":
+        root_dir = args.root_dir if args.root_dir else args.list_file.parent
+        run_dirs = read_list(args.list_file, root_dir)
+        # the events are scanned in worker processes, whose stages are not recorded
+        with stage("scan"), ProcessPoolExecutor(max_workers=args.num_threads) as executor:
+            results = executor.map(scan_event, run_dirs, [args.reference] * len(run_dirs))
+            print("dir\tgenes\tevent_genes\tevent_nRF\tbackground_nRF\tmean_gCF")
+            for run_dir, r in zip(run_dirs, results):
+                if r is not None:
+                    print("\t".join(map(str, [run_dir.relative_to(root_dir), *r])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_build = subparsers.add_parser("build", help="Write the bipartition index of a gene tree file.")
+    parser_build.add_argument("-g", "--gene-trees", required=True, help="Gene tree file (or overlay, or store).")
+    parser_build.add_argument("-o", "--output", required=True, help="Output index (.npz).")
+    parser_query = subparsers.add_parser("query", help="RF per gene, or RF and gCF per window of genes.")
+    parser_query.add_argument("-i", "--input", required=True, help="Index (.npz) or gene tree file.")
+    parser_query.add_argument("-r", "--reference", required=False, help="Reference tree. [majority-rule splits]")
+    parser_query.add_argument("-w", "--window", type=int, required=False, help="Window size in genes.")
+    parser_query.add_argument("--step", type=int, required=False, help="Window step in genes. [window size]")
+    parser_query.add_argument("-o", "--output", required=False, help="Output table. [stdout]")
+    parser_scan = subparsers.add_parser("scan", help="RF inside and outside the event of every listed directory.")
+    parser_scan.add_argument("-l", "--list-file", type=pathlib.Path, required=True, help="List of event directories.")
+    parser_scan.add_argument("--root-dir", type=pathlib.Path, required=False, help="Directory the list entries are relative to. [directory of the list]")
+    parser_scan.add_argument("-r", "--reference", required=False, help="Reference tree. [majority-rule splits of each emission]")
+    parser_scan.add_argument("-t", "--num-threads", type=int, default=8, help="Number of processes.")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    output = getattr(args, "output", None)
+    profiling.setup(args, os.path.dirname(os.path.abspath(output)) if output else os.getcwd())
+
+    main(args)
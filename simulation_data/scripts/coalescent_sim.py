@@ -0,0 +1,162 @@
+import os
+import argparse
+import numpy as np
+import treeswift as ts
+
+from compressed_io import open_output
+import profiling
+from profiling import iterate, stage
+
+
+def species_tree_arrays(tree):
+    """Postorder parent indices, edge lengths (inf at the root) and leaf labels of a species tree."""
+    nodes = list(tree.traverse_postorder())
+    node_index = {nd: i for i, nd in enumerate(nodes)}
+    parent = np.full(len(nodes), -1, dtype=np.int64)
+    length = np.full(len(nodes), np.inf)
+    labels = []
+    leaf = np.full(len(nodes), -1, dtype=np.int64)
+    for i, nd in enumerate(nodes):
+        if not nd.is_root():
+            parent[i] = node_index[nd.get_parent()]
+            length[i] = nd.get_edge_length() or 0.0
+        if nd.is_leaf():
+            leaf[i] = len(labels)
+            labels.append(nd.get_label())
+    return parent, length, leaf, labels
+
+
+def merge_pools(pools):
+    lin = np.concatenate([p[0] for p in pools], axis=1)
+    pend = np.concatenate([p[1] for p in pools], axis=1)
+    order = np.argsort(lin < 0, axis=1, kind="stable")
+    n = sum(p[2] for p in pools)
+    width = int(n.max())
+    lin = np.take_along_axis(lin, order, axis=1)[:, :width]
+    pend = np.take_along_axis(pend, order, axis=1)[:, :width]
+    return lin, pend, n
+
+
+def coalesce(lin, pend, n, period, children, edge, next_id, rng):
+    """Coalesce lineages of every gene tree within one species branch of length ``period``."""
+    elapsed = np.zeros(len(n))
+    active = np.flatnonzero(n >= 2)
+    while len(active):
+        nn = n[active]
+        tau = elapsed[active] + rng.exponential(2.0 / (nn * (nn - 1)))
+        ok = tau < period
+        active, nn, tau = active[ok], nn[ok], tau[ok]
+        if not len(active):
+            break
+        i = rng.integers(nn)
+        j = rng.integers(nn - 1)
+        j += j >= i
+        last = nn - 1
+        a, b = lin[active, i], lin[active, j]
+        new = next_id[active]
+        next_id[active] += 1
+        children[active, new, 0] = a
+        children[active, new, 1] = b
+        edge[active, a] = pend[active, i] + tau
+        edge[active, b] = pend[active, j] + tau
+        lin[active, i] = new
+        pend[active, i] = -tau
+        lin[active, j] = lin[active, last]
+        pend[active, j] = pend[active, last]
+        lin[active, last] = -1
+        n[active] -= 1
+        elapsed[active] = tau
+        active = active[n[active] >= 2]
+    if np.isfinite(period):
+        pend[lin >= 0] += period
+
+
+def simulate_batch(species_tree, num_genes, rng):
+    """Simulate ``num_genes`` gene trees with one lineage per species under the MSC.
+
+    Returns (children, edge, labels): gene-tree nodes are numbered with the leaves
+    first (in ``labels`` order) and every internal node after its children, so the
+    last node is the root. ``children`` has shape (num_genes, 2 * leaves - 1, 2)
+    and ``edge`` holds the length of the edge above each node.
+    """
+    parent, length, leaf, labels = species_tree_arrays(species_tree)
+    num_leaves = len(labels)
+    num_nodes = 2 * num_leaves - 1
+    children = np.full((num_genes, num_nodes, 2), -1, dtype=np.int64)
+    edge = np.zeros((num_genes, num_nodes))
+    next_id = np.full(num_genes, num_leaves, dtype=np.int64)
+
+    pools = {}
+    for s in range(len(parent)):
+        if leaf[s] >= 0:
+            lin = np.full((num_genes, 1), leaf[s], dtype=np.int64)
+            pool = (lin, np.zeros((num_genes, 1)), np.ones(num_genes, dtype=np.int64))
+        else:
+            pool = merge_pools(pools.pop(s))
+        coalesce(*pool, length[s], children, edge, next_id, rng)
+        if parent[s] >= 0:
+            pools.setdefault(parent[s], []).append(pool)
+    return children, edge, labels
+
+
+def batch_newick(children, edge, labels, k):
+    num_leaves = len(labels)
+    strings = list(labels) + [None] * (num_leaves - 1)
+    kids, lengths = children[k].tolist(), edge[k].tolist()
+    for v in range(num_leaves, 2 * num_leaves - 1):
+        a, b = kids[v]
+        strings[v] = f"({strings[a]}:{lengths[a]!r},{strings[b]}:{lengths[b]!r})"
+    return f"[&R] {strings[-1]}:0;"
+
+
+def batch_parent_arrays(children, labels, k, taxon_index):
+    """Parent array and taxon ids of gene tree ``k`` in the node order used by compute_qqs."""
+    num_nodes = children.shape[1]
+    parent = np.full(num_nodes, -1, dtype=np.int64)
+    internal = np.arange(len(labels), num_nodes)
+    parent[children[k, internal, 0]] = internal
+    parent[children[k, internal, 1]] = internal
+    taxa = np.full(num_nodes, -1, dtype=np.int64)
+    taxa[: len(labels)] = [taxon_index.get(lbl, -1) for lbl in labels]
+    return parent, taxa
+
+
+def simulate_newick(species_tree, num_genes, rng, batch_size=1000):
+    for start in range(0, num_genes, batch_size):
+        children, edge, labels = simulate_batch(species_tree, min(batch_size, num_genes - start), rng)
+        for k in range(len(children)):
+            yield batch_newick(children, edge, labels, k)
+
+
+def simulate_parent_arrays(species_tree, num_genes, taxon_index, rng, batch_size=1000):
+    for start in range(0, num_genes, batch_size):
+        children, edge, labels = simulate_batch(species_tree, min(batch_size, num_genes - start), rng)
+        for k in range(len(children)):
+            yield batch_parent_arrays(children, labels, k, taxon_index)
+
+
+def main(args):
+    with stage("read"):
+        with open(args.input_tree, "r") as f:
+            species_tree = ts.read_tree_newick(f.read().strip().split("\n")[0])
+    rng = np.random.default_rng(args.seed)
+    with open_output(args.output) as f:
+        for gt in iterate("simulate", simulate_newick(species_tree, args.num_genes, rng, args.batch_size)):
+            with stage("write"):
+                f.write(f"{gt}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-i", "--input-tree", required=True, help="Species tree in CU.")
+    parser.add_argument("-n", "--num-genes", type=int, default=1000, help="Number gene trees to simulate.")
+    parser.add_argument("-o", "--output", required=True, help="Output gene tree file.")
+    parser.add_argument("-s", "--seed", type=int, required=False, help="Random seed.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Gene trees simulated at once.")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.output)))
+
+    main(args)
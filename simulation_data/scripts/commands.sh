@@ -1,23 +1,34 @@
+# The commands are fed to tool_runner.py, which runs 12 at a time like xargs -P
+# did, and lists every failed command with its stderr at the end.
+
 # Simulated emission distribution 10X population size
-seq 1 50 | xargs -t -P 12 -I{} bash -c "bash compute_nullDist.sh \
-  ../species_trees/estimated/SR201_10X_population/{}_1X_S201_0_1e6_haploid.caster-pair \
-  ../gene_trees/SR201_10X_population/{}_1X_S201_0_1e6_haploid.gtrees \
-  ../qqs-SR201/10X_population-{}"
+for i in $(seq 1 50); do
+  echo "bash compute_nullDist.sh \
+  ../species_trees/estimated/SR201_10X_population/${i}_1X_S201_0_1e6_haploid.caster-pair \
+  ../gene_trees/SR201_10X_population/${i}_1X_S201_0_1e6_haploid.gtrees \
+  ../qqs-SR201/10X_population-${i}"
+done | python tool_runner.py -j 12
 
 # Emissions 10X population size
-seq 1 50 | xargs -t -P 12 -I{} bash -c "bash compute_freqQuad.sh \
-  ../qqs-SR201/10X_population-{}/labelled_cu_tree.tree \
-  ../gene_trees/SR201_10X_population/{}_1X_S201_0_1e6_haploid.gtrees \
-  ../qqs-SR201/10X_population-{}"
+for i in $(seq 1 50); do
+  echo "bash compute_freqQuad.sh \
+  ../qqs-SR201/10X_population-${i}/labelled_cu_tree.tree \
+  ../gene_trees/SR201_10X_population/${i}_1X_S201_0_1e6_haploid.gtrees \
+  ../qqs-SR201/10X_population-${i}"
+done | python tool_runner.py -j 12
 
 # Emissions default population size
-seq 1 50 | xargs -t -P 12 -I{} bash -c "bash compute_nullDist.sh \
-  ../species_trees/estimated/SR201_default_condition/{}_1X_S201_0_haploid.caster-pair \
-  ../gene_trees/SR201_default_condition/{}_1X_S201_0_haploid.gtrees \
-  ../qqs-SR201/default_condition-{}"
+for i in $(seq 1 50); do
+  echo "bash compute_nullDist.sh \
+  ../species_trees/estimated/SR201_default_condition/${i}_1X_S201_0_haploid.caster-pair \
+  ../gene_trees/SR201_default_condition/${i}_1X_S201_0_haploid.gtrees \
+  ../qqs-SR201/default_condition-${i}"
+done | python tool_runner.py -j 12
 
 # Simulated emission distribution default population size
-seq 1 50 | xargs -t -P 12 -I{} bash -c "bash compute_freqQuad.sh \
-  ../qqs-SR201/default_condition-{}/labelled_cu_tree.tree \
-  ../gene_trees/SR201_default_condition/{}_1X_S201_0_haploid.gtrees \
-  ../qqs-SR201/default_condition-{}"
+for i in $(seq 1 50); do
+  echo "bash compute_freqQuad.sh \
+  ../qqs-SR201/default_condition-${i}/labelled_cu_tree.tree \
+  ../gene_trees/SR201_default_condition/${i}_1X_S201_0_haploid.gtrees \
+  ../qqs-SR201/default_condition-${i}"
+done | python tool_runner.py -j 12
@@ -0,0 +1,338 @@
+import os
+import sys
+import gzip
+import zlib
+import tempfile
+import argparse
+import numpy as np
+from itertools import islice
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Files are runs of independently compressed blocks of whole lines: gzip members for
+# .gz (like BGZF) and zstd frames for .zst, so zcat/zstdcat read them as usual. The
+# sidecar <file>.idx has one (first line, byte offset) row per block and a final
+# (line count, file size) row, which gives O(1) access to any line, the mtime of the
+# file, and a fingerprint of it: the CRC32 of the block trailers, which hold the
+# checksum of every block. The fingerprint is only read when the mtime differs.
+CODECS = ("gz", "zst")
+INDEX_SUFFIX = ".idx"
+BLOCK_SIZE = 1 << 20
+# gzip members end with the CRC32 and size of their data, zstd frames with a content checksum
+TRAILER_SIZE = 8
+
+
+def codec_of(filepath):
+    ext = str(filepath).rsplit(".", 1)[-1]
+    return ext if ext in CODECS else None
+
+
+def is_compressed(filepath):
+    return codec_of(filepath) is not None
+
+
+def need_zstandard():
+    if zstandard is None:
+        raise ImportError("reading or writing .zst files needs the zstandard package; use .gz instead")
+
+
+def compress_block(data, codec, level):
+    if codec == "zst":
+        need_zstandard()
+        return zstandard.ZstdCompressor(level=level, write_checksum=True).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def decompress_block(data, codec):
+    if codec == "zst":
+        need_zstandard()
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data, wbits=31)
+
+
+def split_lines(block):
+    # newline-terminated lines, the last one unterminated if the file does not end with a newline
+    parts = block.split(b"\n")
+    lines = [p + b"\n" for p in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+class BlockWriter:
+    """Text writer of a block-compressed file and its line index.
+
+    Used as a context manager, a write interrupted by an exception removes the
+    file instead of leaving a shorter one that reads as complete.
+    """
+
+    def __init__(self, filepath, block_size=BLOCK_SIZE, level=None):
+        self.filepath = str(filepath)
+        self.codec = codec_of(filepath)
+        if self.codec == "zst":
+            need_zstandard()
+        self.level = level if level is not None else (3 if self.codec == "zst" else 6)
+        self.block_size = block_size
+        self.f = open(self.filepath, "wb")
+        self.buffer, self.buffered = [], 0
+        self.index = []
+        self.num_lines = 0
+        self.fingerprint = 0
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.block_size:
+            data = "".join(self.buffer).encode()
+            cut = data.rfind(b"\n") + 1
+            if cut:
+                self.write_block(data[:cut])
+            rest = data[cut:].decode()
+            self.buffer, self.buffered = ([rest], len(rest)) if rest else ([], 0)
+
+    def writelines(self, lines):
+        for s in lines:
+            self.write(s)
+
+    def flush(self):
+        pass
+
+    def write_block(self, data):
+        self.index.append((self.num_lines, self.f.tell()))
+        block = compress_block(data, self.codec, self.level)
+        self.f.write(block)
+        self.fingerprint = zlib.crc32(block[-TRAILER_SIZE:], self.fingerprint)
+        self.num_lines += data.count(b"\n")
+
+    def close(self):
+        if self.f.closed:
+            return
+        data = "".join(self.buffer).encode()
+        if data:
+            self.write_block(data)
+            self.num_lines += not data.endswith(b"\n")
+        self.index.append((self.num_lines, self.f.tell()))
+        self.f.close()
+        with open(self.filepath + INDEX_SUFFIX, "wb") as f:
+            np.savez(
+                f,
+                index=np.array(self.index, dtype=np.int64),
+                fingerprint=np.int64(self.fingerprint),
+                mtime=np.int64(os.stat(self.filepath).st_mtime_ns),
+            )
+
+    def discard(self):
+        self.f.close()
+        for path in (self.filepath, self.filepath + INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class BlockReader:
+    """Lines of a block-compressed file, with random access through its index.
+
+    Without a matching index (e.g. a file from plain gzip, or one rewritten since
+    its index) lines are only streamed. An index matching the size and mtime of the
+    file is used as is; after a copy or touch the block trailers are checked instead.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = str(filepath)
+        self.codec = codec_of(filepath)
+        self.index = None
+        try:
+            with np.load(self.filepath + INDEX_SUFFIX) as data:
+                index, fingerprint = data["index"], int(data["fingerprint"])
+                mtime = int(data["mtime"]) if "mtime" in data else None
+            st = os.stat(self.filepath)
+            if index[-1, 1] == st.st_size and (mtime == st.st_mtime_ns or fingerprint == self.read_fingerprint(index)):
+                self.index = index
+        except (FileNotFoundError, ValueError, KeyError, AttributeError, TypeError):
+            # missing, unreadable or older index
+            pass
+        self.cached = (None, None)
+
+    def read_fingerprint(self, index):
+        fingerprint = 0
+        fd = os.open(self.filepath, os.O_RDONLY)
+        try:
+            for start, end in zip(index[:-1, 1].tolist(), index[1:, 1].tolist()):
+                size = min(TRAILER_SIZE, end - start)
+                fingerprint = zlib.crc32(os.pread(fd, size, end - size), fingerprint)
+        finally:
+            os.close(fd)
+        return fingerprint
+
+    def __len__(self):
+        if self.index is not None:
+            return int(self.index[-1, 0])
+        return sum(1 for _ in self)
+
+    def read_block(self, b):
+        (_, start), (_, end) = self.index[b], self.index[b + 1]
+        fd = os.open(self.filepath, os.O_RDONLY)
+        try:
+            return decompress_block(os.pread(fd, int(end - start), int(start)), self.codec)
+        finally:
+            os.close(fd)
+
+    def line(self, i):
+        """Line ``i`` (0-based) without decompressing the blocks before it."""
+        if self.index is None:
+            for j, line in enumerate(self):
+                if j == i:
+                    return line
+            raise IndexError(i)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        b = int(np.searchsorted(self.index[:-1, 0], i, side="right")) - 1
+        if self.cached[0] != b:
+            self.cached = (b, split_lines(self.read_block(b)))
+        return self.cached[1][i - int(self.index[b, 0])].decode()
+
+    def blocks(self, num_threads=1):
+        """Decompressed blocks in order, decompressing up to ``num_threads`` ahead in threads."""
+        if self.index is None:
+            yield from self.stream()
+            return
+        num_blocks = len(self.index) - 1
+        if num_threads <= 1:
+            yield from (self.read_block(b) for b in range(num_blocks))
+            return
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            todo = iter(range(num_blocks))
+            pending = deque(executor.submit(self.read_block, b) for b in islice(todo, 2 * num_threads))
+            while pending:
+                data = pending.popleft().result()
+                pending.extend(executor.submit(self.read_block, b) for b in islice(todo, 1))
+                yield data
+
+    def stream(self):
+        if self.codec == "zst":
+            need_zstandard()
+            with open(self.filepath, "rb") as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                yield from iter(lambda: reader.read(BLOCK_SIZE), b"")
+        else:
+            with gzip.open(self.filepath, "rb") as f:
+                yield from iter(lambda: f.read(BLOCK_SIZE), b"")
+
+    def iter_bytes(self, num_threads=1):
+        tail = b""
+        for data in self.blocks(num_threads):
+            lines = split_lines(tail + data)
+            tail = lines.pop() if lines and not lines[-1].endswith(b"\n") else b""
+            yield from lines
+        if tail:
+            yield tail
+
+    def __iter__(self):
+        return (line.decode() for line in self.iter_bytes())
+
+
+def iter_lines(filepath, binary=False, num_threads=1):
+    """Lines of a plain or block-compressed file."""
+    if is_compressed(filepath):
+        lines = BlockReader(filepath).iter_bytes(num_threads)
+        yield from (lines if binary else (line.decode() for line in lines))
+    else:
+        with open(filepath, "rb" if binary else "r") as f:
+            yield from f
+
+
+def open_output(filepath, buffering=-1):
+    """Text writer for ``filepath``, block-compressed when it ends with .gz or .zst."""
+    if is_compressed(filepath):
+        return BlockWriter(filepath)
+    return open(filepath, "w", buffering=buffering)
+
+
+@contextmanager
+def plain_path(filepath):
+    """Path of the text of ``filepath`` for external tools: a temporary copy when it is compressed."""
+    if not is_compressed(filepath):
+        yield filepath
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, os.path.basename(str(filepath)).rsplit(".", 1)[0])
+        with open(plain, "wb") as f:
+            f.writelines(BlockReader(filepath).iter_bytes())
+        yield plain
+
+
+def output_name(name, codec=None):
+    return f"{name}.{codec}" if codec else name
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "--compress",
+        choices=CODECS,
+        required=False,
+        help="Write the tree and QQS outputs block-compressed with this codec (seekable, readable with zcat/zstdcat).",
+    )
+
+
+def main(args):
+    if args.command == "compress":
+        output = args.output or f"{args.input}.{args.codec}"
+        with BlockWriter(output, args.block_size_kb << 10, args.level) as out:
+            for line in iter_lines(args.input):
+                out.write(line)
+    elif args.command == "decompress":
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            for line in BlockReader(args.input).iter_bytes(args.num_threads):
+                out.write(line.decode())
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == "line":
+        # 1-based like sed -n '{i}p'
+        if is_compressed(args.input):
+            reader = BlockReader(args.input)
+            for i in args.lines:
+                sys.stdout.write(reader.line(i - 1))
+        else:
+            lines = list(iter_lines(args.input))
+            for i in args.lines:
+                sys.stdout.write(lines[i - 1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_compress = subparsers.add_parser("compress", help="Block-compress a text file and write its index.")
+    parser_compress.add_argument("input", help="Text file (.gtrees, .tsv).")
+    parser_compress.add_argument("-c", "--codec", choices=CODECS, default="gz", help="Codec when no output is given.")
+    parser_compress.add_argument("-o", "--output", required=False, help="Output file ending with .gz or .zst. [input.codec]")
+    parser_compress.add_argument("--block-size-kb", type=int, default=BLOCK_SIZE >> 10, help="Uncompressed block size.")
+    parser_compress.add_argument("--level", type=int, required=False, help="Compression level. [6 for gz, 3 for zst]")
+    parser_decompress = subparsers.add_parser("decompress", help="Write the text of a compressed file.")
+    parser_decompress.add_argument("input", help="Compressed file.")
+    parser_decompress.add_argument("-o", "--output", required=False, help="Output text file. [stdout]")
+    parser_decompress.add_argument("-t", "--num-threads", type=int, default=4, help="Decompression threads.")
+    parser_line = subparsers.add_parser("line", help="Print lines by number (1-based), like sed -n 'Np'.")
+    parser_line.add_argument("input", help="Plain or compressed file.")
+    parser_line.add_argument("lines", type=int, nargs="+", help="Line numbers.")
+    args = parser.parse_args()
+
+    main(args)
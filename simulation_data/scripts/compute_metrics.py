@@ -2,12 +2,14 @@ import sys
 import argparse
 import pathlib
 import numpy as np
-from sklearn.metrics import confusion_matrix
-import treeswift as ts
-from scipy.spatial import distance
+from concurrent.futures import ProcessPoolExecutor
+from event_catalog import DEFAULT_GC, read_event_info
+import profiling
+from profiling import stage
 
 
-DEFAULT_GC = 2000
+INFO_COLUMNS = ["p", "r", "b", "option"]
+SCORE_COLUMNS = ["AUC", "AP", "best_F1"]
 
 
 def is_float(val):
@@ -43,23 +45,14 @@ def count_trees(filepath):
         raise e
 
 
-def read_info(info_file):
-    info_dict = {}
-    with open(info_file, "r") as f:
-        for line in f:
-            k, v = line.strip().split(":")
-            k, v = k.strip(), v.strip()
-            try:
-                info_dict[k] = eval(v)
-            except (NameError, SyntaxError):
-                info_dict[k] = v
-    return info_dict
-
-
 def get_labels(info_dict):
     # assert info_dict["p"] < 0.5
     labels = np.zeros(info_dict.get("gc", DEFAULT_GC), dtype=int)
-    labels[info_dict["start"] : info_dict["end"]] = 1
+    if isinstance(info_dict["start"], (tuple, list)):
+        for start, end in zip(info_dict["start"], info_dict["end"]):
+            labels[start:end] = 1
+    else:
+        labels[info_dict["start"] : info_dict["end"]] = 1
     # labels[info_dict["v"]] = 0
     return labels
 
@@ -95,22 +88,248 @@ def get_phylter_pred(input_file, info_dict):
     return pred
 
 
+def confusion(true, pred):
+    tn = int(np.count_nonzero((true == 0) & (pred == 0)))
+    fp = int(np.count_nonzero((true == 0) & (pred != 0)))
+    fn = int(np.count_nonzero((true != 0) & (pred == 0)))
+    tp = int(np.count_nonzero((true != 0) & (pred != 0)))
+    return tn, fp, fn, tp
+
+
+def get_pred(input_file, info_dict, method):
+    if method == "phlag":
+        return get_phlag_pred(input_file, info_dict)
+    elif method == "phylter":
+        return get_phylter_pred(input_file, info_dict)
+    else:
+        raise ValueError(f"Invalid method: {method}")
+
+
+def get_scores(input_file):
+    """Per-gene scores, higher meaning more likely inside the event.
+
+    .npy files are memory-mapped; text files hold the values separated by commas or
+    newlines, with lines starting with # skipped.
+    """
+    if str(input_file).endswith(".npy"):
+        return np.load(input_file, mmap_mode="r")
+    values = []
+    with open(input_file, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                values.extend(line.replace(",", " ").split())
+    return np.array(values, dtype=np.float64)
+
+
+def score_curves(scores, labels):
+    """ROC and PR curves of every row of a (runs, genes) score matrix at all thresholds at once.
+
+    Rows are padded with NaN scores. Genes are ranked by decreasing score and the cut
+    after rank k calls the top k genes; cuts inside a run of tied scores take the counts
+    at the end of the run, so each distinct threshold counts once. Returns the curves
+    as (runs, genes + 1) arrays starting at the empty call, and per-run AUC, average
+    precision, best F1 and its threshold (call genes scoring at least the threshold).
+    """
+    rows = np.arange(len(scores))
+    valid = ~np.isnan(scores)
+    order = np.argsort(np.where(valid, -scores, np.inf), axis=1, kind="stable")
+    ranked = np.take_along_axis(scores, order, axis=1)
+    pos = np.take_along_axis(labels & valid, order, axis=1)
+    neg = np.take_along_axis(~labels & valid, order, axis=1)
+
+    # index of the last gene of every run of tied scores (the NaN padding is one run)
+    n = ranked.shape[1]
+    is_end = np.ones(ranked.shape, dtype=bool)
+    is_end[:, :-1] = (ranked[:, :-1] != ranked[:, 1:]) & ~(np.isnan(ranked[:, :-1]) & np.isnan(ranked[:, 1:]))
+    end = np.minimum.accumulate(np.where(is_end, np.arange(n), n)[:, ::-1], axis=1)[:, ::-1]
+    zeros = np.zeros((len(scores), 1), dtype=np.int64)
+    tp = np.hstack([zeros, np.take_along_axis(np.cumsum(pos, axis=1, dtype=np.int64), end, axis=1)])
+    fp = np.hstack([zeros, np.take_along_axis(np.cumsum(neg, axis=1, dtype=np.int64), end, axis=1)])
+
+    num_pos, num_neg = tp[:, -1:], fp[:, -1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = tp / num_pos
+        fpr = fp / num_neg
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        f1 = 2 * tp / (tp + fp + num_pos)
+    auc = np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2, axis=1)
+    ap = np.sum(np.diff(tpr, axis=1) * precision[:, 1:], axis=1)
+    best = np.argmax(np.nan_to_num(f1[:, 1:], nan=-1.0), axis=1)
+    curves = {"fpr": fpr, "tpr": tpr, "precision": precision, "thresholds": ranked}
+    stats = {
+        "P": num_pos[:, 0],
+        "N": num_neg[:, 0],
+        "AUC": auc,
+        "AP": ap,
+        "best_F1": f1[rows, best + 1],
+        "threshold": ranked[rows, best],
+    }
+    return curves, stats
+
+
+def load_scored_dir(run_dir, input_name, info_name):
+    try:
+        info_dict = read_event_info(run_dir / info_name)
+        labels = get_labels(info_dict).astype(bool)
+        scores = np.asarray(get_scores(run_dir / input_name), dtype=np.float64)
+        if len(scores) != len(labels):
+            raise ValueError(f"{len(scores)} scores for {len(labels)} genes")
+    except Exception as e:
+        print(f"An error occurred in {run_dir}: {e}", file=sys.stderr)
+        return None
+    return labels, scores, [info_dict.get(k, "NA") for k in INFO_COLUMNS]
+
+
+def stack_runs(loaded):
+    # one row per run, padded with NaN scores up to the largest gene count
+    width = max(len(scores) for _, scores, _ in loaded)
+    scores = np.full((len(loaded), width), np.nan)
+    labels = np.zeros((len(loaded), width), dtype=bool)
+    for i, (l, s, _) in enumerate(loaded):
+        scores[i, : len(s)] = s
+        labels[i, : len(l)] = l
+    return scores, labels
+
+
+def evaluate_dir(run_dir, input_name, info_name, method):
+    try:
+        info_dict = read_event_info(run_dir / info_name)
+        pred = get_pred(run_dir / input_name, info_dict, method)
+        counts = confusion(get_labels(info_dict), pred)
+    except Exception as e:
+        print(f"An error occurred in {run_dir}: {e}", file=sys.stderr)
+        return None
+    return counts, [info_dict.get(k, "NA") for k in INFO_COLUMNS]
+
+
+def read_list(list_file, root_dir):
+    with open(list_file, "r") as f:
+        return [root_dir / line.strip() for line in f if line.strip()]
+
+
+def summarize(rows):
+    # per-condition totals, the condition being the sweep directory and parameters
+    groups = {}
+    for run_dir, counts, params in rows:
+        key = (run_dir.parent.name, *map(str, params))
+        total = groups.setdefault(key, np.zeros(5, dtype=np.int64))
+        total[:4] += counts
+        total[4] += 1
+    for key, (tn, fp, fn, tp, n) in sorted(groups.items()):
+        precision = tp / (tp + fp) if tp + fp else float("nan")
+        recall = tp / (tp + fn) if tp + fn else float("nan")
+        f1 = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else float("nan")
+        yield (*key, n, tn, fp, fn, tp, precision, recall, f1)
+
+
+def summarize_scores(run_dirs, stats, params):
+    # per-condition means, the condition being the sweep directory and parameters
+    groups = {}
+    for i, (run_dir, p) in enumerate(zip(run_dirs, params)):
+        groups.setdefault((run_dir.parent.name, *map(str, p)), []).append(i)
+    for key, idx in sorted(groups.items()):
+        yield (*key, len(idx), *(np.nanmean(stats[k][idx]) for k in SCORE_COLUMNS))
+
+
+def main_scores(args, root_dir, run_dirs):
+    n = len(run_dirs)
+    with stage("read"), ProcessPoolExecutor(max_workers=args.num_threads) as executor:
+        loaded = executor.map(
+            load_scored_dir,
+            run_dirs,
+            [args.input_file] * n,
+            [args.info_file] * n,
+            chunksize=max(1, n // (4 * args.num_threads)),
+        )
+        loaded = [(d, r) for d, r in zip(run_dirs, loaded) if r is not None]
+    if not loaded:
+        print(f"Error: no runs loaded from {args.list_file}", file=sys.stderr)
+        sys.exit(1)
+    run_dirs, loaded = [d for d, _ in loaded], [r for _, r in loaded]
+    params = [r[2] for r in loaded]
+    with stage("evaluate"):
+        curves, stats = score_curves(*stack_runs(loaded))
+
+    with stage("write"):
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            out.write("\t".join(["dir", "P", "N", *SCORE_COLUMNS, "threshold", *INFO_COLUMNS]) + "\n")
+            for i, run_dir in enumerate(run_dirs):
+                row = [stats[k][i] for k in ["P", "N", *SCORE_COLUMNS, "threshold"]]
+                out.write("\t".join(map(str, [run_dir.relative_to(root_dir), *row, *params[i]])) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if args.summary:
+            with open(args.summary, "w") as f:
+                f.write("\t".join(["condition", *INFO_COLUMNS, "n", *SCORE_COLUMNS]) + "\n")
+                for row in summarize_scores(run_dirs, stats, params):
+                    f.write("\t".join(map(str, row)) + "\n")
+        if args.curves:
+            np.savez(
+                args.curves,
+                dirs=np.array([str(d.relative_to(root_dir)) for d in run_dirs]),
+                **{k: v.astype(np.float32) for k, v in curves.items()},
+            )
+
+
+def main_batch(args):
+    root_dir = args.root_dir if args.root_dir else args.list_file.parent
+    run_dirs = read_list(args.list_file, root_dir)
+    if args.method == "scores":
+        main_scores(args, root_dir, run_dirs)
+        return
+    n = len(run_dirs)
+    with stage("evaluate"), ProcessPoolExecutor(max_workers=args.num_threads) as executor:
+        results = executor.map(
+            evaluate_dir,
+            run_dirs,
+            [args.input_file] * n,
+            [args.info_file] * n,
+            [args.method] * n,
+            chunksize=max(1, n // (4 * args.num_threads)),
+        )
+        rows = [(d, *r) for d, r in zip(run_dirs, results) if r is not None]
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        with stage("write"):
+            out.write("\t".join(["dir", "TN", "FP", "FN", "TP", *INFO_COLUMNS]) + "\n")
+            for run_dir, counts, params in rows:
+                out.write("\t".join(map(str, [run_dir.relative_to(root_dir), *counts, *params])) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.summary:
+        with open(args.summary, "w") as f:
+            header = ["condition", *INFO_COLUMNS, "n", "TN", "FP", "FN", "TP", "precision", "recall", "F1"]
+            f.write("\t".join(header) + "\n")
+            for row in summarize(rows):
+                f.write("\t".join(map(str, row)) + "\n")
+
+
 def main(args):
     input_file = args.input_file
     info_file = args.info_file
     describe = args.describe
     method = args.method
 
-    info_dict = read_info(info_file)
-    true = get_labels(info_dict)
+    if method == "scores":
+        run = load_scored_dir(pathlib.Path("."), input_file, info_file)
+        if run is None:
+            sys.exit(1)
+        _, stats = score_curves(run[1][None, :], run[0][None, :])
+        print("\t".join(SCORE_COLUMNS + ["threshold"]), file=sys.stderr)
+        print("\t".join(str(stats[k][0]) for k in SCORE_COLUMNS + ["threshold"]), file=sys.stdout)
+        return
 
-    if method == "phlag":
-        pred = get_phlag_pred(input_file, info_dict)
-    elif method == "phylter":
-        pred = get_phylter_pred(input_file, info_dict)
-    else:
-        raise ValueError(f"Invalid method: {args.method}")
-    tn, fp, fn, tp = confusion_matrix(true, pred).ravel().tolist()
+    with stage("read"):
+        info_dict = read_event_info(info_file)
+        true = get_labels(info_dict)
+        pred = get_pred(input_file, info_dict, method)
+    with stage("evaluate"):
+        tn, fp, fn, tp = confusion(true, pred)
     r = info_dict['r']
     p = info_dict['p']
     print("TN\tFP\tFN\tTP\tMp\tMr", file=sys.stderr)
@@ -123,9 +342,32 @@ def main(args):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-x", "--input-file", type=pathlib.Path, required=True)
-    parser.add_argument("-y", "--info-file", type=pathlib.Path, required=True)
-    parser.add_argument("--method", type=str, required=False, choices=["phlag", "phylter"])
+    parser.add_argument("-x", "--input-file", type=pathlib.Path, required=True, help="Prediction file (file name inside each directory with -l).")
+    parser.add_argument("-y", "--info-file", type=pathlib.Path, required=False, help="Event info file (file name inside each directory with -l).")
+    parser.add_argument(
+        "--method",
+        type=str,
+        required=False,
+        choices=["phlag", "phylter", "scores"],
+        help="Prediction format; scores are per-gene values (.npy, or comma/newline separated text) evaluated at every threshold.",
+    )
     parser.add_argument("--describe", action="store_true", required=False)
+    parser.add_argument("-l", "--list-file", type=pathlib.Path, required=False, help="List of event directories to evaluate in one run.")
+    parser.add_argument("--root-dir", type=pathlib.Path, required=False, help="Directory the list entries are relative to. [directory of the list]")
+    parser.add_argument("-t", "--num-threads", type=int, default=8, help="Number of processes for -l.")
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=False, help="Output table for -l. [stdout]")
+    parser.add_argument("--summary", type=pathlib.Path, required=False, help="Output table of per-condition totals (means with --method scores) for -l.")
+    parser.add_argument("--curves", type=pathlib.Path, required=False, help="Output .npz of the ROC/PR curves of every run for -l with --method scores.")
+    profiling.add_argument(parser)
     args = parser.parse_args()
-    main(args)
+    profiling.setup(args, args.output.parent if args.output else pathlib.Path.cwd())
+    if args.list_file:
+        if args.method is None:
+            parser.error("the following arguments are required with -l: --method")
+        if args.info_file is None:
+            args.info_file = pathlib.Path("info.txt")
+        main_batch(args)
+    else:
+        if args.info_file is None:
+            parser.error("the following arguments are required: -y/--info-file")
+        main(args)
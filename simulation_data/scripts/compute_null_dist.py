@@ -0,0 +1,128 @@
+import os
+import random
+import argparse
+import numpy as np
+
+from tqdm import tqdm
+from coalescent_sim import simulate_parent_arrays
+from compute_qqs import QuartetScorer, write_name_map
+from null_convergence import add_arguments, from_args
+import compressed_io
+import profiling
+from profiling import iterate, stage
+from simulate_gene_trees import (
+    get_cu_tree,
+    get_contained_species_tree,
+    simulate_gene_trees,
+)
+
+
+def contained_taxon_index(gene_to_species_map, taxon_index):
+    return {
+        gene_taxon: taxon_index[species_taxon.label]
+        for gene_taxon, species_taxon in gene_to_species_map.forward.items()
+    }
+
+
+def dendropy_to_arrays(tree, taxon_index):
+    """Postorder parent array and taxon ids of a dendropy tree, keyed by Taxon objects."""
+    nodes = list(tree.postorder_node_iter())
+    node_index = {id(nd): i for i, nd in enumerate(nodes)}
+    parent = np.full(len(nodes), -1, dtype=np.int64)
+    taxa = np.full(len(nodes), -1, dtype=np.int64)
+    for i, nd in enumerate(nodes):
+        if nd.parent_node is not None:
+            parent[i] = node_index[id(nd.parent_node)]
+        if nd.taxon is not None:
+            taxa[i] = taxon_index.get(nd.taxon, -1)
+    return parent, taxa
+
+
+def dendropy_parent_arrays(tree_obj, taxon_index, num_genes, seed):
+    species_tree, gene_to_species_map = get_contained_species_tree(tree_obj)
+    contained_index = contained_taxon_index(gene_to_species_map, taxon_index)
+    for gene_tree in simulate_gene_trees(
+        species_tree, gene_to_species_map, num_genes, rng=random.Random(seed)
+    ):
+        yield dendropy_to_arrays(gene_tree, contained_index)
+
+
+def stream_null_dist(scorer, gene_trees, output_file, convergence=None):
+    with compressed_io.open_output(output_file) as f:
+        for i, (parent, taxa) in enumerate(iterate("simulate", gene_trees)):
+            with stage("score"):
+                freq, en = scorer.score_arrays(parent, taxa)
+            with stage("write"):
+                f.writelines(scorer.rows(i + 1, freq, en))
+            if convergence is not None and convergence.update(freq, en):
+                break
+
+
+def main(args):
+    os.makedirs(args.outdir, exist_ok=True)
+    profiling.setup(args, args.outdir)
+    with stage("cu_tree"):
+        tree_obj = get_cu_tree(
+            args.input_tree,
+            args.gene_trees,
+            args.outdir,
+            args.num_threads,
+            args.cache_dir,
+            args.cache_size_mb << 20,
+            args.cu_timeout,
+            args.cu_retries,
+        )
+    scorer = QuartetScorer(tree_obj)
+    if args.memo_dir:
+        scorer.load_memo(args.memo_dir)
+
+    if args.engine == "numpy":
+        gene_trees = simulate_parent_arrays(
+            tree_obj, args.num_genes, scorer.taxon_index, np.random.default_rng(args.seed)
+        )
+    else:
+        gene_trees = dendropy_parent_arrays(tree_obj, scorer.taxon_index, args.num_genes, args.seed)
+    gene_trees = tqdm(gene_trees, total=args.num_genes)
+    convergence = from_args(args)
+    stream_null_dist(scorer, gene_trees, os.path.join(args.outdir, compressed_io.output_name("nullDist.tsv", args.compress)), convergence)
+    if convergence is not None:
+        convergence.write(os.path.join(args.outdir, "nullDist.convergence.json"), args.num_genes)
+    write_name_map(scorer, os.path.join(args.outdir, "nameMap.tsv"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-i", "--input-tree", required=True, help="Input Species Tree.")
+    parser.add_argument("-g", "--gene-trees", required=True, help="Gene tree file.")
+    parser.add_argument("-n", "--num-genes", type=int, default=3000, help="Number gene trees to simulate.")
+    parser.add_argument("-t", "--num-threads", default=8, help="Number of threads.")
+    parser.add_argument("-o", "--outdir", required=False, default="./", help="Output directory.")
+    parser.add_argument("-s", "--seed", type=int, required=False, help="Random seed.")
+    parser.add_argument(
+        "--engine",
+        default="dendropy",
+        choices=["dendropy", "numpy"],
+        help="Coalescent simulator: dendropy, or the batched numpy engine for one individual per species.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("CU_CACHE_DIR"),
+        help="Directory caching CU trees across runs (defaults to $CU_CACHE_DIR, no cache when unset).",
+    )
+    parser.add_argument("--cache-size-mb", type=int, default=1024, help="Size bound of the CU tree cache.")
+    parser.add_argument("--cu-timeout", type=float, required=False, help="Seconds before astral4 is killed.")
+    parser.add_argument("--cu-retries", type=int, default=0, help="Reruns of a failed astral4 call.")
+    parser.add_argument(
+        "--memo-dir",
+        default=os.environ.get("QQS_MEMO_DIR"),
+        help="Directory of the topology scores kept by compute_qqs runs (defaults to $QQS_MEMO_DIR). "
+        "Only read: simulated topologies are almost all unique and are not added.",
+    )
+    add_arguments(parser)
+    compressed_io.add_argument(parser)
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+
+    main(args)
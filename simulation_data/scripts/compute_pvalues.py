@@ -0,0 +1,107 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+from compressed_io import iter_lines
+from compute_qqs import EMITTED_TOPOLOGIES
+import profiling
+from profiling import stage
+
+
+def read_qqs(qqs_file):
+    """Read a QQS table as (genes, branches, freq, en).
+
+    freq has shape (genes, branches, topologies) and en (genes, branches); rows are
+    grouped by gene with the same branch and topology order for every gene.
+    """
+    branches, first = [], None
+    for line in iter_lines(qqs_file):
+        gene, branch, t, _, _ = line.split("\t")
+        if first is None:
+            first = gene
+        elif gene != first:
+            break
+        if t == EMITTED_TOPOLOGIES[0]:
+            branches.append(branch)
+    if not branches:
+        raise ValueError(f"{qqs_file} has no QQS rows")
+    nt = len(EMITTED_TOPOLOGIES)
+    values = np.loadtxt(iter_lines(qqs_file, num_threads=4), delimiter="\t", usecols=(0, 3, 4), ndmin=2)
+    if len(values) % (len(branches) * nt):
+        raise ValueError(f"{qqs_file} does not have {len(branches) * nt} rows for every gene")
+    values = values.reshape(-1, len(branches), nt, 3)
+    return values[:, 0, 0, 0].astype(np.int64), branches, values[..., 1], values[:, :, 0, 2]
+
+
+def empirical_pvalues(freq, en, null_freq, null_en):
+    """Tail probabilities and z-scores of every gene against the null sample of its branch.
+
+    Each branch sorts its informative null values once and places all genes with
+    ``searchsorted``; tails use the (count + 1) / (n + 1) estimate. Genes or branches
+    without information are NaN.
+    """
+    lower = np.full(freq.shape, np.nan)
+    upper = np.full(freq.shape, np.nan)
+    z = np.full(freq.shape, np.nan)
+    for j in range(freq.shape[1]):
+        informative = en[:, j] > 0
+        for k in range(freq.shape[2]):
+            null = np.sort(null_freq[null_en[:, j] > 0, j, k])
+            if not len(null):
+                continue
+            x = freq[informative, j, k]
+            n = len(null)
+            lower[informative, j, k] = (np.searchsorted(null, x, side="right") + 1) / (n + 1)
+            upper[informative, j, k] = (n - np.searchsorted(null, x, side="left") + 1) / (n + 1)
+            sd = null.std()
+            z[informative, j, k] = (x - null.mean()) / sd if sd > 0 else 0.0
+    return lower, upper, z
+
+
+def main(args):
+    with stage("read"):
+        try:
+            genes, branches, freq, en = read_qqs(args.emissions)
+            _, null_branches, null_freq, null_en = read_qqs(args.null_dist)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    # put the null branches in the order of the emissions
+    order = [null_branches.index(b) for b in branches]
+    with stage("pvalues"):
+        lower, upper, z = empirical_pvalues(freq, en, null_freq[:, order], null_en[:, order])
+
+    arrays = {
+        "genes": genes,
+        "branches": np.array(branches),
+        "topologies": np.array(EMITTED_TOPOLOGIES),
+        "freq": freq,
+        "en": en,
+        "lower": lower,
+        "upper": upper,
+        "z": z,
+    }
+    with stage("write"):
+        if args.npy_dir:
+            # one .npy per array so that readers can memory-map them
+            os.makedirs(args.output, exist_ok=True)
+            for name, arr in arrays.items():
+                np.save(os.path.join(args.output, f"{name}.npy"), arr)
+        else:
+            np.savez_compressed(args.output, **arrays)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-e", "--emissions", required=True, help="QQS table of the gene trees (emissionsQQS.tsv).")
+    parser.add_argument("-n", "--null-dist", required=True, help="QQS table of the simulated gene trees (nullDist.tsv).")
+    parser.add_argument("-o", "--output", required=True, help="Output .npz file (directory with --npy-dir).")
+    parser.add_argument("--npy-dir", action="store_true", help="Write a directory of .npy files instead of one .npz.")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.output)))
+
+    main(args)
@@ -0,0 +1,371 @@
+import os
+import sys
+import hashlib
+import argparse
+import numpy as np
+import treeswift as ts
+from contextlib import nullcontext
+
+from compressed_io import open_output
+from file_lock import locked
+from gtrees_io import iter_gene_trees
+from gtrees_store import GeneTreeStore, is_store
+import profiling
+from profiling import iterate, stage
+
+# Quartet topologies around a species-tree branch with child clusters L, R,
+# sibling cluster S and the remaining cluster O (same order as astral4 -u 3):
+# t1 = LR|SO (main), t2 = RS|LO, t3 = LS|RO.
+TOPOLOGIES = (("t1", (0, 1, 2, 3)), ("t2", (1, 2, 0, 3)), ("t3", (0, 2, 1, 3)))
+EMITTED_TOPOLOGIES = ("t1", "t2")
+# topologies kept in a memo file, the least recently used are dropped beyond it
+MEMO_SIZE = 10000
+
+
+def is_float(val):
+    try:
+        return float(val) == float(val)
+    except (ValueError, TypeError):
+        return False
+
+
+def label_tree(tree):
+    is_labeled = True
+    i = 0
+    labels = set()
+    for node in tree.traverse_postorder():
+        if node.is_leaf():
+            continue
+        if not node.label or (node.label in labels) or is_float(node.label):
+            is_labeled = False
+            node.label = "I" + str(i)
+            i += 1
+        labels.add(node.label)
+    return is_labeled
+
+
+def read_species_tree(species_tree, root=None):
+    with open(species_tree, "r") as f:
+        tree = ts.read_tree_newick(f.read().strip().split("\n")[0])
+    if root is not None:
+        reroot(tree, root)
+    label_tree(tree)
+    return tree
+
+
+def reroot(tree, root):
+    """Root ``tree`` on the branch above the node labelled ``root`` (an outgroup leaf or a clade).
+
+    The branch lengths are not scored, so a branch without one is given a length to split.
+    """
+    lbl2node = tree.label_to_node(selection="all")
+    try:
+        nd = lbl2node[root]
+    except KeyError:
+        raise KeyError(f"Root {root} not found in species tree")
+    if nd is tree.root:
+        return
+    if not nd.get_edge_length():
+        nd.set_edge_length(1.0)
+    tree.reroot(nd, length=nd.get_edge_length() / 2)
+    tree.suppress_unifurcations()
+
+
+def tree_to_arrays(tree, taxon_index):
+    """Postorder parent array and taxon ids (-1 for internal or unknown) of a treeswift tree."""
+    nodes = list(tree.traverse_postorder())
+    node_index = {nd: i for i, nd in enumerate(nodes)}
+    parent = np.full(len(nodes), -1, dtype=np.int64)
+    taxa = np.full(len(nodes), -1, dtype=np.int64)
+    for i, nd in enumerate(nodes):
+        if not nd.is_root():
+            parent[i] = node_index[nd.get_parent()]
+        if nd.is_leaf():
+            taxa[i] = taxon_index.get(nd.get_label(), -1)
+    return parent, taxa
+
+
+def node_depths(parent):
+    # parent array is in postorder, so every parent comes after its children
+    depth = np.zeros(len(parent), dtype=np.int64)
+    for i in range(len(parent) - 1, -1, -1):
+        if parent[i] >= 0:
+            depth[i] = depth[parent[i]] + 1
+    return depth
+
+
+def branch_clusters(nd, bits, full):
+    if nd.is_root() or len(nd.child_nodes()) != 2:
+        return None
+    l, r = (bits[c] for c in nd.child_nodes())
+    parent = nd.get_parent()
+    siblings = [c for c in parent.child_nodes() if c is not nd]
+    if not parent.is_root() or len(siblings) > 1:
+        s = bits[siblings[0]]
+        o = full & ~(l | r | s)
+    elif siblings[0].is_leaf() or len(siblings[0].child_nodes()) != 2:
+        # the branch above a child of a bifurcating root is shared with its sibling
+        return None
+    else:
+        s, o = (bits[c] for c in siblings[0].child_nodes())
+    if o == 0:
+        return None
+    return l, r, s, o
+
+
+def clade_bits(parent, taxa):
+    """Taxon bitset below every node of a postorder parent array, and the one of the root."""
+    parent, taxa = parent.tolist(), taxa.tolist()
+    bits = [0] * len(parent)
+    for i, p in enumerate(parent):
+        if taxa[i] >= 0:
+            bits[i] |= 1 << taxa[i]
+        if p >= 0:
+            bits[p] |= bits[i]
+    return bits, bits[parent.index(-1)]
+
+
+def topology_key(parent, taxa):
+    """Hash of the unrooted topology induced on the scored taxa (None if a taxon repeats).
+
+    Every split is written as the side without the lowest taxon, so rerootings and
+    child orders of the same topology share a key.
+    """
+    mapped = taxa[taxa >= 0]
+    if len(np.unique(mapped)) != len(mapped):
+        return None
+    bits, full = clade_bits(parent, taxa)
+    low = full & -full
+    splits = {b ^ full if b & low else b for b in bits}
+    splits.discard(0)
+    return hashlib.blake2b(repr((full, sorted(splits))).encode(), digest_size=16).hexdigest()
+
+
+def bits_to_ids(cluster):
+    ids = []
+    i = 0
+    while cluster:
+        if cluster & 1:
+            ids.append(i)
+        cluster >>= 1
+        i += 1
+    return ids
+
+
+class QuartetScorer:
+    """Quartet frequencies of gene trees around every internal branch of a species tree.
+
+    Species-tree clusters are kept as leaf bitsets; each branch assigns every taxon
+    to one of its four surrounding clusters (L, R, S, O). A gene tree is scored by
+    accumulating one-hot cluster counts bottom-up over all branches at once and
+    counting, for every gene-tree node, the quartets it resolves.
+    """
+
+    def __init__(self, tree):
+        self.taxa = sorted(nd.get_label() for nd in tree.traverse_leaves())
+        self.taxon_index = {t: i for i, t in enumerate(self.taxa)}
+
+        bits = {}
+        for nd in tree.traverse_postorder():
+            if nd.is_leaf():
+                bits[nd] = 1 << self.taxon_index[nd.get_label()]
+            else:
+                bits[nd] = 0
+                for c in nd.child_nodes():
+                    bits[nd] |= bits[c]
+        full = bits[tree.root]
+
+        self.branches = []
+        self.clusters = []
+        for nd in tree.traverse_postorder(leaves=False, internal=True):
+            clusters = branch_clusters(nd, bits, full)
+            if clusters is not None:
+                self.branches.append(nd.get_label())
+                self.clusters.append(clusters)
+
+        self.groups = np.zeros((len(self.taxa), len(self.branches), 4), dtype=np.int64)
+        for j, clusters in enumerate(self.clusters):
+            for g, cl in enumerate(clusters):
+                self.groups[bits_to_ids(cl), j, g] = 1
+
+        # scores of the gene-tree topologies seen so far, see load_memo
+        self.memo = {}
+        self.memo_used = {}
+        self.species_key = hashlib.sha256(repr((self.taxa, self.branches, self.clusters)).encode()).hexdigest()
+
+    def topology_names(self):
+        rows = []
+        for name, clusters in zip(self.branches, self.clusters):
+            sets = [",".join(self.taxa[i] for i in bits_to_ids(cl)) for cl in clusters]
+            for t, (a, b, c, d) in TOPOLOGIES:
+                rows.append((name, t, f"{{{sets[a]}}}|{{{sets[b]}}}#{{{sets[c]}}}|{{{sets[d]}}}"))
+        return rows
+
+    def score_arrays(self, parent, taxa):
+        """Return (frequencies, effective number) with shapes (branches, 3) and (branches,).
+
+        Trees with an already scored unrooted topology are looked up in the memo.
+        """
+        key = topology_key(parent, taxa)
+        if key is None:
+            return self.score_topology(parent, taxa)
+        if key not in self.memo:
+            self.memo[key] = self.score_topology(parent, taxa)
+        self.memo_used[key] = None
+        return self.memo[key]
+
+    def score_topology(self, parent, taxa):
+        n_nodes = len(parent)
+        nb = len(self.branches)
+        down = np.zeros((n_nodes, nb, 4), dtype=np.int64)
+        is_leaf = taxa >= 0
+        down[is_leaf] = self.groups[taxa[is_leaf]]
+
+        depth = node_depths(parent)
+        for d in range(depth.max(), 0, -1):
+            idx = np.flatnonzero(depth == d)
+            np.add.at(down, parent[idx], down[idx])
+        root = np.flatnonzero(parent < 0)[0]
+        total = down[root]
+
+        # every internal node sees its children clusters and the cluster above it;
+        # a quartet ab|cd is resolved exactly once at the node where a and b split
+        # off into different subtrees while c and d lie together in a third one
+        internal = np.zeros(n_nodes, dtype=bool)
+        internal[parent[parent >= 0]] = True
+        child = np.flatnonzero(parent >= 0)
+        above = np.flatnonzero(internal & (parent >= 0))
+        owner = np.concatenate([parent[child], above])
+        slots = np.concatenate([down[child], total[None] - down[above]])
+
+        counts = np.zeros((nb, 3), dtype=np.float64)
+        for k, (_, (a, b, c, d)) in enumerate(TOPOLOGIES):
+            pair = slots[..., a] * slots[..., b]
+            pair_sum = np.zeros((n_nodes, nb), dtype=np.int64)
+            np.add.at(pair_sum, owner, pair)
+            outside = (total[None, :, a] - slots[..., a]) * (total[None, :, b] - slots[..., b])
+            outside -= pair_sum[owner] - pair
+            counts[:, k] = (slots[..., c] * slots[..., d] * outside).sum(axis=0)
+
+        num = np.prod(total, axis=1).astype(np.float64)
+        en = (num > 0).astype(np.float64)
+        freq = np.divide(counts, num[:, None], out=np.zeros_like(counts), where=num[:, None] > 0)
+        return freq * en[:, None], en
+
+    def score_tree(self, tree):
+        return self.score_arrays(*tree_to_arrays(tree, self.taxon_index))
+
+    def score_newick(self, newick):
+        return self.score_tree(ts.read_tree_newick(newick))
+
+    def memo_file(self, memo_dir):
+        return os.path.join(memo_dir, f"{self.species_key}.npz")
+
+    def load_memo(self, memo_dir):
+        """Add the topologies scored by earlier runs against the same species tree.
+
+        Returns the stored keys, least recently used first.
+        """
+        try:
+            data = np.load(self.memo_file(memo_dir))
+        except FileNotFoundError:
+            return []
+        keys = data["keys"].tolist()
+        for key, freq, en in zip(keys, data["freq"], data["en"]):
+            self.memo.setdefault(key, (freq, en))
+        return keys
+
+    def save_memo(self, memo_dir, max_entries=MEMO_SIZE):
+        # merge with the file of concurrent runs under a lock, keeping the max_entries most
+        # recently used topologies, then swap it in atomically
+        if max_entries <= 0:
+            return
+        os.makedirs(memo_dir, exist_ok=True)
+        memo_file = self.memo_file(memo_dir)
+        with locked(memo_file + ".lock"):
+            stored = self.load_memo(memo_dir)
+            keys = [k for k in stored if k not in self.memo_used] + list(self.memo_used)
+            keys = keys[-max_entries:]
+            nb = len(self.branches)
+            freq = np.array([self.memo[k][0] for k in keys]).reshape(len(keys), nb, 3)
+            en = np.array([self.memo[k][1] for k in keys]).reshape(len(keys), nb)
+            with open(memo_file + ".tmp", "wb") as f:
+                np.savez(f, keys=np.array(keys, dtype="U32"), freq=freq, en=en)
+            os.replace(memo_file + ".tmp", memo_file)
+
+    def rows(self, gene, freq, en):
+        for j, name in enumerate(self.branches):
+            for k, (t, _) in enumerate(TOPOLOGIES):
+                if t in EMITTED_TOPOLOGIES:
+                    yield f"{gene}\t{name}\t{t}\t{freq[j, k]:g}\t{en[j]:g}\n"
+
+
+def write_name_map(scorer, output_file):
+    with open(output_file, "w") as f:
+        for name, t, topology in scorer.topology_names():
+            if t in EMITTED_TOPOLOGIES:
+                f.write(f"{name}\t{t}\t{topology}\n")
+
+
+def main(args):
+    scorer = QuartetScorer(read_species_tree(args.species_tree, args.root))
+    if args.memo_dir:
+        scorer.load_memo(args.memo_dir)
+    # an interrupted run removes a compressed output instead of indexing it as complete
+    with (open_output(args.output) if args.output else nullcontext(sys.stdout)) as out:
+        if is_store(args.gene_trees):
+            # stored trees are already parent arrays, nothing to parse
+            store = GeneTreeStore(args.gene_trees)
+            lookup = store.taxon_lookup(scorer.taxon_index)
+            for i in range(len(store)):
+                with stage("read"):
+                    parent, taxon, _, _ = store.arrays(i)
+                    parent, taxa = np.asarray(parent, dtype=np.int64), lookup[taxon]
+                with stage("score"):
+                    freq, en = scorer.score_arrays(parent, taxa)
+                with stage("write"):
+                    out.writelines(scorer.rows(i + 1, freq, en))
+        else:
+            for i, line in enumerate(iterate("read", iter_gene_trees(args.gene_trees))):
+                line = line.strip()
+                if not line:
+                    continue
+                with stage("parse"):
+                    parent, taxa = tree_to_arrays(ts.read_tree_newick(line), scorer.taxon_index)
+                with stage("score"):
+                    freq, en = scorer.score_arrays(parent, taxa)
+                with stage("write"):
+                    out.writelines(scorer.rows(i + 1, freq, en))
+    if args.name_map:
+        write_name_map(scorer, args.name_map)
+    if args.memo_dir:
+        scorer.save_memo(args.memo_dir, args.memo_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-s", "--species-tree", required=True, help="Labelled species tree in CU.")
+    parser.add_argument("-g", "--gene-trees", required=True, help="File for gene trees (or emission overlay, or gene tree store) to score.")
+    parser.add_argument("-o", "--output", required=False, help="Output QQS table, block-compressed if it ends with .gz or .zst. [stdout]")
+    parser.add_argument("-m", "--name-map", required=False, help="Output table for the quartet topologies of each branch.")
+    parser.add_argument(
+        "--root", required=False, help="Label of the outgroup leaf (or clade) to root the species tree at."
+    )
+    parser.add_argument(
+        "--memo-dir",
+        default=os.environ.get("QQS_MEMO_DIR"),
+        help="Directory keeping the scores of gene-tree topologies across runs. [$QQS_MEMO_DIR]",
+    )
+    parser.add_argument(
+        "--memo-size",
+        type=int,
+        default=MEMO_SIZE,
+        help="Topologies kept in the memo file of a species tree, least recently used dropped first (0: do not save).",
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.output)) if args.output else os.getcwd())
+
+    main(args)
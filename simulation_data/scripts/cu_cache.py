@@ -0,0 +1,106 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import argparse
+from contextlib import contextmanager
+from emission_overlay import file_checksum
+from file_lock import locked
+
+
+def tool_checksum(tool):
+    # the resolved executable stands in for the tool version
+    path = shutil.which(tool)
+    return file_checksum(path) if path else "missing"
+
+
+def cache_key(paths, tool, *extra):
+    """Hash of the contents of ``paths``, the ``tool`` executable and ``extra`` parameters."""
+    h = hashlib.sha256()
+    for part in [file_checksum(p) for p in paths] + [tool_checksum(tool)] + [str(e) for e in extra]:
+        h.update(part.encode() + b"\0")
+    return h.hexdigest()
+
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    """Remove least recently used entries until the cache fits in ``max_bytes``.
+
+    Entries in use by another process (locked) are skipped. An entry goes with its
+    lock file, as do the lock files left without an entry by failed builds.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".lock"):
+            entry = os.path.join(cache_dir, name[: -len(".lock")])
+            if not os.path.isdir(entry) and entry != keep:
+                with locked(entry + ".lock", blocking=False) as acquired:
+                    if acquired and not os.path.isdir(entry):
+                        os.remove(entry + ".lock")
+            continue
+        if name.startswith(".tmp"):
+            continue
+        entry = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(entry), entry_size(entry), entry))
+        except FileNotFoundError:
+            # evicted by a concurrent run
+            continue
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        with locked(entry + ".lock", blocking=False) as acquired:
+            if not acquired or not os.path.isdir(entry):
+                continue
+            trash = tempfile.mkdtemp(prefix=".tmp", dir=cache_dir)
+            os.rename(entry, os.path.join(trash, "entry"))
+            shutil.rmtree(trash)
+            os.remove(entry + ".lock")
+            total -= size
+
+
+@contextmanager
+def fetch(cache_dir, key, build, max_bytes):
+    """Yield the entry directory of ``key``, calling ``build(tmpdir)`` on a miss.
+
+    The entry is built in a temporary directory and renamed into place, and the
+    key stays locked while the caller reads it, so concurrent runs build it once.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    with locked(entry + ".lock"):
+        if os.path.isdir(entry):
+            os.utime(entry)
+        else:
+            tmp = tempfile.mkdtemp(prefix=".tmp", dir=cache_dir)
+            try:
+                os.chmod(tmp, 0o755)
+                build(tmp)
+                os.rename(tmp, entry)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+        yield entry
+    evict(cache_dir, max_bytes, keep=entry)
+
+
+def main(args):
+    evict(args.cache_dir, args.max_mb << 20)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-c", "--cache-dir", required=True, help="Cache directory.")
+    parser.add_argument("--max-mb", type=int, default=0, help="Size to shrink the cache to, in MB.")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from contextlib import nullcontext
+from compressed_io import is_compressed, iter_lines, open_output
+from gtrees_store import is_store
+
+
+OVERLAY_SUFFIX = ".overlay"
+
+
+def base_text(filepath):
+    # a store keeps the original lines verbatim in newick.bin
+    return os.path.join(filepath, "newick.bin") if is_store(filepath) else filepath
+
+
+def file_checksum(filepath):
+    # compressed files are identified by their text, like stores
+    h = hashlib.sha256()
+    if is_compressed(filepath):
+        for line in iter_lines(filepath, binary=True):
+            h.update(line)
+        return h.hexdigest()
+    with open(base_text(filepath), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_overlay(overlay_file, base_file, changes, gc, sha256=None):
+    """Write the lines of ``changes`` ((index, tree) pairs) as a delta over ``base_file``.
+
+    The base is recorded relative to the overlay so event directories can be moved
+    together with the gene tree files. Batches pass the ``sha256`` of the base once.
+    """
+    header = {
+        "base": os.path.relpath(os.path.abspath(base_file), os.path.dirname(os.path.abspath(overlay_file))),
+        "sha256": sha256 if sha256 is not None else file_checksum(base_file),
+        "gc": gc,
+    }
+    with open(overlay_file, "w") as f:
+        f.write(json.dumps(header) + "\n")
+        for i, gt in changes:
+            f.write(f"{i}\t{gt.rstrip()}\n")
+
+
+def read_overlay_header(overlay_file):
+    with open(overlay_file, "r") as f:
+        header = json.loads(f.readline())
+    header["base"] = os.path.join(os.path.dirname(os.path.abspath(overlay_file)), header["base"])
+    return header
+
+
+def iter_overlay(overlay_file, verify=True):
+    """Stream the full emission of an overlay, one newline-terminated tree per line."""
+    header = read_overlay_header(overlay_file)
+    h = hashlib.sha256()
+    with open(overlay_file, "r") as f:
+        f.readline()
+        changes = (line.split("\t", 1) for line in f)
+        nxt = next(changes, None)
+        for i, line in enumerate(iter_lines(base_text(header["base"]), binary=True)):
+            if verify:
+                h.update(line)
+            if nxt is not None and int(nxt[0]) == i:
+                yield nxt[1]
+                nxt = next(changes, None)
+            else:
+                yield line.decode()
+    if verify and h.hexdigest() != header["sha256"]:
+        raise ValueError(f"Checksum mismatch for the base {header['base']} of {overlay_file}")
+
+
+def materialize(overlay_file, output_file=None, verify=True):
+    # a base checksum mismatch is only known at the end: the output is then removed
+    with (open_output(output_file) if output_file else nullcontext(sys.stdout)) as out:
+        for line in iter_overlay(overlay_file, verify):
+            out.write(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_materialize = subparsers.add_parser("materialize", help="Write the full emission of an overlay.")
+    parser_materialize.add_argument("-i", "--input", required=True, help="Overlay file.")
+    parser_materialize.add_argument("-o", "--output", required=False, help="Output gene tree file (.gz/.zst compressed). [stdout]")
+    parser_materialize.add_argument("--no-verify", action="store_true", help="Skip the base checksum.")
+    args = parser.parse_args()
+
+    if args.command == "materialize":
+        materialize(args.input, args.output, not args.no_verify)
@@ -0,0 +1,70 @@
+import os
+import copy
+import hashlib
+
+
+def seed_of(*parts):
+    return int(hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:8], 16)
+
+
+def read_events(events_file):
+    """Rows of an events table as dicts, keyed by the names of its header line."""
+    with open(events_file, "r") as f:
+        header = f.readline().rstrip("\n").split("\t")
+        return [dict(zip(header, line.rstrip("\n").split("\t"))) for line in f if line.strip()]
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "-e",
+        "--events",
+        required=False,
+        help="TSV of events simulated from one load of the inputs: a header of event options "
+        "(e.g. discordant_portion, rate, output_dir, seed) and one event per line. Options missing from "
+        "the table keep their command-line value; input files and flags are set on the command line only. "
+        "Without a seed column the seed of every event is derived from --seed and the name of its output directory.",
+    )
+
+
+def option_name(dest):
+    return "--" + dest.replace("_", "-")
+
+
+def parse_args(parser, columns, required):
+    """Parse the command line, letting an events table vary the options of ``columns``.
+
+    ``columns`` maps the options an event may set to their types. The ``required``
+    options are declared optional in ``parser`` and checked here, on the command
+    line without --events and per event with it. ``args.batch`` is the list of
+    per-event namespaces with --events and None otherwise.
+    """
+    args = parser.parse_args()
+    args.batch = None
+    if args.events is None:
+        missing = [option_name(dest) for dest in required if getattr(args, dest) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+        return args
+
+    args.batch = []
+    for row in read_events(args.events):
+        event = copy.copy(args)
+        unknown = set(row) - set(columns)
+        if unknown:
+            # input files and flags stay those of the command line: the inputs are loaded once for all events
+            parser.error(
+                f"{args.events}: columns {', '.join(sorted(unknown))} cannot vary per event "
+                f"(allowed: {', '.join(columns)})"
+            )
+        for dest, value in row.items():
+            try:
+                setattr(event, dest, columns[dest](value))
+            except ValueError:
+                parser.error(f"{args.events}: invalid {dest} {value!r}")
+        missing = [dest for dest in required if getattr(event, dest) is None]
+        if missing:
+            parser.error(f"{args.events}: no value for {', '.join(missing)}")
+        if "seed" not in row:
+            event.seed = seed_of(args.seed, os.path.basename(os.path.normpath(event.output_dir)))
+        args.batch.append(event)
+    return args
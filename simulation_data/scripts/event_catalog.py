@@ -0,0 +1,340 @@
+import os
+import re
+import ast
+import sys
+import json
+import pathlib
+import argparse
+import numpy as np
+
+from emission_overlay import read_overlay_header
+
+
+INFO_TXT = "info.txt"
+INFO_JSON = "info.json"
+DEFAULT_GC = 2000
+NUMBER_COLUMNS = ["p", "r", "b", "gc"]
+TEXT_COLUMNS = ["type", "condition", "option", "donor", "recipient", "clade"]
+
+
+def write_info(output_dir, info):
+    """Write the metadata of an event as info.txt and as its info.json sidecar."""
+    with open(os.path.join(output_dir, INFO_TXT), "w") as f:
+        f.write("\n".join(f"{k}: {v}" for k, v in info.items()))
+    with open(os.path.join(output_dir, INFO_JSON), "w") as f:
+        json.dump(info, f, default=str)
+
+
+def read_info(info_file):
+    # values are python literals (numbers, lists, tuples); anything else is kept as text
+    info_dict = {}
+    with open(info_file, "r") as f:
+        for line in f:
+            k, v = line.strip().split(":", 1)
+            k, v = k.strip(), v.strip()
+            try:
+                info_dict[k] = ast.literal_eval(v)
+            except (ValueError, SyntaxError):
+                info_dict[k] = v
+    return info_dict
+
+
+def read_event_info(info_file):
+    # the info.json sidecar next to info.txt is read instead when present
+    info_file = pathlib.Path(info_file)
+    json_file = info_file.with_name(INFO_JSON)
+    if info_file.name == INFO_TXT and json_file.exists():
+        with open(json_file, "r") as f:
+            info_dict = json.load(f)
+    else:
+        info_dict = read_info(info_file)
+    # events stored as overlays record the gene count in the overlay header
+    overlay_file = info_file.parent / "emission.overlay"
+    if "gc" not in info_dict and overlay_file.exists():
+        info_dict["gc"] = read_overlay_header(overlay_file)["gc"]
+    return info_dict
+
+
+def intervals(info_dict):
+    if isinstance(info_dict["start"], (tuple, list)):
+        return list(zip(info_dict["start"], info_dict["end"]))
+    return [(info_dict["start"], info_dict["end"])]
+
+
+def find_events(root_dir):
+    for d, _, files in os.walk(root_dir):
+        if INFO_TXT in files or INFO_JSON in files:
+            yield pathlib.Path(d)
+
+
+def info_stamp(event_dir):
+    # (mtime, size) of the files an event is read from, to spot changed events on updates
+    info_file = event_dir / (INFO_JSON if (event_dir / INFO_JSON).exists() else INFO_TXT)
+    st = info_file.stat()
+    return st.st_mtime, st.st_size
+
+
+TOKEN = re.compile(r"\s*(?:(?P<op>==|!=|<=|>=|<|>)|(?P<punct>[&|~()])|(?P<str>'[^']*'|\"[^\"]*\")|(?P<num>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|(?P<name>[A-Za-z_]\w*))")
+
+
+def tokenize(expr):
+    tokens, i = [], 0
+    expr = expr.rstrip()
+    while i < len(expr):
+        m = TOKEN.match(expr, i)
+        if not m:
+            raise ValueError(f"cannot parse query at: {expr[i:]!r}")
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "str":
+            value = value[1:-1]
+        elif kind == "num":
+            value = float(value)
+        tokens.append((kind, value))
+        i = m.end()
+    return tokens
+
+
+class Query:
+    """Boolean selection over catalog columns, e.g. ``p==0.15 & r>0.6 & option=='support'``.
+
+    Terms compare a column with a number or a quoted string and are combined with
+    ``&``, ``|``, ``~`` and parentheses; ``&`` and ``|`` bind looser than comparisons.
+    Numbers compare equal up to rounding. Missing values (NaN or empty text) match
+    no term, negated or not: ``~(p==0.15)`` selects the events with a p other than 0.15.
+    """
+
+    def __init__(self, expr):
+        self.tokens = tokenize(expr)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError(f"unexpected {token[1]!r} in query")
+        self.pos += 1
+        return token
+
+    def evaluate(self, columns):
+        mask, _ = self.either(columns)
+        if self.pos != len(self.tokens):
+            raise ValueError(f"unexpected {self.peek()[1]!r} in query")
+        return mask
+
+    # the parse methods return (mask, known): known rows have every column of the expression
+    def either(self, columns):
+        mask, known = self.both(columns)
+        while self.peek() == ("punct", "|"):
+            self.take()
+            m, k = self.both(columns)
+            mask, known = mask | m, known & k
+        return mask, known
+
+    def both(self, columns):
+        mask, known = self.term(columns)
+        while self.peek() == ("punct", "&"):
+            self.take()
+            m, k = self.term(columns)
+            mask, known = mask & m, known & k
+        return mask, known
+
+    def term(self, columns):
+        if self.peek() == ("punct", "~"):
+            self.take()
+            mask, known = self.term(columns)
+            return ~mask & known, known
+        if self.peek() == ("punct", "("):
+            self.take()
+            mask, known = self.either(columns)
+            self.take("punct", ")")
+            return mask, known
+        _, name = self.take("name")
+        if name not in columns:
+            raise ValueError(f"unknown column {name!r}, expected one of {', '.join(columns)}")
+        _, op = self.take("op")
+        kind, value = self.peek()
+        if kind not in ("num", "str"):
+            raise ValueError(f"expected a number or a quoted string after {name} {op}")
+        self.take()
+        known = present(columns[name])
+        return compare(columns[name], op, value) & known, known
+
+
+def present(column):
+    """Rows of ``column`` holding a value: not NaN, not empty text."""
+    if column.dtype.kind == "f":
+        return ~np.isnan(column)
+    if column.dtype.kind == "U":
+        return column != ""
+    return np.ones(len(column), dtype=bool)
+
+
+def compare(column, op, value):
+    if column.dtype.kind in "fi":
+        if not isinstance(value, float):
+            raise ValueError(f"cannot compare numbers with {value!r}")
+        column = column.astype(np.float64)
+        if op in ("==", "!="):
+            eq = np.isclose(column, value, rtol=1e-9, atol=1e-12)
+            return eq if op == "==" else ~eq & ~np.isnan(column)
+    elif isinstance(value, float) or op not in ("==", "!="):
+        raise ValueError(f"text columns only support == and != with a quoted string, not {op} {value!r}")
+    with np.errstate(invalid="ignore"):
+        return {
+            "==": np.equal, "!=": np.not_equal, "<": np.less,
+            "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+        }[op](column, value)
+
+
+class EventCatalog:
+    """Parameters and true intervals of every event directory below a root, as columns.
+
+    Number columns are NaN and text columns empty where an event lacks the field.
+    Event ``i`` owns intervals ``offsets[i]:offsets[i + 1]`` of ``starts``/``ends``
+    and the ``v`` values ``v_offsets[i]:v_offsets[i + 1]``.
+    """
+
+    ARRAYS = ["dirs", *NUMBER_COLUMNS, *TEXT_COLUMNS, "starts", "ends", "offsets", "v", "v_offsets", "mtime", "size"]
+
+    def __init__(self, root_dir, arrays):
+        self.root_dir = pathlib.Path(root_dir)
+        self.arrays = arrays
+        self.columns = {k: arrays[k] for k in NUMBER_COLUMNS + TEXT_COLUMNS}
+        self.columns["dir"] = arrays["dirs"]
+
+    @classmethod
+    def build(cls, root_dir, previous=None):
+        """Scan ``root_dir``; events unchanged since the ``previous`` catalog are not read again."""
+        root_dir = pathlib.Path(root_dir)
+        known = {}
+        if previous is not None and previous.root_dir.resolve() == root_dir.resolve():
+            known = {d: i for i, d in enumerate(previous.arrays["dirs"].tolist())}
+        rows = []
+        for event_dir in sorted(find_events(root_dir)):
+            rel_dir = str(event_dir.relative_to(root_dir))
+            mtime, size = info_stamp(event_dir)
+            i = known.get(rel_dir)
+            if i is not None and previous.arrays["mtime"][i] == mtime and previous.arrays["size"][i] == size:
+                rows.append(previous.row(i))
+                continue
+            try:
+                info_dict = read_event_info(event_dir / INFO_TXT)
+                event_intervals = intervals(info_dict)
+            except Exception as e:
+                print(f"An error occurred in {event_dir}: {e!r}", file=sys.stderr)
+                continue
+            info_dict.setdefault("gc", DEFAULT_GC)
+            info_dict["condition"] = event_dir.parent.name
+            v = info_dict.get("v", [])
+            rows.append((rel_dir, info_dict, event_intervals, v if isinstance(v, list) else [], mtime, size))
+        return cls.from_rows(root_dir, rows)
+
+    @classmethod
+    def from_rows(cls, root_dir, rows):
+        arrays = {"dirs": np.array([r[0] for r in rows], dtype=str)}
+        for k in NUMBER_COLUMNS:
+            arrays[k] = np.array([to_float(r[1].get(k)) for r in rows], dtype=np.float64)
+        for k in TEXT_COLUMNS:
+            arrays[k] = np.array([str(r[1].get(k, "")) for r in rows], dtype=str)
+        arrays["starts"] = np.array([s for r in rows for s, _ in r[2]], dtype=np.int64)
+        arrays["ends"] = np.array([e for r in rows for _, e in r[2]], dtype=np.int64)
+        arrays["offsets"] = np.concatenate([[0], np.cumsum([len(r[2]) for r in rows])]).astype(np.int64)
+        arrays["v"] = np.array([x for r in rows for x in r[3]], dtype=np.int64)
+        arrays["v_offsets"] = np.concatenate([[0], np.cumsum([len(r[3]) for r in rows])]).astype(np.int64)
+        arrays["mtime"] = np.array([r[4] for r in rows], dtype=np.float64)
+        arrays["size"] = np.array([r[5] for r in rows], dtype=np.int64)
+        return cls(root_dir, arrays)
+
+    def row(self, i):
+        info_dict = {k: self.arrays[k][i].item() for k in NUMBER_COLUMNS + TEXT_COLUMNS}
+        return (self.arrays["dirs"][i].item(), info_dict, self.intervals(i), self.v(i).tolist(), self.arrays["mtime"][i].item(), self.arrays["size"][i].item())
+
+    @classmethod
+    def load(cls, catalog_file):
+        data = np.load(catalog_file)
+        return cls(data["root_dir"].item(), {k: data[k] for k in cls.ARRAYS})
+
+    def save(self, catalog_file):
+        np.savez(catalog_file, root_dir=np.array(str(self.root_dir)), **self.arrays)
+
+    def __len__(self):
+        return len(self.arrays["dirs"])
+
+    def query(self, expr=None):
+        """Indices of the events selected by a query expression (all events without one)."""
+        if not expr:
+            return np.arange(len(self))
+        return np.flatnonzero(Query(expr).evaluate(self.columns))
+
+    def dirs(self, indices):
+        return [self.root_dir / d for d in self.arrays["dirs"][indices].tolist()]
+
+    def intervals(self, i):
+        a, b = self.arrays["offsets"][i : i + 2]
+        return list(zip(self.arrays["starts"][a:b].tolist(), self.arrays["ends"][a:b].tolist()))
+
+    def v(self, i):
+        a, b = self.arrays["v_offsets"][i : i + 2]
+        return self.arrays["v"][a:b]
+
+    def labels(self, i):
+        """0/1 array over the genes of event ``i``, 1 inside its intervals."""
+        labels = np.zeros(int(self.arrays["gc"][i]), dtype=int)
+        for start, end in self.intervals(i):
+            labels[start:end] = 1
+        return labels
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def main(args):
+    if args.command == "build":
+        previous = None
+        if os.path.exists(args.output) and not args.rebuild:
+            previous = EventCatalog.load(args.output)
+        catalog = EventCatalog.build(args.root_dir, previous)
+        catalog.save(args.output)
+        print(f"{len(catalog)} events in {args.output}", file=sys.stderr)
+    elif args.command == "query":
+        catalog = EventCatalog.load(args.catalog)
+        indices = catalog.query(args.expr)
+        unknown = [c for c in args.columns if c not in catalog.columns]
+        if unknown:
+            raise ValueError(f"unknown columns {', '.join(unknown)}, expected some of {', '.join(catalog.columns)}")
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            if args.columns:
+                out.write("\t".join(["dir", *args.columns]) + "\n")
+            for i in indices.tolist():
+                row = [catalog.arrays["dirs"][i]] + [catalog.columns[c][i] for c in args.columns]
+                out.write("\t".join(f"{x:g}" if isinstance(x, float) else str(x) for x in row) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_build = subparsers.add_parser("build", help="Write or update the catalog of the events below a directory.")
+    parser_build.add_argument("root_dir", type=pathlib.Path, help="Directory holding the event directories (e.g. simulated_events).")
+    parser_build.add_argument("-o", "--output", required=True, help="Catalog file (.npz); an existing one is updated.")
+    parser_build.add_argument("--rebuild", action="store_true", help="Read every event again instead of updating.")
+    parser_query = subparsers.add_parser("query", help="List the event directories matching an expression.")
+    parser_query.add_argument("catalog", help="Catalog file (.npz).")
+    parser_query.add_argument("expr", nargs="?", help="Selection, e.g. \"p==0.15 & r>0.6 & option=='support'\". [all events]")
+    parser_query.add_argument("-c", "--columns", nargs="+", default=[], help="Columns to print after the directory.")
+    parser_query.add_argument("-o", "--output", required=False, help="Output list (relative to the catalog root). [stdout]")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,33 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(lock_path, blocking=True):
+    """Hold an exclusive flock on ``lock_path``; yields False if it is taken and not ``blocking``.
+
+    The lock file may be removed by its holder (see cu_cache.evict), so a lock taken
+    on a file that is no longer at ``lock_path`` is dropped and taken again.
+    """
+    while True:
+        f = open(lock_path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            yield False
+            return
+        try:
+            st = os.stat(lock_path)
+        except FileNotFoundError:
+            st = None
+        fst = os.fstat(f.fileno())
+        if st is not None and (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+            break
+        f.close()
+    try:
+        yield True
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
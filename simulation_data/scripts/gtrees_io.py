@@ -0,0 +1,31 @@
+from compressed_io import BlockReader, is_compressed, iter_lines
+from emission_overlay import OVERLAY_SUFFIX, iter_overlay, read_overlay_header
+from gtrees_store import GeneTreeStore, is_store
+
+
+def iter_gene_trees(filepath):
+    if str(filepath).endswith(OVERLAY_SUFFIX):
+        yield from iter_overlay(filepath)
+    elif is_store(filepath):
+        yield from GeneTreeStore(filepath)
+    elif is_compressed(filepath):
+        yield from iter_lines(filepath)
+    else:
+        with open(filepath, "r") as f:
+            yield from f
+
+
+def count_trees(filepath):
+    if str(filepath).endswith(OVERLAY_SUFFIX):
+        return read_overlay_header(filepath)["gc"]
+    if is_store(filepath):
+        return len(GeneTreeStore(filepath))
+    if is_compressed(filepath):
+        return len(BlockReader(filepath))
+    try:
+        with open(filepath, "r") as f:
+            line_count = sum(1 for line in f)
+        return line_count
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise e
@@ -0,0 +1,113 @@
+import os
+import json
+import argparse
+import numpy as np
+import treeswift as ts
+
+from compressed_io import iter_lines
+
+
+STORE_SUFFIX = ".gtstore"
+ARRAYS = ["line_offsets", "node_offsets", "parent", "taxon", "edge", "support"]
+
+
+def is_float(val):
+    try:
+        return float(val) == float(val)
+    except (ValueError, TypeError):
+        return False
+
+
+def is_store(filepath):
+    return str(filepath).rstrip("/").endswith(STORE_SUFFIX)
+
+
+def convert(gene_trees, store_dir):
+    """Write a .gtrees file as a columnar store of postorder node arrays.
+
+    Every tree keeps its raw newick line in newick.bin, so the store reproduces
+    the original file byte for byte and has the same checksum.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    taxa = {}
+    line_offsets = [0]
+    node_offsets = [0]
+    parent, taxon, edge, support = [], [], [], []
+    with open(os.path.join(store_dir, "newick.bin"), "wb") as out:
+        for line in iter_lines(gene_trees, binary=True):
+            out.write(line)
+            line_offsets.append(line_offsets[-1] + len(line))
+            tree = ts.read_tree_newick(line.decode().strip())
+            nodes = list(tree.traverse_postorder())
+            node_index = {nd: i for i, nd in enumerate(nodes)}
+            for nd in nodes:
+                parent.append(-1 if nd.is_root() else node_index[nd.get_parent()])
+                e = nd.get_edge_length()
+                edge.append(np.nan if e is None else e)
+                if nd.is_leaf():
+                    taxon.append(taxa.setdefault(nd.get_label(), len(taxa)))
+                    support.append(np.nan)
+                else:
+                    taxon.append(-1)
+                    support.append(float(nd.get_label()) if is_float(nd.get_label()) else np.nan)
+            node_offsets.append(len(parent))
+    np.save(os.path.join(store_dir, "line_offsets.npy"), np.array(line_offsets, dtype=np.int64))
+    np.save(os.path.join(store_dir, "node_offsets.npy"), np.array(node_offsets, dtype=np.int64))
+    np.save(os.path.join(store_dir, "parent.npy"), np.array(parent, dtype=np.int32))
+    np.save(os.path.join(store_dir, "taxon.npy"), np.array(taxon, dtype=np.int32))
+    np.save(os.path.join(store_dir, "edge.npy"), np.array(edge, dtype=np.float64))
+    np.save(os.path.join(store_dir, "support.npy"), np.array(support, dtype=np.float64))
+    with open(os.path.join(store_dir, "taxa.json"), "w") as f:
+        json.dump(list(taxa), f)
+
+
+class GeneTreeStore:
+    """Memory-mapped reader with O(1) access to the count and to tree ``i``."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r"))
+        if self.line_offsets[-1] > 0:
+            self.newick_bin = np.memmap(os.path.join(store_dir, "newick.bin"), dtype=np.uint8, mode="r")
+        else:
+            self.newick_bin = np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(store_dir, "taxa.json"), "r") as f:
+            self.taxa = json.load(f)
+
+    def __len__(self):
+        return len(self.line_offsets) - 1
+
+    def line(self, i):
+        return self.newick_bin[self.line_offsets[i] : self.line_offsets[i + 1]].tobytes().decode()
+
+    def newick(self, i):
+        return self.line(i).strip()
+
+    def arrays(self, i):
+        """(parent, taxon, edge, support) of tree ``i``; parents follow their children."""
+        s, e = self.node_offsets[i], self.node_offsets[i + 1]
+        return self.parent[s:e], self.taxon[s:e], self.edge[s:e], self.support[s:e]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.line(i)
+
+    def taxon_lookup(self, taxon_index):
+        """Map the interned taxon ids of the store onto ``taxon_index`` (-1 when missing)."""
+        return np.array([taxon_index.get(t, -1) for t in self.taxa] + [-1], dtype=np.int64)
+
+
+def main(args):
+    convert(args.input, args.output if args.output else args.input + STORE_SUFFIX)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-i", "--input", required=True, help="Gene tree file.")
+    parser.add_argument("-o", "--output", required=False, help="Output store directory. [INPUT.gtstore]")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,87 @@
+import json
+import warnings
+import numpy as np
+
+
+class QuantileConvergence:
+    """Early stopping for null distributions based on per-branch quantiles.
+
+    Scores are added one simulated gene tree at a time. Every ``check_every``
+    genes the chosen quantiles of the informative t1/t2 frequencies of every
+    branch are estimated again, and the sample is converged once at least
+    ``min_genes`` genes were seen and no quantile moved by more than ``tol``.
+    """
+
+    def __init__(self, quantiles=(0.01, 0.05, 0.95, 0.99), tol=0.005, min_genes=500, check_every=250):
+        self.quantiles = list(quantiles)
+        self.tol = tol
+        self.min_genes = min_genes
+        self.check_every = check_every
+        self.values = None
+        self.chunk = []
+        self.previous = None
+        self.trace = []
+        self.converged = False
+
+    @property
+    def num_genes(self):
+        return (0 if self.values is None else len(self.values)) + len(self.chunk)
+
+    def update(self, freq, en):
+        """Add the scores of one gene tree; True once the quantiles have converged."""
+        self.chunk.append(np.where(en[:, None] > 0, freq[:, :2], np.nan))
+        if self.num_genes % self.check_every:
+            return False
+        chunk = np.stack(self.chunk)
+        self.values = chunk if self.values is None else np.concatenate([self.values, chunk])
+        self.chunk = []
+        with warnings.catch_warnings():
+            # branches without informative genes have all-NaN quantiles
+            warnings.simplefilter("ignore", RuntimeWarning)
+            current = np.nanquantile(self.values, self.quantiles, axis=0)
+        if self.previous is not None:
+            change = np.abs(current - self.previous)
+            change[np.isnan(current) & np.isnan(self.previous)] = 0.0
+            change[np.isnan(change)] = np.inf
+            max_change = float(change.max()) if change.size else 0.0
+            self.trace.append({"num_genes": self.num_genes, "max_change": max_change})
+            self.converged = self.num_genes >= self.min_genes and max_change < self.tol
+        self.previous = current
+        return self.converged
+
+    def write(self, output_file, max_genes):
+        with open(output_file, "w") as f:
+            json.dump(
+                {
+                    "num_genes": self.num_genes,
+                    "converged": self.converged,
+                    "quantiles": self.quantiles,
+                    "tol": self.tol,
+                    "min_genes": self.min_genes,
+                    "max_genes": max_genes,
+                    "check_every": self.check_every,
+                    "trace": self.trace,
+                },
+                f,
+                indent=1,
+            )
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Stop simulating once the null quantiles converge; the number of genes becomes the maximum.",
+    )
+    parser.add_argument("--min-genes", type=int, default=500, help="Minimum number of genes with --adaptive.")
+    parser.add_argument("--check-every", type=int, default=250, help="Genes between convergence checks.")
+    parser.add_argument(
+        "--quantiles", type=float, nargs="+", default=[0.01, 0.05, 0.95, 0.99], help="Quantiles to track."
+    )
+    parser.add_argument("--tol", type=float, default=0.005, help="Largest quantile change accepted as converged.")
+
+
+def from_args(args):
+    if not args.adaptive:
+        return None
+    return QuantileConvergence(args.quantiles, args.tol, args.min_genes, args.check_every)
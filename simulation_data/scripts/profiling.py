@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import atexit
+import pathlib
+import argparse
+import resource
+from contextlib import contextmanager, nullcontext
+
+
+PROFILE_ENV = "QQS_PROFILE"
+
+
+class Profiler:
+    """Wall time, CPU time and call counts of named stages.
+
+    Stages may nest; the time of a stage excludes the stages inside it, so the
+    stages of a run add up to at most its total. rss_high_water_kb is the
+    process-wide resident high-water mark when the stage last ended, not the
+    memory of the stage itself. Disabled profilers hand out a no-op context, so
+    instrumented loops cost next to nothing unless --profile (or $QQS_PROFILE) is set.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        # [wall, cpu] of the nested stages of every open stage
+        self.nested = []
+        self.output_dir = None
+        self.script = None
+        self.start_wall = self.start_cpu = 0.0
+
+    def start(self, output_dir, script):
+        self.enabled = True
+        self.output_dir = output_dir
+        self.script = script
+        self.start_wall, self.start_cpu = time.perf_counter(), time.process_time()
+        atexit.register(self.write)
+
+    @contextmanager
+    def timed(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.nested.append([0.0, 0.0])
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            nested_wall, nested_cpu = self.nested.pop()
+            if self.nested:
+                self.nested[-1][0] += wall
+                self.nested[-1][1] += cpu
+            s = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "rss_high_water_kb": 0})
+            s["calls"] += 1
+            s["wall"] += wall - nested_wall
+            s["cpu"] += cpu - nested_cpu
+            s["rss_high_water_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def stage(self, name):
+        return self.timed(name) if self.enabled else nullcontext()
+
+    def iterate(self, name, iterable):
+        """Time the production of every item of ``iterable`` as stage ``name``."""
+        if not self.enabled:
+            yield from iterable
+            return
+        it = iter(iterable)
+        while True:
+            with self.timed(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self):
+        return {
+            "script": self.script,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "wall": time.perf_counter() - self.start_wall,
+            "cpu": time.process_time() - self.start_cpu,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stages": self.stages,
+        }
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"profile-{self.script}-{os.getpid()}.json")
+        with open(output_file, "w") as f:
+            json.dump(self.record(), f, indent=1)
+
+
+PROFILE = Profiler()
+
+
+def stage(name):
+    return PROFILE.stage(name)
+
+
+def iterate(name, iterable):
+    return PROFILE.iterate(name, iterable)
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Write per-stage timings and memory to profile-*.json in the output directory (or set ${PROFILE_ENV}).",
+    )
+
+
+def setup(args, output_dir):
+    """Start profiling if asked by --profile or the environment, writing into ``output_dir`` at exit."""
+    if getattr(args, "profile", False) or os.environ.get(PROFILE_ENV):
+        PROFILE.start(output_dir, pathlib.Path(sys.argv[0]).stem)
+
+
+def aggregate(profile_files):
+    """Sum the stages of profile records per script: {(script, stage): totals}."""
+    totals = {}
+    for profile_file in profile_files:
+        with open(profile_file, "r") as f:
+            record = json.load(f)
+        total = {"calls": 1, "wall": record["wall"], "cpu": record["cpu"], "rss_high_water_kb": record["max_rss_kb"]}
+        rows = dict(record["stages"], total=total)
+        for name, s in rows.items():
+            t = totals.setdefault((record["script"], name), {"runs": 0, "calls": 0, "wall": 0.0, "cpu": 0.0, "rss_high_water_kb": 0})
+            t["runs"] += 1
+            t["calls"] += s["calls"]
+            t["wall"] += s["wall"]
+            t["cpu"] += s["cpu"]
+            # records written before the rename call it peak_kb
+            t["rss_high_water_kb"] = max(t["rss_high_water_kb"], s.get("rss_high_water_kb", s.get("peak_kb", 0)))
+    return totals
+
+
+def main(args):
+    dirs = list(args.dirs)
+    if args.list_file:
+        root_dir = args.root_dir if args.root_dir else args.list_file.parent
+        with open(args.list_file, "r") as f:
+            dirs += [root_dir / line.strip() for line in f if line.strip()]
+    profile_files = [p for d in dirs for p in sorted(pathlib.Path(d).glob("profile-*.json"))]
+    totals = aggregate(profile_files)
+    wall = {script: t["wall"] for (script, name), t in totals.items() if name == "total"}
+    print("script\tstage\truns\tcalls\twall_s\tcpu_s\tshare_of_wall\trss_high_water_kb")
+    for (script, name), t in sorted(totals.items(), key=lambda x: (x[0][0], -x[1]["wall"])):
+        share = t["wall"] / wall[script] if wall.get(script) else float("nan")
+        print(f"{script}\t{name}\t{t['runs']}\t{t['calls']}\t{t['wall']:.3f}\t{t['cpu']:.3f}\t{share:.3f}\t{t['rss_high_water_kb']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("dirs", nargs="*", help="Directories holding profile-*.json records.")
+    parser.add_argument("-l", "--list-file", type=pathlib.Path, required=False, help="List of event directories.")
+    parser.add_argument("--root-dir", type=pathlib.Path, required=False, help="Directory the list entries are relative to. [directory of the list]")
+    args = parser.parse_args()
+
+    main(args)
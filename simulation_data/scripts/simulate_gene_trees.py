@@ -1,10 +1,24 @@
 import os
+import random
 import argparse
 from treeswift import *
+import numpy as np
 import dendropy
-import subprocess
+import shutil
+from functools import partial
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
+from coalescent_sim import simulate_newick
+from cu_cache import cache_key, fetch
+from compute_qqs import QuartetScorer
+from null_convergence import add_arguments, from_args
+import compressed_io
+import profiling
+import tool_runner
+from profiling import stage
 
 
 def is_float(val):
@@ -29,6 +43,207 @@ def __label_tree__(tree_obj):
     return is_labeled
 
 
+CU_TOOL = "astral4_coalescent_unit"
+CU_TREE_FILES = ["cu_tree.tree", "labelled_cu_tree.tree"]
+
+
+def run_cu_tree(input_tree, gene_trees, outdir, num_threads, timeout=None, retries=0):
+    # getting species tree in CU unit; astral4 writes into a scratch directory of its
+    # own and the tree is moved to outdir only when it succeeds (ToolError otherwise)
+    cu_tree_path = os.path.join(outdir, "cu_tree.tree")
+    with compressed_io.plain_path(gene_trees) as plain_gene_trees:
+        cmd = [
+            CU_TOOL,
+            "-C",
+            "-c",
+            os.path.abspath(input_tree),
+            "-i",
+            os.path.abspath(plain_gene_trees),
+            "-o",
+            "{scratch}/cu_tree.tree",
+            "-t",
+            str(num_threads),
+        ]
+        with stage("astral4"):
+            tool_runner.run(cmd, outputs={"cu_tree.tree": cu_tree_path}, timeout=timeout, retries=retries)
+    print("CU tree completed successfully.")
+
+    with open(cu_tree_path, "r") as f:
+        tree = f.read().strip().split("\n")[0]
+
+    tree_obj = read_tree_newick(tree)
+    __label_tree__(tree_obj)
+    # written even if astral4 labelled every branch, as the QQS and Phlag runs read this file
+    tree_obj.write_tree_newick(os.path.join(outdir, "labelled_cu_tree.tree"))
+    return tree_obj
+
+
+def get_cu_tree(input_tree, gene_trees, outdir, num_threads, cache_dir=None, cache_size=1 << 30, timeout=None, retries=0):
+    """CU species tree of ``input_tree``, labelled, with its files written to ``outdir``.
+
+    With ``cache_dir`` the CU trees are looked up by the content of the inputs and
+    the astral4 executable, and astral4 only runs on a miss. ``timeout`` and
+    ``retries`` apply to each astral4 call.
+    """
+    if cache_dir is None:
+        return run_cu_tree(input_tree, gene_trees, outdir, num_threads, timeout, retries)
+    key = cache_key([input_tree, gene_trees], CU_TOOL)
+    build = partial(run_cu_tree, input_tree, gene_trees, num_threads=num_threads, timeout=timeout, retries=retries)
+    tree_path = None
+    with fetch(cache_dir, key, build, cache_size) as entry:
+        for name in CU_TREE_FILES:
+            if os.path.exists(os.path.join(entry, name)):
+                shutil.copyfile(os.path.join(entry, name), os.path.join(outdir, name))
+                tree_path = os.path.join(outdir, name)
+    if tree_path is None:
+        raise FileNotFoundError(f"CU tree cache entry {entry} holds none of {', '.join(CU_TREE_FILES)}; remove it to rebuild")
+    with open(tree_path, "r") as f:
+        tree_obj = read_tree_newick(f.read().strip().split("\n")[0])
+    if not __label_tree__(tree_obj):
+        # entries cached before labelled_cu_tree.tree was always written
+        tree_obj.write_tree_newick(os.path.join(outdir, "labelled_cu_tree.tree"))
+    return tree_obj
+
+
+def get_contained_species_tree(tree_obj):
+    tns = dendropy.TaxonNamespace()
+    species_tree = dendropy.Tree.get(
+        data=tree_obj.newick(), schema="newick", taxon_namespace=tns
+    )
+    gene_to_species_map = dendropy.TaxonNamespaceMapping.create_contained_taxon_mapping(
+        containing_taxon_namespace=tns, num_contained=1
+    )
+    return species_tree, gene_to_species_map
+
+
+def simulate_gene_trees(species_tree, gene_to_species_map, num_genes, rng=None):
+    for i in range(num_genes):
+        yield dendropy.simulate.treesim.contained_coalescent_tree(
+            species_tree, gene_to_species_map, rng=rng
+        )
+
+
+def gene_tree_newick(gene_tree):
+    gt = read_tree_newick(gene_tree.as_string(schema="newick"))
+    for n in gt.traverse_leaves():
+        n.label = "_".join(n.label.split("_")[:-1])
+    return gt.newick()
+
+
+def batch_seeds(seed, num_batches):
+    # one independent stream per batch, so output does not depend on the pool size
+    return [
+        int(ss.generate_state(1)[0])
+        for ss in np.random.SeedSequence(seed).spawn(num_batches)
+    ]
+
+
+__worker_state__ = {}
+
+
+def __init_worker__(newick, engine):
+    __worker_state__["tree_obj"] = read_tree_newick(newick)
+    __worker_state__["engine"] = engine
+    if engine == "dendropy":
+        __worker_state__["species_tree"] = get_contained_species_tree(
+            __worker_state__["tree_obj"]
+        )
+
+
+def __simulate_batch__(seed, size):
+    if __worker_state__["engine"] == "numpy":
+        return "".join(
+            f"{gt}\n"
+            for gt in simulate_newick(
+                __worker_state__["tree_obj"], size, np.random.default_rng(seed), size
+            )
+        )
+    species_tree, gene_to_species_map = __worker_state__["species_tree"]
+    return "".join(
+        f"{gene_tree_newick(gt)}\n"
+        for gt in simulate_gene_trees(
+            species_tree, gene_to_species_map, size, rng=random.Random(seed)
+        )
+    )
+
+
+def truncate_to_batches(filepath, batch_size, num_batches):
+    # keep the complete batches only, the rest is simulated again with the same seeds
+    if not os.path.exists(filepath):
+        return 0
+    with open(filepath, "rb+") as f:
+        offsets = [0]
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offsets.append(offsets[-1] + len(line))
+        num_done = min((len(offsets) - 1) // batch_size, num_batches)
+        f.truncate(offsets[num_done * batch_size])
+    return num_done
+
+
+def simulate_to_file(
+    tree_obj,
+    output_file,
+    num_genes,
+    num_threads,
+    seed,
+    batch_size,
+    resume,
+    engine="dendropy",
+    convergence=None,
+):
+    """Simulate seeded batches into ``output_file``.
+
+    With ``convergence`` every tree is also scored against ``tree_obj`` and the
+    file ends at the tree where the quantiles converge, so it holds exactly the
+    ``convergence.num_genes`` trees of the null distribution.
+    """
+    num_batches = (num_genes + batch_size - 1) // batch_size
+    seeds = batch_seeds(seed, num_batches)
+    first_batch = truncate_to_batches(output_file, batch_size, num_batches) if resume else 0
+    sizes = [min(batch_size, num_genes - b * batch_size) for b in range(num_batches)]
+
+    scorer = None
+    if convergence is not None:
+        scorer = QuartetScorer(tree_obj)
+        if first_batch:
+            with open(output_file, "rb+") as f:
+                offset = 0
+                for line in iter(f.readline, b""):
+                    offset += len(line)
+                    if convergence.update(*scorer.score_newick(line.decode())):
+                        f.truncate(offset)
+                        return
+
+    with (open(output_file, "a") if resume else compressed_io.open_output(output_file)) as f, ProcessPoolExecutor(
+        max_workers=num_threads, initializer=__init_worker__, initargs=(tree_obj.newick(), engine)
+    ) as executor:
+        # submit a few batches ahead only, so that converged runs stop early
+        todo = zip(seeds[first_batch:], sizes[first_batch:])
+        pending = deque(executor.submit(__simulate_batch__, *b) for b in islice(todo, 2 * num_threads))
+        for _ in tqdm(range(first_batch, num_batches), total=num_batches, initial=first_batch):
+            with stage("simulate"):
+                batch = pending.popleft().result()
+            pending.extend(executor.submit(__simulate_batch__, *b) for b in islice(todo, 1))
+            converged = False
+            if scorer is not None:
+                with stage("score"):
+                    lines = batch.splitlines(keepends=True)
+                    for k, line in enumerate(lines):
+                        if convergence.update(*scorer.score_newick(line)):
+                            # drop the trees after the one where the quantiles converge
+                            batch, converged = "".join(lines[: k + 1]), True
+                            break
+            with stage("write"):
+                f.write(batch)
+                f.flush()
+            if converged:
+                for future in pending:
+                    future.cancel()
+                break
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -43,59 +258,75 @@ def main():
     parser.add_argument(
         "-o", "--outdir", required=False, default="./", help="Output directory. [CWD]"
     )
+    parser.add_argument(
+        "-s", "--seed", type=int, required=False, help="Master random seed. [random]"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=100, help="Gene trees per seeded batch. [100]"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep complete batches of an existing simulated.gtrees instead of replacing it. Needs the --seed of that run.",
+    )
+    parser.add_argument(
+        "--engine",
+        default="dendropy",
+        choices=["dendropy", "numpy"],
+        help="Coalescent simulator: dendropy, or the batched numpy engine for one individual per species.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("CU_CACHE_DIR"),
+        help="Directory caching CU trees across runs. [$CU_CACHE_DIR, no cache]",
+    )
+    parser.add_argument(
+        "--cache-size-mb", type=int, default=1024, help="Size bound of the CU tree cache. [1024]"
+    )
+    parser.add_argument(
+        "--cu-timeout", type=float, required=False, help="Seconds before astral4 is killed. [no limit]"
+    )
+    parser.add_argument(
+        "--cu-retries", type=int, default=0, help="Reruns of a failed astral4 call. [0]"
+    )
+    add_arguments(parser)
+    compressed_io.add_argument(parser)
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    if args.resume and args.seed is None:
+        parser.error("--resume needs the --seed of the interrupted run, or the batches would mix two random streams")
+    if args.resume and args.compress:
+        parser.error("--resume only works with an uncompressed simulated.gtrees")
+    os.makedirs(args.outdir, exist_ok=True)
+    profiling.setup(args, args.outdir)
 
-    # getting species tree in CU unit
-    cu_tree_path = os.path.join(args.outdir, "cu_tree.tree")
-    cmd = [
-        "astral4_coalescent_unit",
-        "-C",
-        "-c",
-        args.input_tree,
-        "-i",
-        args.gene_trees,
-        "-o",
-        cu_tree_path,
-        "-t",
-        args.num_threads,
-    ]
-    try:
-        subprocess.run(
-            cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    with stage("cu_tree"):
+        tree_obj = get_cu_tree(
+            args.input_tree,
+            args.gene_trees,
+            args.outdir,
+            args.num_threads,
+            args.cache_dir,
+            args.cache_size_mb << 20,
+            args.cu_timeout,
+            args.cu_retries,
         )
-        print("CU tree completed successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error: Command failed with return code {e.returncode}")
-    except FileNotFoundError:
-        print("Error: 'astral4_coalescent_unit' not found in PATH.")
-
-    with open(cu_tree_path, "r") as f:
-        tree = f.read().strip().split("\n")[0]
-
-    tree_obj = read_tree_newick(tree)
-    is_labeled = __label_tree__(tree_obj)
-    labels = [n.label for n in tree_obj.traverse_internal() if not n.is_root()]
-    if not is_labeled:
-        tree_obj.write_tree_newick(os.path.join(args.outdir, "labelled_cu_tree.tree"))
 
     # simulating gene trees
-    tns = dendropy.TaxonNamespace()
-    species_tree = dendropy.Tree.get(
-        data=tree_obj.newick(), schema="newick", taxon_namespace=tns
+    convergence = from_args(args)
+    simulate_to_file(
+        tree_obj,
+        os.path.join(args.outdir, compressed_io.output_name("simulated.gtrees", args.compress)),
+        int(args.num_genes),
+        int(args.num_threads),
+        args.seed,
+        args.batch_size,
+        args.resume,
+        args.engine,
+        convergence,
     )
-    gene_to_species_map = dendropy.TaxonNamespaceMapping.create_contained_taxon_mapping(
-        containing_taxon_namespace=tns, num_contained=1
-    )
-
-    for i in tqdm(range(int(args.num_genes))):
-        gene_tree = dendropy.simulate.treesim.contained_coalescent_tree(
-            species_tree, gene_to_species_map
-        )
-        gt = read_tree_newick(gene_tree.as_string(schema="newick"))
-        for n in gt.traverse_leaves():
-            n.label = "_".join(n.label.split("_")[:-1])
-        with open(os.path.join(args.outdir, "simulated.gtrees"), "a") as file:
-            file.write(f"{gt.newick()}\n")
+    if convergence is not None:
+        convergence.write(os.path.join(args.outdir, "simulated.convergence.json"), int(args.num_genes))
 
 
 if __name__ == "__main__":
@@ -4,16 +4,24 @@ import argparse
 import treeswift as ts
 import numpy as np
 from pathlib import Path
+from emission_overlay import file_checksum, write_overlay
+from event_catalog import write_info
+from gtrees_io import count_trees, iter_gene_trees
+import event_batch
+import compressed_io
+import profiling
+from profiling import iterate, stage
 
 
-def count_trees(filepath):
+# options an --events table may set per event
+EVENT_COLUMNS = {"discordant_portion": float, "num_blocks": int, "recipient": str, "donor": str, "output_dir": Path, "seed": int}
+
+
+def is_float(val):
     try:
-        with open(filepath, "r") as f:
-            line_count = sum(1 for line in f)
-        return line_count
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise e
+        return float(val) == float(val)
+    except (ValueError, TypeError):
+        return False
 
 
 def label_tree(tree):
@@ -31,24 +39,70 @@ def label_tree(tree):
     return tree
 
 
-def switch_taxa(tree, recipient, donor):
-    lbl2node = tree.label_to_node(selection="all")
-    try:
-        lbl2node[recipient].label = donor
-    except KeyError:
+def leaf_label_spans(newick):
+    """Yield (start, end) of every leaf label token of a newick string without building a tree."""
+    i, n = 0, len(newick)
+    leaf = False
+    while i < n:
+        c = newick[i]
+        if c == "[":
+            i = newick.index("]", i) + 1
+        elif c in "(,":
+            leaf = True
+            i += 1
+        elif c.isspace():
+            i += 1
+        elif leaf and c == "'":
+            j = i + 1
+            while True:
+                j = newick.index("'", j) + 1
+                if newick[j : j + 1] != "'":
+                    break
+                j += 1
+            yield i, j
+            leaf = False
+            i = j
+        elif leaf and c not in "):;":
+            j = i
+            while j < n and newick[j] not in "(),:;[":
+                j += 1
+            yield i, len(newick[i:j].rstrip()) + i
+            leaf = False
+            i = j
+        else:
+            leaf = False
+            i += 1
+
+
+def switch_taxa(newick, recipient, donor):
+    spans = {}
+    for i, j in leaf_label_spans(newick):
+        lbl = newick[i:j]
+        if lbl[:1] == "'":
+            lbl = lbl[1:-1].replace("''", "'")
+        if lbl in (recipient, donor):
+            spans[lbl] = (i, j)
+    if recipient not in spans:
         raise KeyError(f"Reciepient {recipient} not found in tree")
-    try:
-        lbl2node[donor].label = recipient
-    except KeyError:
+    if donor not in spans:
         raise KeyError(f"Donor {donor} not found in tree")
-    return tree.newick()
+    if recipient == donor:
+        return newick
+    (i1, j1), (i2, j2) = sorted(spans.values())
+    return newick[:i1] + newick[i2:j2] + newick[j1:i2] + newick[i1:j1] + newick[j2:]
 
 
-def simulate_introgression_event(gene_trees_l, dstart, dend, donor, recipient):
-    for i, j in zip(dstart, dend):
-        for ix in range(i, j):
-            gene_trees_l[ix] = switch_taxa(ts.read_tree_newick(gene_trees_l[ix].strip()), recipient, donor) + "\n"
-    return gene_trees_l
+def simulate_introgression_event(gene_trees_f, dstart, dend, donor, recipient):
+    """Yield (index, tree, switched) for every line, relabelling the lines inside the blocks."""
+    blocks = iter(zip(dstart, dend))
+    block = next(blocks, None)
+    for ix, gt in enumerate(gene_trees_f):
+        while block is not None and ix >= block[1]:
+            block = next(blocks, None)
+        if block is not None and ix >= block[0]:
+            yield ix, switch_taxa(gt.strip(), recipient, donor) + "\n", True
+        else:
+            yield ix, gt, False
 
 
 def positive_integers_with_sum(n, total):
@@ -77,9 +131,8 @@ def f(z, w, a, b):
     return rv
 
 
-def simulate_separate_blocks(gene_trees, p, b):
+def simulate_separate_blocks(gc, p, b):
     bb = np.random.poisson(b) + 1
-    gc = count_trees(gene_trees)
     assert p < 0.5
     size = int(gc * p)
     size_b = size // (bb) + 1
@@ -88,25 +141,19 @@ def simulate_separate_blocks(gene_trees, p, b):
     return dstart, dend
 
 
-def save_event(output_dir, gene_trees_l, metadata):
-    with open(output_dir / "emission.gtrees", "w") as f:
-        for i, gt in enumerate(gene_trees_l):
-            f.write(gt)
-    with open(output_dir / "info.txt", "w") as f:
-        f.write(f"type: separate_blocks\n")
-        f.write(f"start: {metadata['start']}\n")
-        f.write(f"end: {metadata['end']}\n")
-        f.write(f"gc: {metadata['gc']}\n")
-        f.write(f"gene_trees: {metadata['gene_trees']}\n")
-        f.write(f"p: {metadata['p']}\n")
-        f.write(f"b: {metadata['b']}\n")
-        f.write(f"donor: {metadata['donor']}\n")
-        f.write(f"recipient: {metadata['recipient']}\n")
-        f.write(f"clade: {metadata['clade']}")
-
-
-def get_target_clade(species_tree, donor, recipient):
-    tree = label_tree(ts.read_tree_newick(species_tree))
+def save_event(output_dir, emission, metadata, overlay=False, sha256=None, compress=None):
+    if overlay:
+        changes = ((i, gt) for i, gt, switched in emission if switched)
+        write_overlay(output_dir / "emission.overlay", metadata["gene_trees"], changes, metadata["gc"], sha256)
+    else:
+        with compressed_io.open_output(output_dir / compressed_io.output_name("emission.gtrees", compress)) as f:
+            for i, gt, switched in emission:
+                f.write(gt)
+    keys = ["start", "end", "gc", "gene_trees", "p", "b", "donor", "recipient", "clade"]
+    write_info(output_dir, {"type": "separate_blocks", **{k: metadata[k] for k in keys}})
+
+
+def get_target_clade(tree, donor, recipient):
     nd_to_lbl = tree.label_to_node(selection="all")
     nd_parent = tree.mrca({donor, recipient})
     donor = nd_to_lbl[donor]
@@ -118,7 +165,11 @@ def get_target_clade(species_tree, donor, recipient):
     return recipient.get_parent().get_label()
 
 
-def main(args):
+def simulate_event(args, base=None):
+    """Simulate and save one event; ``base`` is (lines, count, checksum, labelled species tree) for a batch."""
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
     output_dir = args.output_dir
     gene_trees = args.gene_trees
     species_tree = args.species_tree
@@ -132,25 +183,51 @@ def main(args):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    dstart, dend = simulate_separate_blocks(gene_trees, p, b)
+    if base is None:
+        with stage("read"):
+            gc = count_trees(gene_trees)
+        with stage("parse"):
+            tree = label_tree(ts.read_tree_newick(species_tree))
+        base = (iter_gene_trees(gene_trees), gc, None, tree)
+    gene_trees_l, gc, sha256, tree = base
+    dstart, dend = simulate_separate_blocks(gc, p, b)
+    metadata = {"type": "separate_blocks", "start": dstart, "end": dend, "gc": gc, "gene_trees": gene_trees, "p": p, "b": b, "recipient": recipient, "donor": donor}
+    metadata["clade"] = get_target_clade(tree, donor, recipient)
+    emission = simulate_introgression_event(gene_trees_l, dstart, dend, donor, recipient)
+    with stage("write"):
+        save_event(output_dir, iterate("perturb", emission), metadata, args.overlay, sha256, args.compress)
+
 
-    with open(gene_trees, "r") as f:
-        gene_trees_l = simulate_introgression_event(f.readlines(), dstart, dend, donor, recipient)
-    metadata = {"type": "separate_blocks", "start": dstart, "end": dend, "gc": count_trees(gene_trees), "gene_trees": gene_trees, "p": p, "b": b, "recipient": recipient, "donor": donor}
-    metadata["clade"] = get_target_clade(species_tree, donor, recipient)
-    save_event(output_dir, gene_trees_l, metadata)
+def main(args):
+    if args.batch is None:
+        profiling.setup(args, args.output_dir)
+        simulate_event(args)
+        return
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.events)))
+    with stage("read"):
+        gene_trees_l = list(iter_gene_trees(args.gene_trees))
+        sha256 = file_checksum(args.gene_trees) if args.overlay else None
+    with stage("parse"):
+        tree = label_tree(ts.read_tree_newick(args.species_tree))
+    for event in args.batch:
+        simulate_event(event, (gene_trees_l, len(gene_trees_l), sha256, tree))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-s", "--species-tree", required=True, help="File for species trees to select the target branch.")
-    parser.add_argument("-g", "--gene-trees", required=True, help="File for gene trees to modify.")
-    parser.add_argument("-p", "--discordant-portion", required=True, type=float, help="Portion of the region of the genome with recombination suppression.")
+    parser.add_argument("-g", "--gene-trees", required=True, help="File (or store) for gene trees to modify.")
+    parser.add_argument("-p", "--discordant-portion", required=False, type=float, help="Portion of the region of the genome with recombination suppression. (required without --events)")
 
     parser.add_argument("-b", "--num-blocks", required=False, type=int, default=1, help="Number of blocks to distribute the introgression event.")
-    parser.add_argument("-r", "--recipient", required=True, help="Label of the recipient taxon.")
-    parser.add_argument("-d", "--donor", required=True, help="Label of the donor taxon.")
-    parser.add_argument("-o", "--output-dir", required=True, type=Path, help="Output directory.")
-    args = parser.parse_args()
+    parser.add_argument("-r", "--recipient", required=False, help="Label of the recipient taxon. (required without --events)")
+    parser.add_argument("-d", "--donor", required=False, help="Label of the donor taxon. (required without --events)")
+    parser.add_argument("-o", "--output-dir", required=False, type=Path, help="Output directory. (required without --events)")
+    parser.add_argument("--overlay", action="store_true", help="Write emission.overlay with the modified lines only instead of emission.gtrees.")
+    parser.add_argument("--seed", type=int, required=False, help="Random seed.")
+    event_batch.add_argument(parser)
+    compressed_io.add_argument(parser)
+    profiling.add_argument(parser)
+    args = event_batch.parse_args(parser, EVENT_COLUMNS, ["discordant_portion", "recipient", "donor", "output_dir"])
 
     main(args)
@@ -2,23 +2,22 @@ import os
 import random
 import argparse
 from pathlib import Path
+from itertools import zip_longest
+from emission_overlay import file_checksum, write_overlay
+from event_catalog import write_info
+from gtrees_io import count_trees, iter_gene_trees
+import event_batch
+import compressed_io
+import profiling
+from profiling import iterate, stage
 
 
-def count_trees(filepath):
-    try:
-        with open(filepath, "r") as f:
-            line_count = sum(1 for line in f)
-        return line_count
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise e
+BUFFER_SIZE = 1 << 20
+# options an --events table may set per event
+EVENT_COLUMNS = {"discordant_portion": float, "rate": float, "output_dir": str, "seed": int}
 
 
-def simulate_independent_region(default_gtrees, discordant_gtrees, p, rate):
-    default_gc = count_trees(default_gtrees)
-    discordant_gc = count_trees(discordant_gtrees)
-    assert default_gc == discordant_gc
-    gc = default_gc = discordant_gc
+def simulate_independent_region(gc, p, rate):
     assert p < 0.5
     assert rate <= 1.0
     r = p / rate
@@ -33,39 +32,67 @@ def simulate_independent_region(default_gtrees, discordant_gtrees, p, rate):
     return dstart, dend, vl
 
 
+def check_lengths(default_gtrees, discordant_gtrees, default_count, discordant_count):
+    # checked before anything is written, a failed splice would leave a partial emission
+    if default_count != discordant_count:
+        raise ValueError(
+            f"Gene tree files differ in length: {default_gtrees} has {default_count} trees, "
+            f"{discordant_gtrees} has {discordant_count}"
+        )
+
+
+def splice_trees(default_f, discordant_f, dstart, dend, vl):
+    """Read both files in lockstep, yielding (index, tree, is_discordant).
+
+    Lines in [dstart, dend) come from the discordant file unless their index is in
+    the sorted list ``vl``, which is consumed with a cursor.
+    """
+    vi = 0
+    for i, (gt, dt) in enumerate(zip_longest(default_f, discordant_f)):
+        if gt is None or dt is None:
+            raise ValueError("Gene tree files differ in length")
+        if dstart <= i < dend:
+            if vi < len(vl) and vl[vi] == i:
+                vi += 1
+            else:
+                yield i, dt, True
+                continue
+        yield i, gt, False
+
+
 def save_event(
-    output_dir, default_gtrees, discordant_gtrees, dstart, dend, vl
+    output_dir, default_gtrees, discordant_gtrees, gc, dstart, dend, vl, overlay=False, base=None, compress=None
 ):
-    default_f = open(default_gtrees, "r")
-    discordant_f = open(discordant_gtrees, "r")
-    default_gtrees_l = default_f.readlines()
-    discordant_gtrees_l = discordant_f.readlines()
-    default_len = len(default_gtrees_l)
-    discordant_len = len(discordant_gtrees_l)
-    assert default_len == discordant_len
-
-    with open(output_dir / "emission.gtrees", "w") as f:
-        for i, gt in enumerate(default_gtrees_l):
-            if i in vl:
-                gt = default_gtrees_l[i]
-            elif i >= dstart and i < dend:
-                gt = discordant_gtrees_l[i]
-            f.write(gt)
-
-    default_f.close()
-    discordant_f.close()
-    with open(output_dir / "info.txt", "w") as f:
-        f.write(f"type: single_independent\n")
-        f.write(f"start: {dstart}\n")
-        f.write(f"end: {dend}\n")
-        f.write(f"default_gtrees: {default_gtrees}\n")
-        f.write(f"discordant_gtrees: {discordant_gtrees}\n")
-        f.write(f"p: {(dend - dstart)/float(default_len)}\n")
-        f.write(f"r: {1.0-len(vl)/float(dend-dstart)}\n")
-        f.write(f"v: {vl}")
+    # base: (default lines, discordant lines, checksum of the default file) loaded once for a batch
+    if base is None:
+        base = (iter_gene_trees(default_gtrees), iter_gene_trees(discordant_gtrees), None)
+    default_l, discordant_l, sha256 = base
+    spliced = iterate("perturb", splice_trees(default_l, discordant_l, dstart, dend, vl))
+    if overlay:
+        changes = ((i, gt) for i, gt, is_discordant in spliced if is_discordant)
+        write_overlay(output_dir / "emission.overlay", default_gtrees, changes, gc, sha256)
+    else:
+        emission = output_dir / compressed_io.output_name("emission.gtrees", compress)
+        with compressed_io.open_output(emission, buffering=BUFFER_SIZE) as f:
+            for i, gt, is_discordant in spliced:
+                f.write(gt)
 
+    write_info(output_dir, {
+        "type": "single_independent",
+        "start": dstart,
+        "end": dend,
+        "gc": gc,
+        "default_gtrees": default_gtrees,
+        "discordant_gtrees": discordant_gtrees,
+        "p": (dend - dstart) / float(gc),
+        "r": 1.0 - len(vl) / float(dend - dstart),
+        "v": vl,
+    })
 
-def main(args):
+
+def simulate_event(args, base=None):
+    if args.seed is not None:
+        random.seed(args.seed)
     output_dir = args.output_dir
     default_gtrees = args.default_gene_trees
     discordant_gtrees = args.discordant_gene_trees
@@ -75,17 +102,43 @@ def main(args):
     os.makedirs(output_dir, exist_ok=True)
     output_dir = Path(output_dir)
 
-    dstart, dend, vl = simulate_independent_region(
-        default_gtrees, discordant_gtrees, p, r
-    )
-    save_event(
-        output_dir,
-        default_gtrees,
-        discordant_gtrees,
-        dstart,
-        dend,
-        vl,
-    )
+    if base is None:
+        with stage("read"):
+            gc = count_trees(default_gtrees)
+            check_lengths(default_gtrees, discordant_gtrees, gc, count_trees(discordant_gtrees))
+    else:
+        gc = len(base[0])
+    dstart, dend, vl = simulate_independent_region(gc, p, r)
+    with stage("write"):
+        save_event(
+            output_dir,
+            default_gtrees,
+            discordant_gtrees,
+            gc,
+            dstart,
+            dend,
+            vl,
+            args.overlay,
+            base,
+            args.compress,
+        )
+
+
+def main(args):
+    if args.batch is None:
+        profiling.setup(args, args.output_dir)
+        simulate_event(args)
+        return
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.events)))
+    with stage("read"):
+        base = (
+            list(iter_gene_trees(args.default_gene_trees)),
+            list(iter_gene_trees(args.discordant_gene_trees)),
+            file_checksum(args.default_gene_trees) if args.overlay else None,
+        )
+        check_lengths(args.default_gene_trees, args.discordant_gene_trees, len(base[0]), len(base[1]))
+    for event in args.batch:
+        simulate_event(event, base)
 
 
 if __name__ == "__main__":
@@ -108,8 +161,8 @@ if __name__ == "__main__":
         "-p",
         "--discordant-portion",
         type=float,
-        required=True,
-        help="Portion of the discordant segment.",
+        required=False,
+        help="Portion of the discordant segment. (required without --events)",
     )
     parser.add_argument(
         "-r",
@@ -119,7 +172,16 @@ if __name__ == "__main__":
         default=1.0,
         help="Desired rate of the discordant segment.",
     )
-    parser.add_argument("-o", "--output-dir", required=True, help="Output directory.")
-    args = parser.parse_args()
+    parser.add_argument("-o", "--output-dir", required=False, help="Output directory. (required without --events)")
+    event_batch.add_argument(parser)
+    parser.add_argument(
+        "--overlay",
+        action="store_true",
+        help="Write emission.overlay with the modified lines only instead of emission.gtrees.",
+    )
+    parser.add_argument("--seed", type=int, required=False, help="Random seed.")
+    compressed_io.add_argument(parser)
+    profiling.add_argument(parser)
+    args = event_batch.parse_args(parser, EVENT_COLUMNS, ["discordant_portion", "output_dir"])
 
     main(args)
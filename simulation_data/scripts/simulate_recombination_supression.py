@@ -2,49 +2,131 @@ import os
 import argparse
 import random
 import treeswift as ts
+from treeswift.Node import UNSAFE_SYMBOLS
 
 from pathlib import Path
+from emission_overlay import file_checksum, write_overlay
+from event_catalog import write_info
+from gtrees_io import count_trees, iter_gene_trees
+import event_batch
+import compressed_io
+import profiling
+from profiling import stage
 
 
-def count_trees(filepath):
-    try:
-        with open(filepath, "r") as f:
-            line_count = sum(1 for line in f)
-        return line_count
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise e
+OPTIONS = ["fixed", "random", "support"]
 
 
-def get_random_internal_node(tree):
-    nd_list = list(tree.traverse_postorder(leaves=False, internal=True))
+def event_option(value):
+    if value not in OPTIONS:
+        raise ValueError(value)
+    return value
+
+
+# options an --events table may set per event
+EVENT_COLUMNS = {"discordant_portion": float, "rate": float, "option": event_option, "output_dir": Path, "seed": int}
+
+
+class TreeTemplate:
+    """A gene tree parsed once into child lists, with preformatted newick pieces.
+
+    Perturbed copies only duplicate the child lists; labels, branch lengths and the
+    nodes eligible for NNI are shared, so no copy is ever re-parsed.
+    """
+
+    def __init__(self, newick):
+        tree = ts.read_tree_newick(newick)
+        nodes = list(tree.traverse_preorder())
+        index = {nd: i for i, nd in enumerate(nodes)}
+        self.root = index[tree.root]
+        self.children = [[index[c] for c in nd.child_nodes()] for nd in nodes]
+        self.parent = [index[nd.get_parent()] if not nd.is_root() else -1 for nd in nodes]
+        self.opening = [label_str(nd) + branch_str(nd) if nd.is_leaf() else "(" for nd in nodes]
+        self.closing = [")" + label_str(nd) + branch_str(nd) for nd in nodes]
+        self.closing[self.root] = ")" + label_str(tree.root)
+        self.prefix = "[&R] " if tree.is_rooted else ""
+        self.suffix = tree.newick()[len(self.prefix) + len(tree.root.newick()):]
+        # same visiting order as traverse_postorder on a freshly parsed copy
+        self.internal = [index[nd] for nd in tree.traverse_postorder(leaves=False, internal=True)]
+        self.support = {
+            index[nd]: float(nd.get_label())
+            for nd in tree.traverse_postorder(leaves=False, internal=True)
+            if (not nd.is_root()) and (nd.get_label() is not None)
+        }
+
+    def copy(self):
+        return [list(ch) for ch in self.children], list(self.parent)
+
+    def newick(self, children):
+        out = [self.prefix]
+        stack = [[self.root, 0]]
+        while stack:
+            top = stack[-1]
+            nd, i = top
+            if i == 0:
+                out.append(self.opening[nd])
+                if not children[nd]:
+                    stack.pop()
+                    continue
+            if i < len(children[nd]):
+                if i > 0:
+                    out.append(",")
+                top[1] += 1
+                stack.append([children[nd][i], 0])
+            else:
+                out.append(self.closing[nd])
+                stack.pop()
+        out.append(self.suffix)
+        return "".join(out)
+
+
+def label_str(nd):
+    if nd.get_label() is None:
+        return ""
+    s = str(nd.get_label())
+    for c in UNSAFE_SYMBOLS:
+        if c in s:
+            return f"'{s}'"
+    return s
+
+
+def branch_str(nd):
+    e = nd.get_edge_length()
+    if e is None:
+        return ""
+    if isinstance(e, float) and e.is_integer():
+        return f":{int(e)}"
+    return f":{e}"
+
+
+def get_random_internal_node(template, children, parent):
+    nd_list = list(template.internal)
     while True:
         random.shuffle(nd_list)
         nd = nd_list[0]
-        if not nd.is_root() and len(nd.get_parent().child_nodes()) > 1:
+        if parent[nd] >= 0 and len(children[parent[nd]]) > 1:
             break
-    return tree, nd
+    return nd
 
 
-def drop_nni(nd):
-    assert not nd.is_root()
-    assert len(nd.get_parent().child_nodes()) > 1
-    nd_parent = nd.get_parent()
-    nd_child = random.sample(nd.child_nodes(), 1)[0]
-    for nd_curr in nd_parent.child_nodes():
+def drop_nni(nd, children, parent):
+    assert parent[nd] >= 0
+    assert len(children[parent[nd]]) > 1
+    nd_parent = parent[nd]
+    nd_child = random.sample(children[nd], 1)[0]
+    for nd_curr in children[nd_parent]:
         if nd_curr != nd:
             nd_sibling = nd_curr
-    nd_parent.remove_child(nd_sibling)
-    nd_parent.add_child(nd_child)
-    nd.remove_child(nd_child)
-    nd.add_child(nd_sibling)
-    nd_child.set_parent(nd_parent)
-    nd_sibling.set_parent(nd)
+    children[nd_parent].remove(nd_sibling)
+    children[nd_parent].append(nd_child)
+    children[nd].remove(nd_child)
+    children[nd].append(nd_sibling)
+    parent[nd_child] = nd_parent
+    parent[nd_sibling] = nd
     return nd
 
 
-def simulate_independent_region(gene_trees, p):
-    gc = count_trees(gene_trees)
+def simulate_independent_region(gc, p):
     assert p < 0.5
     size = int(gc * p)
     dstart = random.randint(1, gc - size)
@@ -70,39 +152,42 @@ def fixed_suppressed_trees(gt1, gt2, i, dstart, dend, r):
         return gt1, 0
 
 
-def random_suppressed_trees(gt1, gt2, i, dstart, dend, r):
+def random_suppressed_trees(gt1, template, i, dstart, dend, r):
     if i > dstart and i < dend:
         if random.random() < r:
-            ntree, nd = get_random_internal_node(ts.read_tree_newick(gt2))
-            nd = drop_nni(nd)
-            return ntree.newick() + "\n", 0
+            children, parent = template.copy()
+            nd = get_random_internal_node(template, children, parent)
+            nd = drop_nni(nd, children, parent)
+            return template.newick(children) + "\n", 0
         else:
             return gt1, i
     else:
         return gt1, 0
 
 
-def support_suppressed_trees(gt1, gt2, i, dstart, dend, r):
+def support_suppressed_trees(gt1, template, i, dstart, dend, r):
     c = 0
     if i > dstart and i < dend:
-        ntree = ts.read_tree_newick(gt2)
-        for nd in ntree.traverse_postorder(leaves=False, internal=True):
+        children, parent = template.copy()
+        for nd in template.internal:
             if (
-                (not nd.is_root())
-                and (len(nd.get_parent().child_nodes()) > 1)
-                and (nd.get_label() is not None)
+                (nd in template.support)
+                and (len(children[parent[nd]]) > 1)
             ):
-                s = float(nd.get_label())
+                s = template.support[nd]
                 if random.random() < (1.0 - (r * s)):
-                    nd = drop_nni(nd)
+                    nd = drop_nni(nd, children, parent)
                     c += 1
-        return ntree.newick() + "\n", c
+        return template.newick(children) + "\n", c
     else:
         return gt1, 0
 
 
 def simulate_suppression_event(gene_trees_l, dstart, dend, option, r):
     vl = []
+    template = None
+    if option in ("random", "support"):
+        template = TreeTemplate(gene_trees_l[dstart])
     for i, gt in enumerate(gene_trees_l):
         if option == "fixed":
             gt, v = fixed_suppressed_trees(
@@ -110,11 +195,11 @@ def simulate_suppression_event(gene_trees_l, dstart, dend, option, r):
             )
         elif option == "random":
             gt, v = random_suppressed_trees(
-                gene_trees_l[i], gene_trees_l[dstart], i, dstart, dend, r
+                gene_trees_l[i], template, i, dstart, dend, r
             )
         elif option == "support":
             gt, v = support_suppressed_trees(
-                gene_trees_l[i], gene_trees_l[dstart], i, dstart, dend, r
+                gene_trees_l[i], template, i, dstart, dend, r
             )
         if v > 0:
             vl.append(v)
@@ -122,23 +207,22 @@ def simulate_suppression_event(gene_trees_l, dstart, dend, option, r):
     return gene_trees_l, vl
 
 
-def save_event(output_dir, gene_trees_l, metadata):
-    with open(output_dir / "emission.gtrees", "w") as f:
-        for i, gt in enumerate(gene_trees_l):
-            f.write(gt)
-    with open(output_dir / "info.txt", "w") as f:
-        f.write(f"type: single_independent\n")
-        f.write(f"start: {metadata['start']}\n")
-        f.write(f"end: {metadata['end']}\n")
-        f.write(f"gc: {metadata['gc']}\n")
-        f.write(f"gene_trees: {metadata['gene_trees']}\n")
-        f.write(f"p: {metadata['p']}\n")
-        f.write(f"r: {metadata['r']}\n")
-        f.write(f"v: {metadata['v']}\n")
-        f.write(f"option: {metadata['option']}")
+def save_event(output_dir, gene_trees_l, metadata, base_l=None, sha256=None, compress=None):
+    if base_l is not None:
+        changes = ((i, gt) for i, (gt, bt) in enumerate(zip(gene_trees_l, base_l)) if gt != bt)
+        write_overlay(output_dir / "emission.overlay", metadata["gene_trees"], changes, metadata["gc"], sha256)
+    else:
+        with compressed_io.open_output(output_dir / compressed_io.output_name("emission.gtrees", compress)) as f:
+            for i, gt in enumerate(gene_trees_l):
+                f.write(gt)
+    keys = ["start", "end", "gc", "gene_trees", "p", "r", "v", "option"]
+    write_info(output_dir, {"type": "single_independent", **{k: metadata[k] for k in keys}})
 
 
-def main(args):
+def simulate_event(args, base=None):
+    """Simulate and save one event; ``base`` is (lines, count, checksum) of the gene trees for a batch."""
+    if args.seed is not None:
+        random.seed(args.seed)
     output_dir = args.output_dir
     gene_trees = args.gene_trees
     p = args.discordant_portion
@@ -152,24 +236,41 @@ def main(args):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    dstart, dend = simulate_independent_region(gene_trees, p)
-
-    with open(gene_trees, "r") as f:
+    if base is None:
+        with stage("read"):
+            base = (list(iter_gene_trees(gene_trees)), count_trees(gene_trees), None)
+    base_l, gc, sha256 = base
+    dstart, dend = simulate_independent_region(gc, p)
+    with stage("perturb"):
         gene_trees_l, vl = simulate_suppression_event(
-            f.readlines(), dstart, dend, option, r
+            list(base_l), dstart, dend, option, r
         )
     metadata = {
         "type": "recombination_suppression",
         "start": dstart,
         "end": dend,
-        "gc": count_trees(gene_trees),
+        "gc": gc,
         "gene_trees": gene_trees,
         "p": p,
         "r": r,
         "v": vl,
         "option": option,
     }
-    save_event(output_dir, gene_trees_l, metadata)
+    with stage("write"):
+        save_event(output_dir, gene_trees_l, metadata, base_l if args.overlay else None, sha256, args.compress)
+
+
+def main(args):
+    if args.batch is None:
+        profiling.setup(args, args.output_dir)
+        simulate_event(args)
+        return
+    profiling.setup(args, os.path.dirname(os.path.abspath(args.events)))
+    with stage("read"):
+        base_l = list(iter_gene_trees(args.gene_trees))
+        base = (base_l, len(base_l), file_checksum(args.gene_trees) if args.overlay else None)
+    for event in args.batch:
+        simulate_event(event, base)
 
 
 if __name__ == "__main__":
@@ -181,14 +282,14 @@ if __name__ == "__main__":
         "--gene-trees",
         required=True,
         type=Path,
-        help="File for gene trees to use.",
+        help="File (or store) for gene trees to use.",
     )
     parser.add_argument(
         "-p",
         "--discordant-portion",
-        required=True,
+        required=False,
         type=float,
-        help="Portion of the region of the genome with recombination suppression.",
+        help="Portion of the region of the genome with recombination suppression. (required without --events)",
     )
     parser.add_argument(
         "-r",
@@ -199,16 +300,25 @@ if __name__ == "__main__":
         help="Rate of the gene tree mimicking recombination suppression.",
     )
     parser.add_argument(
-        "-o", "--output-dir", required=True, type=Path, help="Output directory."
+        "-o", "--output-dir", required=False, type=Path, help="Output directory. (required without --events)"
     )
+    event_batch.add_argument(parser)
     parser.add_argument(
         "--option",
         required=False,
         type=str,
         default="fixed",
-        choices=["fixed", "random", "support"],
+        choices=OPTIONS,
         help="Option for the trees in the suppressed region: fixed, random, support.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--overlay",
+        action="store_true",
+        help="Write emission.overlay with the modified lines only instead of emission.gtrees.",
+    )
+    parser.add_argument("--seed", type=int, required=False, help="Random seed.")
+    compressed_io.add_argument(parser)
+    profiling.add_argument(parser)
+    args = event_batch.parse_args(parser, EVENT_COLUMNS, ["discordant_portion", "output_dir"])
 
     main(args)
@@ -1,31 +1,75 @@
-import sys
-import fileinput
+import os
+import argparse
 import treeswift as ts
-import numpy as np
 
-if __name__ == "__main__":
-    try:
-        tree = ts.read_tree_newick(sys.argv[1])
-        nd_to_lbl = tree.label_to_node(selection="all")
-    except AttributeError:
-        pass
+import profiling
+from profiling import stage
+
+
+def root_distance_moments(tree):
+    # count, mean and sum of squared deviations (M2) of the distances from each
+    # node to the labelled nodes below it (itself included), as in
+    # distances_from_root; children are merged with Chan et al.'s pairwise update,
+    # which stays exact when the variance is near 0 (near-ultrametric subtrees)
+    # unlike the difference of raw moments
+    moments = {}
+    for nd in tree.traverse_postorder():
+        c, mean, m2 = (1, 0.0, 0.0) if nd.get_label() is not None else (0, 0.0, 0.0)
+        for ch in nd.child_nodes():
+            cc, cmean, cm2 = moments[ch]
+            if cc == 0:
+                continue
+            # the branch shifts every distance below ch by its length, M2 is unchanged
+            delta = cmean + (ch.get_edge_length() or 0.0) - mean
+            n = c + cc
+            mean += delta * cc / n
+            m2 += cm2 + delta * delta * c * cc / n
+            c = n
+        moments[nd] = (c, mean, m2)
+    return moments
 
+
+def list_triplets(tree):
+    # leaf pairs at topological distance 3: a leaf child of ndp and a leaf
+    # grandchild of ndp, with the variance of root-to-leaf distances below ndp
+    with stage("moments"):
+        moments = root_distance_moments(tree)
     um_ins = []
-    for ix, line in enumerate(fileinput.input()):
-        if ix == 0:
+    for ndp in tree.traverse_postorder(leaves=False, internal=True):
+        children = ndp.child_nodes()
+        leaves = [nd for nd in children if nd.is_leaf()]
+        if not leaves:
             continue
-        nd1, nd2 = line.strip().split(" ")
-        ndp = tree.mrca({nd1, nd2})
-        nd1 = nd_to_lbl[nd1]
-        nd2 = nd_to_lbl[nd2]
-        if nd1.get_parent().get_label() != ndp.get_label():
-            nd_tmp = nd2
-            nd2 = nd1
-            nd1 = nd_tmp
-        tree_sub = tree.extract_subtree(ndp)
-        dist_l = [dist for nd, dist in tree_sub.distances_from_root(leaves=True)]
-        # um_ins.append((line.strip().split(" "), sum(dist_l) / len(dist_l)))
-        um_ins.append(((nd1.get_label(), nd2.get_label()), np.var(dist_l), nd2.get_parent().get_edge_length()))
+        c, _, m2 = moments[ndp]
+        var = m2 / c
+        for ndc in children:
+            if ndc.is_leaf():
+                continue
+            for nd2 in ndc.child_nodes():
+                if not nd2.is_leaf():
+                    continue
+                for nd1 in leaves:
+                    um_ins.append(((nd1.get_label(), nd2.get_label()), var, ndc.get_edge_length()))
+    return sorted(um_ins, key=lambda x: x[1])
+
+
+def main(args):
+    with stage("parse"):
+        tree = ts.read_tree_newick(args.tree)
+    with stage("triplets"):
+        um_ins = list_triplets(tree)
     if um_ins:
-        um_ins = list(sorted(um_ins, key=lambda x: x[1]))
-        print("\n".join(list(map(lambda x: f"{x[0][0]}\t{x[0][1]}\t{x[1]}\t{x[2]}", um_ins))))
+        with stage("write"):
+            print("\n".join(list(map(lambda x: f"{x[0][0]}\t{x[0][1]}\t{x[1]}\t{x[2]}", um_ins))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("tree", help="Species tree (Newick string or file).")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.setup(args, os.getcwd())
+
+    main(args)
@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import shlex
+import hashlib
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from compressed_io import output_name
+from emission_overlay import file_checksum
+from event_batch import seed_of
+import profiling
+from profiling import stage
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = ".sweep"
+
+
+def lbl(v):
+    return str(v).replace(".", "")
+
+
+def read_pairs(pairs_file):
+    # recipient, donor (and candidate statistics) per line
+    with open(pairs_file, "r") as f:
+        return [line.rstrip("\n").split("\t")[:2] for line in f if line.strip()]
+
+
+def task(tid, cmd, inputs, outputs, deps=()):
+    return {"id": tid, "cmd": cmd, "inputs": list(inputs), "outputs": list(outputs), "deps": list(deps)}
+
+
+def null_task(grid, root, rep):
+    species_tree = os.path.join(root, grid["species_tree"].format(rep=rep))
+    gene_trees = os.path.join(root, grid["gene_trees"].format(rep=rep))
+    null_dir = os.path.join(root, grid["null_dir"].format(rep=rep))
+    cmd = [
+        sys.executable, "compute_null_dist.py",
+        "-i", species_tree, "-g", gene_trees, "-o", null_dir, "-t", "1",
+        "-n", str(grid.get("num_genes", 3000)), "-s", str(seed_of(grid["null_dir"], rep)),
+    ]
+    if grid.get("adaptive"):
+        cmd.append("--adaptive")
+    outputs = [os.path.join(null_dir, name) for name in ("labelled_cu_tree.tree", "nullDist.tsv", "nameMap.tsv")]
+    return task(f"null:{grid['null_dir'].format(rep=rep)}", cmd, [species_tree, gene_trees], outputs)
+
+
+def event_params(grid, root, rep):
+    """Parameters of every event of replicate ``rep`` in a grid."""
+    if grid["simulator"] == "introgression":
+        pairs = read_pairs(os.path.join(root, grid["pairs"].format(rep=rep)))
+        for p, b, (recipient, donor) in itertools.product(grid["p"], grid["b"], pairs):
+            yield {"p": p, "b": b, "donor": donor, "recipient": recipient, "rep": rep}
+    elif grid["simulator"] == "recombination":
+        for p, r, option in itertools.product(grid["p"], grid["r"], grid.get("option", ["fixed"])):
+            yield {"p": p, "r": r, "option": option, "rep": rep}
+    else:
+        for p, r in itertools.product(grid["p"], grid["r"]):
+            yield {"p": p, "r": r, "rep": rep}
+
+
+def event_row(grid, params):
+    """Options of one event in the --events table of its simulator."""
+    if grid["simulator"] == "introgression":
+        return {"discordant_portion": params["p"], "num_blocks": params["b"], "recipient": params["recipient"], "donor": params["donor"]}
+    elif grid["simulator"] == "recombination":
+        return {"discordant_portion": params["p"], "rate": params["r"], "option": params["option"]}
+    return {"discordant_portion": params["p"], "rate": params["r"]}
+
+
+def events_table(rows):
+    header = list(rows[0])
+    return ["\t".join(header)] + ["\t".join(str(row[k]) for k in header) for row in rows]
+
+
+def simulate_cmd(grid, root, rep, events_file):
+    # one process simulates every event of a replicate from a single load of its inputs
+    gene_trees = os.path.join(root, grid["gene_trees"].format(rep=rep))
+    if grid["simulator"] == "introgression":
+        species_tree = os.path.join(root, grid["species_tree"].format(rep=rep))
+        inputs = [species_tree, gene_trees]
+        cmd = ["simulate_introgression.py", "-s", species_tree, "-g", gene_trees]
+    elif grid["simulator"] == "recombination":
+        inputs = [gene_trees]
+        cmd = ["simulate_recombination_supression.py", "-g", gene_trees]
+    else:
+        discordant = os.path.join(root, grid["discordant_gene_trees"].format(rep=rep))
+        inputs = [gene_trees, discordant]
+        cmd = ["simulate_mixture_condition.py", "-x", gene_trees, "-y", discordant]
+    cmd = [sys.executable, *cmd, "-e", events_file]
+    if grid.get("overlay"):
+        cmd.append("--overlay")
+    if grid.get("compress"):
+        cmd += ["--compress", grid["compress"]]
+    return cmd, inputs + [events_file]
+
+
+def build_tasks(grids, root, num_threads):
+    """Tasks of the sweep DAG: null distribution -> events -> QQS -> p-values, Phlag -> metrics.
+
+    The events of a replicate are simulated by one task. Returns the tasks by id and
+    the generated files (event lists and event tables) with their lines.
+    """
+    tasks, manifests = {}, {}
+    for grid in grids:
+        condition = grid["condition"]
+        events, predictions = [], []
+        for rep in range(1, grid["replicates"] + 1):
+            null = null_task(grid, root, rep)
+            if tasks.setdefault(null["id"], null) != null:
+                # grids may share a null distribution, but only if they build it the same way
+                raise ValueError(
+                    f"{null['id']} is defined twice with different commands:\n"
+                    f"  {shlex.join(tasks[null['id']]['cmd'])}\n  {shlex.join(null['cmd'])}"
+                )
+            cu_tree, null_dist, name_map = null["outputs"]
+            events_file = os.path.join(root, grid["output_dir"], f"events-{rep}.tsv")
+            cmd, inputs = simulate_cmd(grid, root, rep, events_file)
+            sim = task(f"simulate:{grid['output_dir']}:{rep}", cmd, inputs, [])
+            rows = []
+            for params in event_params(grid, root, rep):
+                name = grid["event_name"].format(**{k: lbl(v) for k, v in params.items()})
+                rel_dir = os.path.join(grid["output_dir"], name)
+                event_dir = os.path.join(root, rel_dir)
+                events.append(rel_dir)
+
+                rows.append(dict(event_row(grid, params), output_dir=event_dir, seed=seed_of(condition, name)))
+                if grid.get("overlay"):
+                    emission = os.path.join(event_dir, "emission.overlay")
+                else:
+                    emission = os.path.join(event_dir, output_name("emission.gtrees", grid.get("compress")))
+                sim["outputs"] += [os.path.join(event_dir, "info.txt"), emission]
+
+                emissions = os.path.join(event_dir, "emissionsQQS.tsv")
+                cmd = [sys.executable, "compute_qqs.py", "-s", cu_tree, "-g", emission, "-o", emissions]
+                qqs = task(f"qqs:{rel_dir}", cmd, [cu_tree, emission], [emissions], [sim["id"], null["id"]])
+                pvalues = os.path.join(event_dir, "pvalues.npz")
+                cmd = [sys.executable, "compute_pvalues.py", "-e", emissions, "-n", null_dist, "-o", pvalues]
+                pv = task(f"pvalues:{rel_dir}", cmd, [emissions, null_dist], [pvalues], [qqs["id"]])
+                tasks.update({qqs["id"]: qqs, pv["id"]: pv})
+
+                if grid.get("phlag"):
+                    prediction = os.path.join(event_dir, grid.get("prediction", "phlag.txt"))
+                    cmd = shlex.split(
+                        grid["phlag"].format(
+                            emissions=emissions,
+                            null_dist=null_dist,
+                            name_map=name_map,
+                            species_tree=cu_tree,
+                            event_dir=event_dir,
+                            output=prediction,
+                            threads=num_threads,
+                        )
+                    )
+                    phlag = task(f"phlag:{rel_dir}", cmd, [emissions, null_dist, name_map], [prediction], [qqs["id"]])
+                    tasks[phlag["id"]] = phlag
+                    predictions.append(phlag["id"])
+            if rows:
+                tasks[sim["id"]] = sim
+                manifests[events_file] = events_table(rows)
+
+        manifest = os.path.join(root, f"list-{condition}.txt")
+        manifests[manifest] = events
+        if predictions:
+            output = os.path.join(root, f"metrics-{condition}.tsv")
+            summary = os.path.join(root, f"metrics-{condition}-summary.tsv")
+            cmd = [
+                sys.executable, "compute_metrics.py", "-l", manifest, "--root-dir", root,
+                "-x", grid.get("prediction", "phlag.txt"), "--method", "phlag",
+                "-t", "1", "-o", output, "--summary", summary,
+            ]
+            inputs = [manifest] + [p for tid in predictions for p in tasks[tid]["outputs"]]
+            metrics = task(f"metrics:{condition}", cmd, inputs, [output, summary], predictions)
+            tasks[metrics["id"]] = metrics
+    return tasks, manifests
+
+
+def write_manifests(manifests):
+    for manifest, events in manifests.items():
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        content = "".join(f"{e}\n" for e in events)
+        if os.path.exists(manifest):
+            with open(manifest, "r") as f:
+                if f.read() == content:
+                    continue
+        with open(manifest, "w") as f:
+            f.write(content)
+
+
+def stamp_path(root, tid):
+    return os.path.join(root, STATE_DIR, hashlib.sha256(tid.encode()).hexdigest() + ".json")
+
+
+def log_path(root, tid):
+    return os.path.join(root, STATE_DIR, "logs", hashlib.sha256(tid.encode()).hexdigest() + ".log")
+
+
+# checksums by (path, mtime, size): the shared gene tree and null files of a run are hashed once
+CHECKSUMS = {}
+
+
+def checksum(path):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in CHECKSUMS:
+        with stage("checksum"):
+            CHECKSUMS[key] = file_checksum(path)
+    return CHECKSUMS[key]
+
+
+def checksums(paths):
+    return {p: checksum(p) if os.path.isfile(p) else None for p in paths}
+
+
+def is_up_to_date(root, t):
+    # the same command already produced the current outputs from the current inputs
+    try:
+        with open(stamp_path(root, t["id"]), "r") as f:
+            stamp = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return (
+        stamp["cmd"] == t["cmd"]
+        and stamp["inputs"] == checksums(t["inputs"])
+        and None not in stamp["outputs"].values()
+        and stamp["outputs"] == checksums(t["outputs"])
+    )
+
+
+def write_stamp(root, t):
+    stamp = {"id": t["id"], "cmd": t["cmd"], "inputs": checksums(t["inputs"]), "outputs": checksums(t["outputs"])}
+    with open(stamp_path(root, t["id"]) + ".tmp", "w") as f:
+        json.dump(stamp, f, indent=1)
+    os.replace(stamp_path(root, t["id"]) + ".tmp", stamp_path(root, t["id"]))
+
+
+def run_command(cmd, log_file):
+    with open(log_file, "w") as log:
+        return subprocess.run(cmd, cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def run_dag(tasks, root, num_workers, force=False, dry_run=False):
+    """Run the tasks once their dependencies are done, skipping the ones up to date.
+
+    A failed task only fails the tasks depending on it. Returns the failed task ids.
+    """
+    os.makedirs(os.path.join(root, STATE_DIR, "logs"), exist_ok=True)
+    pending = dict(tasks)
+    done, failed = set(), set()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        running = {}
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for tid, t in list(pending.items()):
+                    if any(d in failed for d in t["deps"]):
+                        print(f"skipped (failed dependency)\t{tid}", file=sys.stderr)
+                        failed.add(tid)
+                    elif all(d in done for d in t["deps"]):
+                        if not force and is_up_to_date(root, t):
+                            done.add(tid)
+                        elif dry_run:
+                            print(f"would run\t{tid}\t{shlex.join(t['cmd'])}")
+                            done.add(tid)
+                        else:
+                            log_file = log_path(root, tid)
+                            running[executor.submit(run_command, t["cmd"], log_file)] = (tid, log_file)
+                            print(f"started\t{tid}", file=sys.stderr)
+                    else:
+                        continue
+                    del pending[tid]
+                    progressed = True
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tid, log_file = running.pop(future)
+                t = tasks[tid]
+                if future.result() == 0 and all(os.path.isfile(p) for p in t["outputs"]):
+                    write_stamp(root, t)
+                    done.add(tid)
+                    print(f"done\t{tid}", file=sys.stderr)
+                else:
+                    failed.add(tid)
+                    print(f"failed\t{tid}\t(see {log_file})", file=sys.stderr)
+    return failed
+
+
+def read_grids(grid_files, conditions=None):
+    grids = []
+    for grid_file in grid_files:
+        with open(grid_file, "r") as f:
+            grid = json.load(f)
+        grids.extend(grid if isinstance(grid, list) else [grid])
+    if conditions:
+        grids = [g for g in grids if g["condition"] in conditions]
+    return grids
+
+
+def main(args):
+    root = os.path.abspath(args.root_dir)
+    # the tasks run in their own processes (with their own --profile); this covers the scheduler
+    profiling.setup(args, os.path.join(root, STATE_DIR))
+    with stage("plan"):
+        tasks, manifests = build_tasks(read_grids(args.grids, args.condition), root, args.num_threads)
+        write_manifests(manifests)
+    with stage("run"):
+        failed = run_dag(tasks, root, args.num_threads, args.force, args.dry_run)
+    if failed:
+        print(f"{len(failed)} of {len(tasks)} tasks failed or were skipped.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("grids", nargs="+", help="JSON sweep grids (one condition or a list of them).")
+    parser.add_argument("-c", "--condition", nargs="+", required=False, help="Only run these conditions of the grids.")
+    parser.add_argument(
+        "--root-dir", default=os.path.dirname(SCRIPTS_DIR), help="Directory the grid paths are relative to."
+    )
+    parser.add_argument("-t", "--num-threads", type=int, default=8, help="Number of tasks run at once.")
+    parser.add_argument("--force", action="store_true", help="Rerun tasks even if they are up to date.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the tasks that would run.")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+
+    main(args)
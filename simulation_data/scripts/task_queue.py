@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from sweep import build_tasks, is_up_to_date, log_path, read_grids, run_command, write_manifests, write_stamp
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    expires REAL
+);
+CREATE TABLE IF NOT EXISTS deps (task TEXT NOT NULL, dep TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+CREATE INDEX IF NOT EXISTS deps_task ON deps (task);
+"""
+
+READY = """
+SELECT id, task FROM tasks t WHERE state = 'pending' AND NOT EXISTS (
+    SELECT 1 FROM deps d JOIN tasks u ON u.id = d.dep WHERE d.task = t.id AND u.state != 'done'
+) LIMIT 1
+"""
+
+BLOCKED = """
+UPDATE tasks SET state = 'failed' WHERE state = 'pending' AND EXISTS (
+    SELECT 1 FROM deps d JOIN tasks u ON u.id = d.dep WHERE d.task = tasks.id AND u.state = 'failed'
+)
+"""
+
+
+# filesystems whose byte-range locks SQLite cannot rely on
+UNSAFE_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs")
+# seconds after which the lock directory of a worker that died inside a transaction is broken
+LOCK_STALE = 120.0
+
+
+def filesystem_type(path):
+    """Type of the filesystem holding ``path`` from /proc/mounts, None when unknown."""
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f:
+                fields = line.split()
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) > len(best):
+                    best, fs_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return fs_type
+
+
+@contextmanager
+def dir_lock(lock_dir, stale=LOCK_STALE):
+    """Hold ``lock_dir``, created with mkdir, which is atomic on NFS unlike fcntl locks.
+
+    A lock older than ``stale`` seconds belongs to a worker that died holding it
+    and is renamed away (only one of the workers breaking it wins the rename).
+    """
+    while True:
+        try:
+            os.mkdir(lock_dir)
+            break
+        except FileExistsError:
+            pass
+        try:
+            age = time.time() - os.stat(lock_dir).st_mtime
+        except FileNotFoundError:
+            continue
+        if age > stale:
+            broken = f"{lock_dir}.stale-{socket.gethostname()}-{os.getpid()}"
+            try:
+                os.rename(lock_dir, broken)
+                os.rmdir(broken)
+            except OSError:
+                pass
+            continue
+        time.sleep(random.uniform(0.01, 0.1))
+    try:
+        yield
+    finally:
+        try:
+            os.rmdir(lock_dir)
+        except FileNotFoundError:
+            pass
+
+
+class TaskQueue:
+    """Lease-based task queue in a SQLite file.
+
+    Workers lease a task whose dependencies are done and renew the lease while
+    it runs; leases of crashed workers expire and the task goes back to pending,
+    up to ``max_attempts`` times. Leases compare the clocks of the nodes, which
+    must agree to well within the lease.
+
+    On a local disk or a cluster filesystem with working POSIX locks (Lustre, GPFS)
+    SQLite locks the file itself. Those locks are unreliable over NFS, so there
+    (or with ``nfs=True``) every transaction runs under a lock directory next to
+    the file, on a connection opened after taking it and closed before releasing
+    it: NFS close-to-open consistency then shows each transaction the last one.
+    """
+
+    def __init__(self, path, lease=300.0, max_attempts=3, nfs=None):
+        if nfs is None:
+            nfs = filesystem_type(os.path.dirname(os.path.abspath(path))) in UNSAFE_FILESYSTEMS
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock_dir = path + ".lock.d" if nfs else None
+        self.conn = None if nfs else self.connect()
+        with self.locked() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        if self.lock_dir is None:
+            return sqlite3.connect(self.path, timeout=600, isolation_level=None)
+        # the lock directory serializes the workers, SQLite's own locks are off
+        return sqlite3.connect(f"file:{self.path}?nolock=1", uri=True, isolation_level=None)
+
+    @contextmanager
+    def locked(self):
+        if self.lock_dir is None:
+            yield self.conn
+            return
+        with dir_lock(self.lock_dir):
+            conn = self.connect()
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so two workers never lease the same task
+        with self.locked() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, tasks, retry_failed=False):
+        """Add new tasks; tasks whose definition changed go back to pending with it, unless leased."""
+        with self.transaction() as conn:
+            for tid, t in tasks.items():
+                task = json.dumps(t)
+                row = conn.execute("SELECT task, state FROM tasks WHERE id = ?", (tid,)).fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO tasks (id, task) VALUES (?, ?)", (tid, task))
+                elif row[0] == task:
+                    continue
+                elif row[1] == "leased":
+                    print(f"Warning: {tid} changed while it runs, enqueue again once it is released", file=sys.stderr)
+                    continue
+                else:
+                    conn.execute("UPDATE tasks SET task = ?, state = 'pending', attempts = 0 WHERE id = ?", (task, tid))
+                    conn.execute("DELETE FROM deps WHERE task = ?", (tid,))
+                conn.executemany("INSERT INTO deps VALUES (?, ?)", [(tid, d) for d in t["deps"]])
+            if retry_failed:
+                conn.execute("UPDATE tasks SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+
+    def acquire(self, owner):
+        """Lease a ready task: (id, task), None when nothing is ready yet, or False when the queue is finished."""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL "
+                "WHERE state = 'leased' AND expires < ?",
+                (self.max_attempts, now),
+            )
+            while conn.execute(BLOCKED).rowcount:
+                pass
+            row = conn.execute(READY).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE tasks SET state = 'leased', owner = ?, expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    (owner, now + self.lease, row[0]),
+                )
+                result = (row[0], json.loads(row[1]))
+            else:
+                unfinished = conn.execute("SELECT 1 FROM tasks WHERE state IN ('pending', 'leased') LIMIT 1").fetchone()
+                result = None if unfinished else False
+        return result
+
+    def heartbeat(self, tid, owner):
+        with self.locked() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET expires = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (time.time() + self.lease, tid, owner),
+            )
+            return cur.rowcount > 0
+
+    def release(self, tid, owner, ok):
+        with self.locked() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = ?, owner = NULL WHERE id = ? AND owner = ? AND state = 'leased'",
+                ("done" if ok else "failed", tid, owner),
+            )
+
+    def status(self):
+        with self.locked() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+
+def keep_alive(queue_file, lease, tid, owner, stop, nfs=None):
+    queue = TaskQueue(queue_file, lease, nfs=nfs)
+    while not stop.wait(lease / 3):
+        if not queue.heartbeat(tid, owner):
+            break
+
+
+def work(queue_file, root, lease, max_attempts, poll=5.0, nfs=None):
+    """Worker loop: lease, run and release tasks until the queue is finished."""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    queue = TaskQueue(queue_file, lease, max_attempts, nfs)
+    os.makedirs(os.path.dirname(log_path(root, "")), exist_ok=True)
+    num_done = 0
+    while True:
+        leased = queue.acquire(owner)
+        if leased is False:
+            return num_done
+        if leased is None:
+            time.sleep(poll)
+            continue
+        tid, t = leased
+        if is_up_to_date(root, t):
+            queue.release(tid, owner, True)
+            continue
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(queue_file, lease, tid, owner, stop, nfs), daemon=True)
+        heartbeat.start()
+        try:
+            ok = run_command(t["cmd"], log_path(root, tid)) == 0 and all(os.path.isfile(p) for p in t["outputs"])
+        finally:
+            stop.set()
+            heartbeat.join()
+        if ok:
+            write_stamp(root, t)
+        queue.release(tid, owner, ok)
+        num_done += 1
+        print(f"{'done' if ok else 'failed'}\t{tid}\t{owner}", file=sys.stderr)
+
+
+def main(args):
+    root = os.path.abspath(args.root_dir)
+    if args.command == "enqueue":
+        tasks, manifests = build_tasks(read_grids(args.grids, args.condition), root, 1)
+        write_manifests(manifests)
+        TaskQueue(args.queue, nfs=args.nfs).enqueue(tasks, args.retry_failed)
+    elif args.command == "worker":
+        with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+            futures = [
+                executor.submit(work, args.queue, root, args.lease, args.max_attempts, args.poll, args.nfs)
+                for _ in range(args.num_workers)
+            ]
+            print(f"{sum(f.result() for f in futures)} tasks run on {socket.gethostname()}.", file=sys.stderr)
+    if args.command in ("enqueue", "status"):
+        status = TaskQueue(args.queue, nfs=args.nfs).status()
+        print("\t".join(f"{k}: {status.get(k, 0)}" for k in ("pending", "leased", "done", "failed")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("queue", help="SQLite queue file in a directory shared by the workers (local disk, NFS, Lustre, ...).")
+    parser.add_argument(
+        "--nfs",
+        action="store_true",
+        default=None,
+        help="Serialize the workers with a lock directory, as done on NFS, on a filesystem not detected as NFS "
+        "but without reliable POSIX locks. [detected from /proc/mounts]",
+    )
+    parser.add_argument(
+        "--root-dir",
+        default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        help="Directory the grid paths are relative to.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_enqueue = subparsers.add_parser("enqueue", help="Add the tasks of sweep grids to the queue.")
+    parser_enqueue.add_argument("grids", nargs="+", help="JSON sweep grids.")
+    parser_enqueue.add_argument("-c", "--condition", nargs="+", required=False, help="Only these conditions.")
+    parser_enqueue.add_argument("--retry-failed", action="store_true", help="Put failed tasks back to pending.")
+    parser_worker = subparsers.add_parser("worker", help="Run tasks from the queue until it is finished.")
+    parser_worker.add_argument("-t", "--num-workers", type=int, default=8, help="Worker processes on this node.")
+    parser_worker.add_argument("--lease", type=float, default=300.0, help="Lease duration in seconds.")
+    parser_worker.add_argument("--max-attempts", type=int, default=3, help="Leases of a task before it fails.")
+    parser_worker.add_argument("--poll", type=float, default=5.0, help="Seconds between polls when no task is ready.")
+    subparsers.add_parser("status", help="Count the tasks by state.")
+    args = parser.parse_args()
+
+    main(args)
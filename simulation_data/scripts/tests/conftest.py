@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import each other by module name, as when they are run from their directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
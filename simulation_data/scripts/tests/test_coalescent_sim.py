@@ -0,0 +1,46 @@
+import random
+import numpy as np
+import treeswift as ts
+
+from coalescent_sim import simulate_newick
+from simulate_gene_trees import gene_tree_newick, get_contained_species_tree, simulate_gene_trees
+
+SPECIES_TREE = "((A:0.4,B:0.4):0.3,(C:0.2,D:0.2):0.5);"
+NUM_GENES = 3000
+
+
+def quartet_and_height(newick):
+    """Unrooted topology (the cherry holding A) and root height of a 4-taxon gene tree."""
+    tree = ts.read_tree_newick(newick)
+    split = None
+    for nd in tree.traverse_internal():
+        leaves = {leaf.get_label() for leaf in nd.traverse_leaves()}
+        if len(leaves) == 2:
+            split = leaves if "A" in leaves else {"A", "B", "C", "D"} - leaves
+    height = max(d for _, d in tree.distances_from_root(internal=False))
+    return "".join(sorted(split)), height
+
+
+def summarize(newicks):
+    rows = [quartet_and_height(nwk) for nwk in newicks]
+    topologies = [t for t, _ in rows]
+    freq = {t: topologies.count(t) / len(rows) for t in ("AB", "AC", "AD")}
+    return freq, np.array([h for _, h in rows])
+
+
+def test_numpy_engine_matches_dendropy():
+    species_tree = ts.read_tree_newick(SPECIES_TREE)
+    numpy_freq, numpy_heights = summarize(simulate_newick(species_tree, NUM_GENES, np.random.default_rng(1)))
+    contained = get_contained_species_tree(species_tree)
+    dendropy_freq, dendropy_heights = summarize(
+        gene_tree_newick(gt) for gt in simulate_gene_trees(*contained, NUM_GENES, rng=random.Random(1))
+    )
+    # topology frequencies within ~4 standard errors of a binomial proportion
+    for t in numpy_freq:
+        assert abs(numpy_freq[t] - dendropy_freq[t]) < 4 * np.sqrt(0.25 * 2 / NUM_GENES), (numpy_freq, dendropy_freq)
+    # the matching topology is the most frequent: 1 - 2/3 exp(-0.3) plus the deep coalescences
+    assert numpy_freq["AB"] > 0.5
+    # mean and variance of the time to the most recent common ancestor
+    se = np.sqrt(numpy_heights.var() / NUM_GENES + dendropy_heights.var() / NUM_GENES)
+    assert abs(numpy_heights.mean() - dendropy_heights.mean()) < 4 * se
+    assert abs(numpy_heights.var() / dendropy_heights.var() - 1) < 0.15
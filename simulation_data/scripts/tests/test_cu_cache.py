@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cu_cache import fetch
+from simulate_gene_trees import get_cu_tree
+
+# stand-in for astral4_coalescent_unit: copies the -c tree to -o and counts its runs
+STUB_ASTRAL = f"""#!{sys.executable}
+import os, sys
+argv = sys.argv[1:]
+args = {{flag: argv[argv.index(flag) + 1] for flag in ("-c", "-o")}}
+with open(args["-c"]) as f, open(args["-o"], "w") as out:
+    out.write(f.read())
+with open(os.environ["STUB_RUNS"], "a") as f:
+    f.write("run\\n")
+"""
+
+
+def runs(path):
+    return sum(1 for _ in open(path)) if os.path.exists(path) else 0
+
+
+def stub_astral(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub = bin_dir / "astral4_coalescent_unit"
+    stub.write_text(STUB_ASTRAL)
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_RUNS", str(tmp_path / "runs.txt"))
+    return tmp_path / "runs.txt"
+
+
+def test_get_cu_tree_hit_and_miss(tmp_path, monkeypatch):
+    runs_file = stub_astral(tmp_path, monkeypatch)
+    species_tree = tmp_path / "species.tree"
+    species_tree.write_text("((A:1,B:1)I0:1,(C:1,D:1)I1:1)I2;\n")
+    gene_trees = tmp_path / "genes.gtrees"
+    gene_trees.write_text("((A,B),(C,D));\n")
+    cache_dir = tmp_path / "cache"
+    for i in range(2):
+        outdir = tmp_path / f"out{i}"
+        outdir.mkdir()
+        tree = get_cu_tree(str(species_tree), str(gene_trees), str(outdir), 1, str(cache_dir))
+        assert sorted(leaf.label for leaf in tree.traverse_leaves()) == ["A", "B", "C", "D"]
+        assert (outdir / "cu_tree.tree").exists()
+    assert runs(runs_file) == 1
+    # other inputs are a miss
+    gene_trees.write_text("((A,C),(B,D));\n")
+    get_cu_tree(str(species_tree), str(gene_trees), str(tmp_path / "out0"), 1, str(cache_dir))
+    assert runs(runs_file) == 2
+
+
+def write_entry(size):
+    def build(d):
+        with open(os.path.join(d, "cu_tree.tree"), "w") as f:
+            f.write("x" * size)
+    return build
+
+
+def test_fetch_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    for age, key in enumerate(["a", "b"]):
+        with fetch(cache_dir, key, write_entry(100), 1000):
+            pass
+        os.utime(os.path.join(cache_dir, key), (age, age))
+    # a hit refreshes the entry, so b is now the least recently used
+    with fetch(cache_dir, "a", write_entry(100), 1000):
+        pass
+    with fetch(cache_dir, "c", write_entry(100), 250):
+        pass
+    # the lock file of an evicted entry goes with it
+    assert sorted(os.listdir(cache_dir)) == ["a", "a.lock", "c", "c.lock"]
+
+
+def test_evict_removes_lock_of_failed_build(tmp_path):
+    cache_dir = str(tmp_path)
+
+    def failing_build(d):
+        raise RuntimeError("astral4 failed")
+
+    try:
+        with fetch(cache_dir, "a", failing_build, 1000):
+            pass
+    except RuntimeError:
+        pass
+    assert os.listdir(cache_dir) == ["a.lock"]
+    with fetch(cache_dir, "b", write_entry(100), 1000):
+        pass
+    assert sorted(os.listdir(cache_dir)) == ["b", "b.lock"]
+
+
+def slow_build(runs_file):
+    def build(d):
+        with open(runs_file, "a") as f:
+            f.write("run\n")
+        time.sleep(0.2)
+        with open(os.path.join(d, "cu_tree.tree"), "w") as f:
+            f.write("(A,B);\n")
+    return build
+
+
+def fetch_once(cache_dir, runs_file):
+    with fetch(cache_dir, "key", slow_build(runs_file), 1 << 20) as entry:
+        with open(os.path.join(entry, "cu_tree.tree")) as f:
+            return f.read()
+
+
+def test_concurrent_fetch_builds_once(tmp_path):
+    cache_dir, runs_file = str(tmp_path / "cache"), str(tmp_path / "runs.txt")
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        trees = list(executor.map(fetch_once, [cache_dir] * 8, [runs_file] * 8))
+    assert trees == ["(A,B);\n"] * 8
+    assert runs(runs_file) == 1
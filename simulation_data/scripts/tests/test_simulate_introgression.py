@@ -0,0 +1,52 @@
+import random
+import treeswift as ts
+
+from simulate_introgression import switch_taxa
+
+PLAIN = [f"T{i}" for i in range(12)]
+QUOTED = ["'a b'", "'it''s'", "'x,y'", "'(p)'"]
+
+
+def random_newick(rng):
+    """Random rooted newick with plain and quoted leaf labels, supports, comments and varied lengths."""
+    leaves = rng.sample(PLAIN, rng.randint(2, 8)) + rng.sample(QUOTED, rng.randint(0, 2))
+    nodes = [f"{lbl}:{rng.choice(['1', '0.5', '2.125e-06', repr(rng.random())])}" for lbl in leaves]
+    while len(nodes) > 1:
+        a, b = (nodes.pop(rng.randrange(len(nodes))) for _ in range(2))
+        support = rng.choice(["", "0.95", "100"])
+        comment = rng.choice(["", "[&c=1]"])
+        nodes.append(f"({a},{b}){support}{comment}:{rng.random()!r}")
+    return nodes[0].rsplit(":", 1)[0] + ";", leaves
+
+
+def unquoted(label):
+    # what treeswift makes of a label: the quotes are dropped
+    return label.replace("'", "")
+
+
+def relabelled(newick, recipient, donor):
+    """The swap done on a treeswift tree, as before the span-based switch."""
+    tree = ts.read_tree_newick(newick)
+    lbl2node = tree.label_to_node(selection="leaves")
+    lbl2node[unquoted(recipient)].label, lbl2node[unquoted(donor)].label = unquoted(donor), unquoted(recipient)
+    return tree.newick()
+
+
+def name(label):
+    return label[1:-1].replace("''", "'") if label[:1] == "'" else label
+
+
+def test_switch_taxa_matches_treeswift_relabel():
+    rng = random.Random(0)
+    for _ in range(500):
+        newick, leaves = random_newick(rng)
+        recipient, donor = rng.sample(leaves, 2)
+        switched = switch_taxa(newick, name(recipient), name(donor))
+        assert ts.read_tree_newick(switched).newick() == relabelled(newick, recipient, donor), newick
+        # only the two label tokens move: swapping back restores the input byte for byte
+        assert switch_taxa(switched, name(recipient), name(donor)) == newick
+
+
+def test_switch_taxa_same_taxon_is_unchanged():
+    newick = "((A:1,B:2)0.9:1,(C:1,D:1):2);"
+    assert switch_taxa(newick, "A", "A") == newick
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from task_queue import LOCK_STALE, TaskQueue, work
+
+# appends its id to the runs file and writes its output, after its dependencies
+RUN = "import sys; open(sys.argv[1], 'a').write(sys.argv[2] + '\\n'); open(sys.argv[3], 'w').write('ok')"
+
+
+def make_tasks(tmp_path, n):
+    runs = tmp_path / "runs.txt"
+    tasks = {}
+    for i in range(n):
+        tid = f"t{i}"
+        output = str(tmp_path / f"{tid}.out")
+        deps = [f"t{i // 2}"] if i else []
+        tasks[tid] = {"id": tid, "cmd": [sys.executable, "-c", RUN, str(runs), tid, output], "inputs": [], "outputs": [output], "deps": deps}
+    return tasks, runs
+
+
+@pytest.mark.parametrize("nfs", [False, True])
+def test_workers_run_every_task_once(tmp_path, nfs):
+    tasks, runs = make_tasks(tmp_path, 20)
+    queue_file = str(tmp_path / "queue.db")
+    TaskQueue(queue_file, nfs=nfs).enqueue(tasks)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(work, queue_file, str(tmp_path), 30.0, 3, 0.05, nfs) for _ in range(4)]
+        assert sum(f.result() for f in futures) == 20
+    order = runs.read_text().split()
+    assert sorted(order) == sorted(tasks)
+    for tid, t in tasks.items():
+        assert all(order.index(d) < order.index(tid) for d in t["deps"])
+    assert TaskQueue(queue_file, nfs=nfs).status() == {"done": 20}
+
+
+def test_stale_lock_dir_is_broken(tmp_path):
+    queue_file = str(tmp_path / "queue.db")
+    queue = TaskQueue(queue_file, nfs=True)
+    # left behind by a worker that died inside a transaction
+    os.mkdir(queue_file + ".lock.d")
+    old = time.time() - 2 * LOCK_STALE
+    os.utime(queue_file + ".lock.d", (old, old))
+    assert queue.status() == {}
+    assert not os.path.exists(queue_file + ".lock.d")
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    tasks, _ = make_tasks(tmp_path, 1)
+    queue = TaskQueue(str(tmp_path / "queue.db"), lease=0.2, max_attempts=2)
+    queue.enqueue(tasks)
+    tid, _ = queue.acquire("crashed")
+    assert queue.acquire("other") is None
+    time.sleep(0.3)
+    # the lease of the crashed worker expired: the task is leased again and its release is ignored
+    assert queue.acquire("other")[0] == tid
+    queue.release(tid, "crashed", False)
+    assert queue.status() == {"leased": 1}
+    time.sleep(0.3)
+    # after max_attempts expired leases the task fails
+    assert queue.acquire("third") is False
+    assert queue.status() == {"failed": 1}
+
+
+def test_enqueue_updates_changed_tasks(tmp_path):
+    tasks, _ = make_tasks(tmp_path, 2)
+    queue = TaskQueue(str(tmp_path / "queue.db"))
+    queue.enqueue(tasks)
+    tid, _ = queue.acquire("worker")
+    queue.release(tid, "worker", True)
+    changed = {k: dict(t, cmd=t["cmd"] + ["--changed"]) for k, t in tasks.items()}
+    queue.enqueue(changed)
+    assert queue.status() == {"pending": 2}
+    tid, t = queue.acquire("worker")
+    assert t["cmd"][-1] == "--changed"
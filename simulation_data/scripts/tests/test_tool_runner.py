@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+from tool_runner import ToolError, ToolNotFoundError, run
+
+# stand-in for an external tool: `stub MODE OUT` writes OUT after acting out MODE
+STUB_TOOL = f"""#!{sys.executable}
+import os, sys, time
+mode, out = sys.argv[1:]
+if mode == "sleep":
+    time.sleep(10)
+elif mode == "flaky":
+    # fails on its first run only
+    if not os.path.exists(os.environ["STUB_RUNS"]):
+        open(os.environ["STUB_RUNS"], "w").close()
+        sys.exit("first run fails")
+elif mode == "progress":
+    # tqdm-style progress: \\r-separated redraws of one line, far over 64 KiB
+    for i in range(3000):
+        sys.stderr.write(f"\\r{{i}}/3000 " + "#" * 60)
+    sys.stderr.flush()
+elif mode == "fail":
+    sys.stderr.write("\\r" + "x" * 100000 + "\\nbad input\\n")
+    sys.exit(2)
+print("done")
+with open(out, "w") as f:
+    f.write(mode)
+"""
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    path = bin_dir / "stub"
+    path.write_text(STUB_TOOL)
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_RUNS", str(tmp_path / "runs"))
+    return tmp_path
+
+
+def test_outputs_and_parsed_stdout(stub):
+    dest = stub / "out" / "result.txt"
+    parsed = run(["stub", "ok", "{scratch}/result.txt"], outputs={"result.txt": dest}, parse=str.strip)
+    assert parsed == ["done"]
+    assert dest.read_text() == "ok"
+
+
+def test_timeout(stub):
+    with pytest.raises(ToolError, match="timed out"):
+        run(["stub", "sleep", "{scratch}/result.txt"], timeout=0.5)
+
+
+def test_retry(stub):
+    dest = stub / "result.txt"
+    with pytest.raises(ToolError, match="exit status 1"):
+        run(["stub", "flaky", "{scratch}/result.txt"], outputs={"result.txt": dest})
+    os.remove(stub / "runs")
+    run(["stub", "flaky", "{scratch}/result.txt"], outputs={"result.txt": dest}, retries=1)
+    assert dest.read_text() == "flaky"
+
+
+def test_missing_tool_is_not_retried(stub, capsys):
+    with pytest.raises(ToolNotFoundError):
+        run(["no-such-stub"], retries=3)
+    assert "Retrying" not in capsys.readouterr().err
+
+
+def test_long_stderr_lines(stub):
+    dest = stub / "result.txt"
+    run(["stub", "progress", "{scratch}/result.txt"], outputs={"result.txt": dest})
+    assert dest.read_text() == "progress"
+    with pytest.raises(ToolError) as e:
+        run(["stub", "fail", "{scratch}/result.txt"])
+    assert e.value.stderr.endswith("bad input\n")
@@ -0,0 +1,182 @@
+import os
+import sys
+import shlex
+import shutil
+import asyncio
+import tempfile
+import argparse
+
+
+# lines of stderr kept for the error of a failed call
+STDERR_TAIL = 20
+# bytes read from a pipe at once, and bytes of stderr kept to find those lines in
+CHUNK_SIZE = 1 << 16
+
+
+class ToolError(RuntimeError):
+    """Failure of an external tool, with the tail of its stderr."""
+
+    def __init__(self, cmd, reason, stderr=()):
+        self.cmd = list(cmd)
+        self.reason = reason
+        self.stderr = "".join(stderr)
+        message = f"{shlex.join(self.cmd)}: {reason}"
+        super().__init__(f"{message}\n{self.stderr.rstrip()}" if self.stderr.strip() else message)
+
+
+class ToolNotFoundError(ToolError):
+    """The executable of a tool is missing, which no retry can fix."""
+
+
+async def drain(stream, on_line):
+    # read in chunks rather than lines: StreamReader fails on lines over its limit,
+    # and tools write long lines (tqdm redraws its bar with \r, never a \n)
+    pending = b""
+    while chunk := await stream.read(CHUNK_SIZE):
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            on_line(line.decode(errors="replace") + "\n")
+    if pending:
+        on_line(pending.decode(errors="replace"))
+
+
+async def drain_tail(stream, tail):
+    # only the end of stderr is reported, so only the last CHUNK_SIZE bytes are kept
+    while chunk := await stream.read(CHUNK_SIZE):
+        tail[:] = (bytes(tail) + chunk)[-CHUNK_SIZE:]
+
+
+def tail_lines(tail):
+    lines = bytes(tail).decode(errors="replace").replace("\r", "\n").splitlines(keepends=True)
+    return [line for line in lines if line.strip()][-STDERR_TAIL:]
+
+
+async def attempt(cmd, scratch, outputs, parse, timeout, cwd, env):
+    args = [str(a).replace("{scratch}", scratch) for a in cmd]
+    stderr, parsed = bytearray(), []
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=cwd if cwd is not None else scratch,
+            env=dict(os.environ if env is None else env, TMPDIR=scratch),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if parse else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise ToolNotFoundError(cmd, f"'{cmd[0]}' not found in PATH") from None
+
+    def on_stdout(line):
+        value = parse(line)
+        if value is not None:
+            parsed.append(value)
+
+    # stdout and stderr are read together so that neither pipe fills up and blocks the tool
+    readers = [drain_tail(proc.stderr, stderr)] + ([drain(proc.stdout, on_stdout)] if parse else [])
+    try:
+        await asyncio.wait_for(asyncio.gather(*readers, proc.wait()), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise ToolError(cmd, f"timed out after {timeout}s", tail_lines(stderr)) from None
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise ToolError(cmd, f"exit status {proc.returncode}", tail_lines(stderr))
+    missing = [name for name in outputs if not os.path.exists(os.path.join(scratch, name))]
+    if missing:
+        raise ToolError(cmd, f"no {', '.join(missing)} written", tail_lines(stderr))
+    return parsed
+
+
+async def run_async(cmd, outputs=None, parse=None, timeout=None, retries=0, cwd=None, env=None, scratch_root=None):
+    """Run ``cmd`` in a private scratch directory and return the parsed lines of its stdout.
+
+    ``{scratch}`` in the arguments is replaced by the scratch directory, which is
+    also the working directory (unless ``cwd`` is given) and $TMPDIR of the tool,
+    so concurrent calls never share files. ``outputs`` maps files written in the
+    scratch directory to their destinations, which are only replaced when the call
+    succeeds. ``parse`` is applied to each line of stdout while the tool runs and
+    its non-None values are returned. Failed calls are retried ``retries`` times
+    and then raise a ToolError; a missing executable (ToolNotFoundError) is not retried.
+    """
+    outputs = outputs or {}
+    for i in range(retries + 1):
+        scratch = tempfile.mkdtemp(prefix=f"{os.path.basename(cmd[0])}-", dir=scratch_root)
+        try:
+            parsed = await attempt(cmd, scratch, outputs, parse, timeout, cwd, env)
+            for name, dest in outputs.items():
+                os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+                shutil.move(os.path.join(scratch, name), dest)
+            return parsed
+        except ToolError as e:
+            if i == retries or isinstance(e, ToolNotFoundError):
+                raise
+            print(f"Retrying ({i + 1}/{retries}) after {e.reason}: {shlex.join(e.cmd)}", file=sys.stderr)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+async def run_all_async(jobs, max_concurrency=None, return_exceptions=False):
+    """Results of ``run_async(**job)`` for every job, running at most ``max_concurrency`` at once."""
+    semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+
+    async def bounded(job):
+        async with semaphore:
+            return await run_async(**job)
+
+    return await asyncio.gather(*(bounded(job) for job in jobs), return_exceptions=return_exceptions)
+
+
+def run(cmd, **kwargs):
+    """Blocking ``run_async``."""
+    return asyncio.run(run_async(cmd, **kwargs))
+
+
+def run_all(jobs, max_concurrency=None, return_exceptions=False):
+    """Blocking ``run_all_async``."""
+    return asyncio.run(run_all_async(jobs, max_concurrency, return_exceptions))
+
+
+def echo(line):
+    # stdout of the commands goes through as it comes, nothing is kept
+    sys.stdout.write(line)
+
+
+def main(args):
+    # like xargs -P, but each command gets its own $TMPDIR and failures are reported with their stderr
+    f = open(args.commands, "r") if args.commands != "-" else sys.stdin
+    with f:
+        cmds = [shlex.split(line) for line in f if line.strip() and not line.lstrip().startswith("#")]
+    jobs = [
+        {"cmd": cmd, "parse": echo, "timeout": args.timeout, "retries": args.retries, "cwd": None if args.isolate else os.getcwd()}
+        for cmd in cmds
+    ]
+    results = run_all(jobs, args.num_jobs, return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    for e in failed:
+        print(f"Error: {e}", file=sys.stderr)
+    print(f"{len(cmds) - len(failed)}/{len(cmds)} commands succeeded", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("commands", nargs="?", default="-", help="File with one command per line. [stdin]")
+    parser.add_argument("-j", "--num-jobs", type=int, default=os.cpu_count(), help="Commands run at once.")
+    parser.add_argument("--timeout", type=float, required=False, help="Seconds before a command is killed.")
+    parser.add_argument("--retries", type=int, default=0, help="Reruns of a failed command.")
+    parser.add_argument(
+        "--isolate",
+        action="store_true",
+        help="Run each command inside its scratch directory (relative paths then need to be absolute), "
+        "for tools writing fixed file names into their working directory.",
+    )
+    args = parser.parse_args()
+
+    main(args)